@@ -2,6 +2,7 @@
 import abc
 import os
 import logging
+import threading
 
 _logger = logging.getLogger(__name__)
 
@@ -12,13 +13,46 @@ class BackendException(Exception):
 
 class BackendResult:
 
-    def __init__(self, exitCode, runTime, oot, oom, userCpuTime=None, sysCpuTime=None):
+    def __init__(self, exitCode, runTime, oot, oom, userCpuTime=None, sysCpuTime=None,
+                 peakRss=None, minorPageFaults=None, majorPageFaults=None,
+                 voluntaryContextSwitches=None, involuntaryContextSwitches=None,
+                 blockReadBytes=None, blockWriteBytes=None, telemetryFile=None,
+                 memoryAccounting=None, peakMemoryUsage=None, logFile=None):
+        """
+          peakRss: Peak total resident set size in MiB of the process
+          tree. Backends that sample the process tree can miss short
+          lived peaks.
+          blockReadBytes, blockWriteBytes: Bytes the process tree caused
+          to be read from and written to storage.
+          telemetryFile: Path to the file written by a
+          ``Telemetry.TelemetryRecorder`` or None.
+          memoryAccounting: How the backend measured the memory usage of
+          the process tree when enforcing the memory limit (e.g. "pss").
+          peakMemoryUsage: Peak memory usage in MiB of the process tree
+          measured using ``memoryAccounting``.
+          logFile: Path the log was written to if it differs from the
+          path given to ``run()`` (e.g. because it was compressed).
+
+          The resource usage values are None if the backend could not
+          record them.
+        """
         self.exitCode = exitCode
         self.runTime = runTime
         self.outOfTime = oot
         self.outOfMemory = oom
         self.userCpuTime = userCpuTime
         self.sysCpuTime = sysCpuTime
+        self.peakRss = peakRss
+        self.minorPageFaults = minorPageFaults
+        self.majorPageFaults = majorPageFaults
+        self.voluntaryContextSwitches = voluntaryContextSwitches
+        self.involuntaryContextSwitches = involuntaryContextSwitches
+        self.blockReadBytes = blockReadBytes
+        self.blockWriteBytes = blockWriteBytes
+        self.telemetryFile = telemetryFile
+        self.memoryAccounting = memoryAccounting
+        self.peakMemoryUsage = peakMemoryUsage
+        self.logFile = logFile
 
         if not (isinstance(self.exitCode, int) or self.exitCode == None):
             msg = 'exitCode was expected to be an int or None but was a {}'.format(
@@ -50,6 +84,131 @@ class BackendResult:
                    ' {}'.format(self.sysCpuTime))
             _logger.error(msg)
             raise BackendException(msg)
+        if not (isinstance(self.peakRss, float) or self.peakRss == None):
+            msg = ('peakRss was expected to be a float or None but was'
+                   ' {}'.format(self.peakRss))
+            _logger.error(msg)
+            raise BackendException(msg)
+        if not (isinstance(self.telemetryFile, str) or self.telemetryFile == None):
+            msg = ('telemetryFile was expected to be a str or None but was'
+                   ' {}'.format(self.telemetryFile))
+            _logger.error(msg)
+            raise BackendException(msg)
+        if not (isinstance(self.memoryAccounting, str) or self.memoryAccounting == None):
+            msg = ('memoryAccounting was expected to be a str or None but was'
+                   ' {}'.format(self.memoryAccounting))
+            _logger.error(msg)
+            raise BackendException(msg)
+        if not (isinstance(self.logFile, str) or self.logFile == None):
+            msg = ('logFile was expected to be a str or None but was'
+                   ' {}'.format(self.logFile))
+            _logger.error(msg)
+            raise BackendException(msg)
+        if not (isinstance(self.peakMemoryUsage, float) or self.peakMemoryUsage == None):
+            msg = ('peakMemoryUsage was expected to be a float or None but was'
+                   ' {}'.format(self.peakMemoryUsage))
+            _logger.error(msg)
+            raise BackendException(msg)
+        for name in ['minorPageFaults', 'majorPageFaults', 'voluntaryContextSwitches',
+                     'involuntaryContextSwitches', 'blockReadBytes', 'blockWriteBytes']:
+            value = getattr(self, name)
+            if not ((isinstance(value, int) and value >= 0) or value == None):
+                msg = ('{} was expected to be an integer >= 0 or None but was'
+                       ' {}'.format(name, value))
+                _logger.error(msg)
+                raise BackendException(msg)
+
+
+def getProcessIOBytes(pid):
+    """
+      Returns a tuple ``(readBytes, writeBytes)`` of the bytes the process
+      with ``pid`` (and the children it has waited for) caused to be read
+      from and written to storage. These are read from ``/proc/<pid>/io``
+      which must be done before the process is reaped. Returns
+      ``(None, None)`` if they are not available.
+    """
+    counters = dict()
+    try:
+        with open('/proc/{}/io'.format(pid), 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                counters[key] = int(value)
+    except (OSError, ValueError) as e:
+        _logger.debug('Could not read I/O counters of PID {}: {}'.format(pid, e))
+    return (counters.get('read_bytes', None), counters.get('write_bytes', None))
+
+
+def getResourceUsageFromRUsage(rusage, ioBytes=(None, None)):
+    """
+      Convert the ``resource.struct_rusage`` returned by ``os.wait4()``
+      and the ``(readBytes, writeBytes)`` returned by
+      ``getProcessIOBytes()`` into keyword arguments for
+      ``BackendResult``.
+    """
+    return {
+        'userCpuTime': float(rusage.ru_utime),
+        'sysCpuTime': float(rusage.ru_stime),
+        # Linux reports this in KiB. It is the largest process rather
+        # than the whole tree so backends that sample the process tree
+        # replace it.
+        'peakRss': rusage.ru_maxrss / 1024.0,
+        'minorPageFaults': rusage.ru_minflt,
+        'majorPageFaults': rusage.ru_majflt,
+        'voluntaryContextSwitches': rusage.ru_nvcsw,
+        'involuntaryContextSwitches': rusage.ru_nivcsw,
+        'blockReadBytes': ioBytes[0],
+        'blockWriteBytes': ioBytes[1],
+    }
+
+
+def waitForProcess(popen, timeLimit, onTimeout):
+    """
+      Wait for the process started by the ``subprocess.Popen`` ``popen``
+      to exit. ``os.wait4()`` is used instead of ``popen.wait()`` so the
+      resource usage of the process and the descendants it waited for is
+      available.
+
+      If the process is still running after ``timeLimit`` seconds (zero
+      means no limit) ``onTimeout()`` is called from another thread and
+      it should kill the process.
+
+      Returns a tuple ``(exitCode, resourceUsage, timedOut)`` where
+      ``resourceUsage`` is keyword arguments for ``BackendResult``. As
+      with ``subprocess`` the exit code is ``-N`` if the process was
+      killed by signal ``N``.
+    """
+    lock = threading.Lock()
+    state = {'finished': False, 'timedOut': False}
+
+    def handleTimeout():
+        with lock:
+            if state['finished']:
+                return
+            state['timedOut'] = True
+        onTimeout()
+
+    timer = None
+    if timeLimit > 0:
+        timer = threading.Timer(timeLimit, handleTimeout)
+        timer.daemon = True
+        timer.start()
+    try:
+        # Wait without reaping so the I/O counters can still be read
+        os.waitid(os.P_PID, popen.pid, os.WEXITED | os.WNOWAIT)
+        ioBytes = getProcessIOBytes(popen.pid)
+        _, status, rusage = os.wait4(popen.pid, 0)
+    finally:
+        with lock:
+            state['finished'] = True
+        if timer is not None:
+            timer.cancel()
+    if os.WIFSIGNALED(status):
+        exitCode = -os.WTERMSIG(status)
+    else:
+        exitCode = os.WEXITSTATUS(status)
+    # The process has been reaped so stop `popen` from trying to reap it.
+    popen.returncode = exitCode
+    return (exitCode, getResourceUsageFromRUsage(rusage, ioBytes), state['timedOut'])
 
 
 class BackendBaseClass(metaclass=abc.ABCMeta):
@@ -134,6 +293,17 @@ class BackendBaseClass(metaclass=abc.ABCMeta):
     def name(self):
         pass
 
+    @property
+    def environmentIdentifier(self):
+        """
+          Returns a hashable value that identifies the environment programs
+          are run in (e.g. a Docker image ID). Backends that return the same
+          ``name`` and ``environmentIdentifier`` are assumed to give the same
+          result from ``checkToolExists()``. The default is the host
+          environment.
+        """
+        return None
+
     @abc.abstractmethod
     def run(self, cmdLine, logFilePath, envVars):
         """
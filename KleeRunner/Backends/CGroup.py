@@ -0,0 +1,414 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+"""
+Backend that runs programs directly on the host, with each run in its
+own cgroup v2 leaf. The kernel enforces the limits, so memory limits
+are not overshot between polls, and the cgroup gives exact CPU times
+and OOM kill counts for the whole process tree.
+"""
+from . BackendBase import *
+from .. import LogCapture
+from .. import Telemetry
+import errno
+import itertools
+import logging
+import os
+import pprint
+import signal
+import subprocess
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+# `cpu.max` period in microseconds
+_CPU_MAX_PERIOD = 100000
+
+
+class CGroupBackendException(BackendException):
+    pass
+
+
+def readCGroupKeyedFile(path):
+    """
+      Parse a flat keyed cgroup file (e.g. ``cpu.stat``) into a
+      dictionary mapping keys to integers.
+    """
+    values = dict()
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 2:
+                values[fields[0]] = int(fields[1])
+    return values
+
+
+def _sampleCGroup(cgroup, recorder, startTime, stopEvent):
+    """
+      Add samples of the processes in ``cgroup`` to ``recorder`` until
+      ``stopEvent`` is set.
+    """
+    pageSize = os.sysconf('SC_PAGE_SIZE')
+    lastTime = startTime
+    lastCpuTime = 0.0
+    while not stopEvent.wait(recorder.interval):
+        try:
+            with open(os.path.join(cgroup, 'cgroup.procs'), 'r') as f:
+                pids = f.read().split()
+            cpuTime = readCGroupKeyedFile(os.path.join(cgroup, 'cpu.stat'))['usage_usec'] / 1e6
+        except OSError:
+            # The cgroup has been removed
+            return
+        now = time.perf_counter()
+        rss = 0
+        openFiles = 0
+        for pid in pids:
+            try:
+                with open('/proc/{}/statm'.format(pid), 'r') as f:
+                    rss += int(f.read().split()[1]) * pageSize
+                openFiles += len(os.listdir('/proc/{}/fd'.format(pid)))
+            except OSError:
+                # The process exited
+                pass
+        recorder.addSample(
+            now - startTime,
+            rss / (2**20),
+            100.0 * (cpuTime - lastCpuTime) / (now - lastTime),
+            openFiles)
+        lastTime, lastCpuTime = now, cpuTime
+
+
+def _writeCGroupFile(path, value):
+    with open(path, 'w') as f:
+        f.write(value)
+
+
+def _setupCGroupRoot(root, controllers):
+    """
+      Check ``root`` can hold the cgroups for runs and enable
+      ``controllers`` for its children.
+    """
+    if not os.path.isdir(root):
+        raise CGroupBackendException(
+            'cgroup "{}" does not exist'.format(root))
+    with open(os.path.join(root, 'cgroup.controllers'), 'r') as f:
+        available = f.read().split()
+    missing = [c for c in controllers if c not in available]
+    if len(missing) > 0:
+        raise CGroupBackendException(
+            'cgroup "{}" does not have the controllers {}. The cgroup must be '
+            'delegated with these controllers'.format(root, missing))
+    with open(os.path.join(root, 'cgroup.subtree_control'), 'r') as f:
+        enabled = f.read().split()
+    toEnable = [c for c in controllers if c not in enabled]
+    if len(toEnable) == 0:
+        return
+    try:
+        _writeCGroupFile(
+            os.path.join(root, 'cgroup.subtree_control'),
+            ' '.join('+' + c for c in toEnable))
+    except OSError as e:
+        if e.errno == errno.EBUSY:
+            # cgroup v2 does not allow a non-root cgroup to contain
+            # processes and enable controllers for its children.
+            raise CGroupBackendException(
+                'Cannot enable controllers {} in cgroup "{}" because it contains '
+                'processes. Set "cgroup_root" to an empty cgroup'.format(toEnable, root))
+        raise CGroupBackendException(
+            'Failed to enable controllers {} in cgroup "{}": {}'.format(toEnable, root, e))
+
+
+class CGroupBackend(BackendBaseClass):
+    """
+      Runs programs on the host. Each run gets a new cgroup v2 leaf
+      below ``cgroup_root``. It has ``memory.max``, ``memory.swap.max``
+      and ``cpu.max`` set from the limits, and ``cpu.stat``,
+      ``memory.peak`` and ``memory.events`` are read when the run
+      finishes. The leaf is removed afterwards.
+    """
+    _leafCounter = itertools.count()
+
+    def __init__(self, hostProgramPath, workingDirectory, timeLimit, memoryLimit, stackLimit, ctx, **kwargs):
+        super().__init__(hostProgramPath, workingDirectory,
+                         timeLimit, memoryLimit, stackLimit, ctx, **kwargs)
+        self._process = None
+        self._cgroup = None
+        self._killLock = threading.Lock()
+
+        # This is required because the cgroup the runner is in can't be
+        # used. It contains processes (i.e. the runner) so controllers
+        # can't be enabled for its children.
+        self._cgroupRoot = kwargs.get('cgroup_root', None)
+        if self._cgroupRoot is None:
+            raise CGroupBackendException('"cgroup_root" must be specified')
+        if not (isinstance(self._cgroupRoot, str) and os.path.isabs(self._cgroupRoot)):
+            raise CGroupBackendException('"cgroup_root" must be an absolute path')
+
+        self._allowSwap = kwargs.get('allow_swap', False)
+        if not isinstance(self._allowSwap, bool):
+            raise CGroupBackendException('"allow_swap" must be a bool')
+
+        try:
+            self._telemetryInterval = Telemetry.getTelemetryInterval(self.name, kwargs)
+        except Telemetry.TelemetryException as e:
+            raise CGroupBackendException(e.msg)
+
+        try:
+            self._logCapture = LogCapture.getLogCaptureOptions(self.name, kwargs)
+        except LogCapture.LogCaptureException as e:
+            raise CGroupBackendException(e.msg)
+
+        self._cpuLimit = kwargs.get('cpu_limit', None)
+        if self._cpuLimit is not None:
+            if not (isinstance(self._cpuLimit, (int, float)) and self._cpuLimit > 0):
+                raise CGroupBackendException(
+                    '"cpu_limit" must be a number of CPUs greater than zero')
+
+        controllers = []
+        if self.memoryLimit > 0:
+            controllers.append('memory')
+        if self._cpuLimit is not None:
+            controllers.append('cpu')
+        # Only set up the root once for all backends sharing the context
+        self.ctx.memoize(
+            ('CGroupBackend.setupRoot', self._cgroupRoot, tuple(controllers)),
+            lambda: _setupCGroupRoot(self._cgroupRoot, controllers))
+
+    @property
+    def name(self):
+        return "CGroup"
+
+    def programPath(self):
+        # We run directly on the host so nothing special here
+        return self.hostProgramPath
+
+    def _createCGroup(self):
+        name = 'klee-runner-{}-{}'.format(os.getpid(), next(self._leafCounter))
+        path = os.path.join(self._cgroupRoot, name)
+        try:
+            os.mkdir(path)
+        except OSError as e:
+            raise CGroupBackendException(
+                'Failed to create cgroup "{}": {}'.format(path, e))
+        try:
+            if self.memoryLimit > 0:
+                _writeCGroupFile(
+                    os.path.join(path, 'memory.max'),
+                    str(self.memoryLimit * (2**20)))
+                swapMaxPath = os.path.join(path, 'memory.swap.max')
+                # `memory.swap.max` does not exist if the kernel does not
+                # account swap (e.g. there is no swap).
+                if not self._allowSwap and os.path.exists(swapMaxPath):
+                    _writeCGroupFile(swapMaxPath, '0')
+                # Kill the whole process tree if the limit is hit rather
+                # than leaving part of it running.
+                _writeCGroupFile(os.path.join(path, 'memory.oom.group'), '1')
+            if self._cpuLimit is not None:
+                _writeCGroupFile(
+                    os.path.join(path, 'cpu.max'),
+                    '{} {}'.format(int(self._cpuLimit * _CPU_MAX_PERIOD), _CPU_MAX_PERIOD))
+        except:
+            os.rmdir(path)
+            raise
+        return path
+
+    def _killCGroup(self, path):
+        """
+          Kill every process in the cgroup at ``path``.
+        """
+        try:
+            # Linux >= 5.14
+            _writeCGroupFile(os.path.join(path, 'cgroup.kill'), '1')
+            return
+        except FileNotFoundError:
+            pass
+        # Processes can fork whilst we kill them so repeat until the
+        # cgroup is empty.
+        while True:
+            with open(os.path.join(path, 'cgroup.procs'), 'r') as f:
+                pids = [int(l) for l in f.read().split()]
+            if len(pids) == 0:
+                return
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            time.sleep(0.01)
+
+    def _waitForEmptyCGroup(self, path, timeout=10.0):
+        # Processes that were killed might not have left the cgroup yet.
+        endTime = time.perf_counter() + timeout
+        while time.perf_counter() < endTime:
+            events = readCGroupKeyedFile(os.path.join(path, 'cgroup.events'))
+            if events.get('populated', 0) == 0:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def _removeCGroup(self, path):
+        if not self._waitForEmptyCGroup(path):
+            self._killCGroup(path)
+            self._waitForEmptyCGroup(path)
+        try:
+            os.rmdir(path)
+        except OSError as e:
+            _logger.error('Failed to remove cgroup "{}": {}'.format(path, e))
+
+    def kill(self):
+        with self._killLock:
+            if self._cgroup is not None:
+                self._killCGroup(self._cgroup)
+
+    def run(self, cmdLine, logFilePath, envVars):
+        _logger.info('Running:\n{}\nwith env:{}'.format(
+            pprint.pformat(cmdLine),
+            pprint.pformat(envVars)))
+
+        cgroup = self._createCGroup()
+        _logger.debug('Created cgroup "{}"'.format(cgroup))
+        exitCode = None
+        outOfTime = False
+        startTime = time.perf_counter()
+        procsFd = None
+        telemetry = None
+        telemetryFile = None
+        memoryAccounting = None
+        peakMemoryUsage = None
+        samplerThread = None
+        stopSampling = threading.Event()
+        try:
+            # The child moves itself into the cgroup before calling exec()
+            # so that every process it creates is accounted for.
+            procsFd = os.open(os.path.join(cgroup, 'cgroup.procs'), os.O_WRONLY)
+
+            def preExecFn():
+                os.write(procsFd, b'0')
+                if self.stackLimit != None:
+                    self._setStacksize()
+
+            if self.stackLimit != None:
+                _logger.info('Using stacksize limit: {} KiB'.format(
+                    'unlimited' if self.stackLimit == 0 else self.stackLimit))
+            with LogCapture.LogSink(logFilePath, self._logCapture) as logSink:
+                _logger.info('writing to log file {}'.format(logSink.path))
+                with self._killLock:
+                    self._process = subprocess.Popen(cmdLine,
+                                                     cwd=self.workingDirectory,
+                                                     stdout=logSink.stdout,
+                                                     stderr=logSink.stdout,
+                                                     env=envVars,
+                                                     preexec_fn=preExecFn)
+                    self._cgroup = cgroup
+                logSink.processStarted()
+                os.close(procsFd)
+                procsFd = None
+                if self._telemetryInterval is not None:
+                    telemetry = Telemetry.TelemetryRecorder(self._telemetryInterval)
+                    samplerThread = threading.Thread(
+                        target=_sampleCGroup,
+                        args=(cgroup, telemetry, startTime, stopSampling),
+                        name='telemetry-{}'.format(self._process.pid),
+                        daemon=True)
+                    samplerThread.start()
+                _logger.info(
+                    'Running with timeout of {} seconds'.format(self.timeLimit))
+                exitCode, resourceUsage, outOfTime = waitForProcess(
+                    self._process,
+                    self.timeLimit,
+                    lambda: self._killCGroup(cgroup))
+                runTime = time.perf_counter() - startTime
+                # Children of the program might still be running. They
+                # must be gone before the log is finished.
+                self._killCGroup(cgroup)
+                if not self._waitForEmptyCGroup(cgroup):
+                    _logger.warning('cgroup "{}" did not become empty'.format(cgroup))
+            if samplerThread is not None:
+                stopSampling.set()
+                samplerThread.join()
+                telemetryFile = Telemetry.getTelemetryFile(self.workingDirectory)
+                telemetry.save(telemetryFile)
+                # The rusage only has the largest process
+                if telemetry.peakRss is not None:
+                    resourceUsage['peakRss'] = max(resourceUsage['peakRss'], telemetry.peakRss)
+
+            # Unlike the rusage these include every process in the cgroup
+            cpuStat = readCGroupKeyedFile(os.path.join(cgroup, 'cpu.stat'))
+            resourceUsage['userCpuTime'] = cpuStat['user_usec'] / 1e6
+            resourceUsage['sysCpuTime'] = cpuStat['system_usec'] / 1e6
+            outOfMemory = False
+            if self.memoryLimit > 0:
+                memoryEvents = readCGroupKeyedFile(os.path.join(cgroup, 'memory.events'))
+                outOfMemory = memoryEvents.get('oom_kill', 0) > 0
+                memoryAccounting = 'cgroup'
+                peakFile = os.path.join(cgroup, 'memory.peak')
+                # `memory.peak` needs Linux >= 5.19
+                if os.path.exists(peakFile):
+                    with open(peakFile, 'r') as f:
+                        peakMemoryUsage = int(f.read()) / (2**20)
+                    _logger.info('Peak memory usage: {} MiB'.format(peakMemoryUsage))
+            if outOfMemory:
+                _logger.warning('Memory limit reached')
+        finally:
+            stopSampling.set()
+            if procsFd is not None:
+                os.close(procsFd)
+            with self._killLock:
+                self._cgroup = None
+                self._process = None
+            self._removeCGroup(cgroup)
+
+        return BackendResult(exitCode=exitCode,
+                             runTime=runTime,
+                             oot=outOfTime,
+                             oom=outOfMemory,
+                             telemetryFile=telemetryFile,
+                             memoryAccounting=memoryAccounting,
+                             peakMemoryUsage=peakMemoryUsage,
+                             logFile=LogCapture.getLogFilePath(logFilePath, self._logCapture),
+                             **resourceUsage)
+
+    def _setStacksize(self):
+        """
+          Designed to be called subprocess.POpen() after fork.
+          Note do not try to use the _logger here are the file descriptors have been changed.
+        """
+        assert self.stackLimit != None
+        assert isinstance(self.stackLimit, int)
+        import resource
+        if self.stackLimit == 0:
+            resource.setrlimit(resource.RLIMIT_STACK,
+                               (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+        else:
+            resource.setrlimit(resource.RLIMIT_STACK,
+                               (self.stackLimit, self.stackLimit))
+
+    def checkToolExists(self, toolPath):
+        assert os.path.isabs(toolPath)
+        if not os.path.exists(toolPath):
+            raise CGroupBackendException(
+                'Tool "{}" does not exist'.format(toolPath))
+
+    @property
+    def workingDirectoryInternal(self):
+        # Nothing special here. We work directly on the host
+        return self.workingDirectory
+
+    def addFileToBackend(self, path, read_only):
+        """
+          CGroupBackend runs directly on the host
+          so this is a no-op
+        """
+        if read_only:
+            _logger.warning('Cannot enforce that "{}" is read only'.format(path))
+
+    def getFilePathInBackend(self, hostPath):
+        """
+          CGroupBackend runs directly on the host
+          so all files are available so just return
+          the requested `hostPath`.
+        """
+        return hostPath
+
+
+def get():
+    return CGroupBackend
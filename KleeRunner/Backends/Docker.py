@@ -1,8 +1,12 @@
 # vim: set sw=4 ts=4 softtabstop=4 expandtab:
 from . BackendBase import *
-import functools
+from .. import CpuPool
+from .. import LogCapture
+from .. import Telemetry
+import atexit
 import logging
 import os
+import shutil
 import pprint
 import time
 import psutil
@@ -31,37 +35,25 @@ class ResourcePool:
         that can be acquired and returned. These resources include
 
         * DockerClient
-        * CPUs
+        * Warm containers (idle long-lived containers that jobs are run
+          inside using ``exec``)
     """
-    def __init__(self, num_jobs, available_cpu_ids, cpus_per_job, use_memset_of_nearest_node):
+    def __init__(self, num_jobs):
         assert isinstance(num_jobs, int)
         assert num_jobs > 0
-        assert isinstance(available_cpu_ids, set) or available_cpu_ids is None
-        assert isinstance(cpus_per_job, int) or cpus_per_job is None
-        if cpus_per_job is not None:
-            assert cpus_per_job > 0
-        if available_cpu_ids is not None:
-            assert len(available_cpu_ids) > 0
-        assert isinstance(use_memset_of_nearest_node, bool) or use_memset_of_nearest_node is None
         self._num_jobs = num_jobs
-        self._available_cpu_ids = available_cpu_ids
-        self._cpus_per_job = cpus_per_job
-        self._use_memset_of_nearest_node = use_memset_of_nearest_node
 
         # Docker client data structures
         self._docker_clients = dict() # All created clients
         self._docker_client_pool = set() # Available clients
 
-        # CPU and memset data structures
-        self._numa_nodes = dict() # Maps NUMA node to set of CPU ids
-        self._numa_node_pool = dict() # Maps NUMa node to set of available CPU ids
+        # Warm container data structures
+        self._warm_containers = set() # Ids of all warm containers
+        self._warm_container_pool = dict() # Maps key to list of idle container ids
+        self._registered_atexit = False
 
         self._lock = threading.Lock()
 
-        # Sanity check
-        if cpus_per_job is not None and available_cpu_ids is not None:
-            assert (num_jobs * cpus_per_job) <= len(available_cpu_ids)
-
     def _lazy_docker_client_init(self):
         # Implicitly assume lock is already held
         if len(self._docker_clients) != 0:
@@ -98,106 +90,177 @@ class ResourcePool:
             # Put back in pool
             self._docker_client_pool.add(id(docker_client))
 
-    def _lazy_cpu_and_mem_set_init(self):
-        # Implicitly assume lock is already held
-        if len(self._numa_nodes) != 0:
-            # Init already happened
-            return
-        if (self._available_cpu_ids is None
-            or self._cpus_per_job is None
-            or self._use_memset_of_nearest_node is None):
-            raise Exception('Cannot do init. One or more params were None')
-        import numa
-        if not numa.available():
-            raise Exception('NUMA not available')
-        numa_nodes = list(range(0, numa.get_max_node() + 1))
-        cpu_count = 0
-        for numa_node in numa_nodes:
-            cpus = numa.node_to_cpus(numa_node)
-            for cpu_id in cpus:
-                if cpu_id in self._available_cpu_ids:
-                    try:
-                        self._numa_nodes[numa_node].add(cpu_id)
-                    except KeyError:
-                        self._numa_nodes[numa_node] = set()
-                        self._numa_nodes[numa_node].add(cpu_id)
-                    try:
-                        self._numa_node_pool[numa_node].add(cpu_id)
-                    except KeyError:
-                        self._numa_node_pool[numa_node] = set()
-                        self._numa_node_pool[numa_node].add(cpu_id)
-                    _logger.info('Putting CPU {} in NUMA node {} in resource pool'.format(
-                        cpu_id, numa_node))
-                    cpu_count += 1
-                else:
-                    _logger.info('CPU {} in NUMA node {} is NOT IN resource pool'.format(
-                        cpu_id, numa_node))
+    def get_warm_container(self, key):
+        """
+            Returns the id of an idle warm container created with ``key``
+            or None if there isn't one.
+        """
+        with self._lock:
+            try:
+                return self._warm_container_pool[key].pop()
+            except (KeyError, IndexError):
+                return None
 
-        if cpu_count == 0:
-            raise Exception('Found no available CPUs')
-        if cpu_count != len(self._available_cpu_ids):
-            raise Exception(
-                'Mismatch between provided available CPU ids and what was found on system')
-        assert len(self._numa_node_pool) == len(self._numa_nodes)
+    def add_warm_container(self, container_id):
+        """
+            Register a newly created warm container so it is removed
+            when the process exits.
+        """
+        with self._lock:
+            self._warm_containers.add(container_id)
+            if not self._registered_atexit:
+                atexit.register(self.remove_warm_containers)
+                self._registered_atexit = True
 
-    def get_cpus(self):
+    def release_warm_container(self, key, container_id, max_idle):
         """
-            Returns a set of CPU ids for a single job
+            Return a warm container to the pool. Returns False if there are
+            already ``max_idle`` idle containers for ``key`` in which case the
+            caller should remove the container.
         """
         with self._lock:
-            self._lazy_cpu_and_mem_set_init()
-            cpu_memset_tuples_to_return = set()
-            if self._use_memset_of_nearest_node:
-                for numa_node, available_cpus in sorted(
-                    self._numa_node_pool.items(), key=lambda x:x[0]):
-                    if len(available_cpus) >= self._cpus_per_job:
-                        for _ in range(0, self._cpus_per_job):
-                            cpu = available_cpus.pop()
-                            cpu_memset_tuples_to_return.add( (cpu, numa_node) )
-                        break # We are done
-            else:
-                # Grab any available CPU
-                available_cpus = set(functools.reduce(
-                    lambda a,b: a.union(b),
-                    self._numa_node_pool.values()))
-                cpus_to_grab = set()
-                if len(available_cpus) >= self._cpus_per_job:
-                    for _ in range(0, self._cpus_per_job):
-                        cpus_to_grab.add(available_cpus.pop())
-                    # Now remove from pool
-                    for numa_node, available_cpus_in_node in sorted(
-                        self._numa_node_pool.items(), key=lambda x:x[0]):
-                        for cpu_to_grab in cpus_to_grab:
-                            if cpu_to_grab in available_cpus_in_node:
-                                cpu_memset_tuples_to_return.add( (cpu_to_grab, numa_node) )
-                                available_cpus_in_node.remove(cpu_to_grab)
-
-
-            if len(cpu_memset_tuples_to_return) != self._cpus_per_job:
-                _logger.error('Failed to retrieve CPU resources required for job')
-                _logger.error('cpu_memset_tuples_to_return: {}'.format(cpu_memset_tuples_to_return))
-                _logger.error('cpus_per_job: {}'.format(self._cpus_per_job))
-                raise Exception('Failed to retrieve CPU resources required for job')
-            return cpu_memset_tuples_to_return
-
-    def release_cpus(self, cpu_ids):
+            assert container_id in self._warm_containers
+            idle = self._warm_container_pool.setdefault(key, [])
+            if len(idle) >= max_idle:
+                self._warm_containers.remove(container_id)
+                return False
+            idle.append(container_id)
+            return True
+
+    def discard_warm_container(self, container_id):
+        """
+            Forget about a warm container that the caller is removing.
+        """
+        with self._lock:
+            self._warm_containers.discard(container_id)
+
+    def remove_warm_containers(self):
+        """
+            Remove all warm containers.
+        """
+        with self._lock:
+            container_ids = list(self._warm_containers)
+            self._warm_containers.clear()
+            self._warm_container_pool.clear()
+        if len(container_ids) == 0:
+            return
+        dc = docker.APIClient(version='1.24')
+        for container_id in container_ids:
+            _logger.info('Destroying warm container:{}'.format(container_id))
+            try:
+                dc.remove_container(container=container_id, v=True, force=True)
+            except docker.errors.APIError as e:
+                _logger.error('Failed to remove container:"{}".\n{}'.format(
+                    container_id, str(e)))
+
+class _ContainerStatsSampler:
+    """
+        Reads the stats of a container from the Docker stats API on its
+        own thread whilst a job runs. Docker sends a sample about once a
+        second so nothing is recorded for shorter jobs.
+
+        If ``telemetry`` (a ``Telemetry.TelemetryRecorder``) is not None
+        samples are added to it. ``startTime`` is when the job started
+        and ``startCpuTime`` is the CPU time (in seconds) the container
+        had used by then, or None if it is not known.
+    """
+    def __init__(self, containerId, telemetry=None, startTime=None, startCpuTime=None):
+        self._containerId = containerId
+        self._lock = threading.Lock()
+        self._stopEvent = threading.Event()
+        self._peakRss = None
+        self._lastStats = None
+        self._telemetry = telemetry
+        self._startTime = startTime
+        self._lastCpuSample = None
+        if startCpuTime is not None:
+            self._lastCpuSample = (startTime, startCpuTime)
+        self._thread = threading.Thread(
+            target=self._readStats,
+            name='docker_stats-{}'.format(containerId[:12]),
+            daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _readStats(self):
+        # The stream is read using a separate client so that it does not
+        # tie up a client from the resource pool after the job finishes.
+        dc = docker.APIClient(version='1.24')
+        try:
+            for stats in dc.stats(container=self._containerId, decode=True, stream=True):
+                if self._stopEvent.is_set():
+                    break
+                self._addSample(stats)
+        except (docker.errors.APIError, requests.exceptions.RequestException) as e:
+            _logger.debug('Stopped reading stats of container "{}": {}'.format(
+                self._containerId, e))
+        finally:
+            dc.close()
+
+    def _addSample(self, stats):
+        memoryStats = stats.get('memory_stats', None) or {}
+        if 'usage' not in memoryStats:
+            # The container has stopped
+            return
+        # Like `docker stats` don't count the page cache ("cache" for
+        # cgroup v1, "inactive_file" for cgroup v2).
+        cgroupStats = memoryStats.get('stats', None) or {}
+        cache = cgroupStats.get('cache', cgroupStats.get('inactive_file', 0))
+        rss = max(0, memoryStats['usage'] - cache) / (2**20)
+        with self._lock:
+            if self._peakRss is None or rss > self._peakRss:
+                self._peakRss = rss
+            self._lastStats = stats
+            cpuUsage = stats.get('cpu_stats', {}).get('cpu_usage', {})
+            if self._telemetry is None or 'total_usage' not in cpuUsage:
+                return
+            now = time.perf_counter()
+            cpuTime = cpuUsage['total_usage'] / (10**9)
+            lastCpuSample = self._lastCpuSample
+            self._lastCpuSample = (now, cpuTime)
+            if lastCpuSample is None:
+                # The CPU use can't be worked out from the first sample
+                return
+            lastTime, lastCpuTime = lastCpuSample
+            # The stats API does not give the number of open files
+            self._telemetry.addSample(
+                now - self._startTime,
+                rss,
+                max(0.0, 100.0 * (cpuTime - lastCpuTime) / (now - lastTime)),
+                -1)
+
+    def stop(self, withCounters):
         """
-            Returns a set of CPU ids
+            Stop sampling and return keyword arguments for
+            ``BackendResult``. The CPU times and block I/O are only
+            returned if ``withCounters`` is True because the counters
+            cover the whole life of the container (so they are wrong for
+            containers that have run other jobs).
         """
+        self._stopEvent.set()
         with self._lock:
-            self._lazy_cpu_and_mem_set_init()
-            assert isinstance(cpu_ids, set)
-            for item in cpu_ids:
-                assert isinstance(item, int)
-            for cpu_to_release in cpu_ids:
-                released=False
-                for numa_node, available_cpu_ids in self._numa_node_pool.items():
-                    if cpu_to_release in self._numa_nodes[numa_node]:
-                        available_cpu_ids.add(cpu_to_release)
-                        released = True
-                        break
-                if not released:
-                    raise Exception('Failed to return CPU {} to pool'.format(cpu_to_release))
+            peakRss = self._peakRss
+            stats = self._lastStats
+            # The sampling thread might still be running
+            self._telemetry = None
+        resourceUsage = {'peakRss': peakRss}
+        if not withCounters or stats is None:
+            return resourceUsage
+        cpuUsage = stats.get('cpu_stats', {}).get('cpu_usage', {})
+        if 'usage_in_usermode' in cpuUsage:
+            resourceUsage['userCpuTime'] = cpuUsage['usage_in_usermode'] / (10**9)
+        if 'usage_in_kernelmode' in cpuUsage:
+            resourceUsage['sysCpuTime'] = cpuUsage['usage_in_kernelmode'] / (10**9)
+        ioServiceBytes = stats.get('blkio_stats', {}).get('io_service_bytes_recursive', None)
+        if ioServiceBytes is not None:
+            # The operations are capitalised for cgroup v1 but not v2
+            resourceUsage['blockReadBytes'] = sum(
+                e['value'] for e in ioServiceBytes if e['op'].lower() == 'read')
+            resourceUsage['blockWriteBytes'] = sum(
+                e['value'] for e in ioServiceBytes if e['op'].lower() == 'write')
+        return resourceUsage
+
 
 class DockerBackend(BackendBaseClass):
 
@@ -214,6 +277,14 @@ class DockerBackend(BackendBaseClass):
         self._usedFileMapNames = set()  # HACK
         self._extra_volume_mounts = dict()
         self._grabbed_cpus = None
+        self._warmContainerPoolSize = 0
+        self._warmContainerMounts = []
+        self._warmContainerKey = None
+        self._warmContainerDiscard = False
+        self._warmContainerFinished = False
+        self._warmContainerTimedOut = False
+        self._logWriter = None
+        self._logPump = None
         # handle required options
         if not 'image' in kwargs:
             raise DockerBackendException('"image" but be specified')
@@ -229,7 +300,15 @@ class DockerBackend(BackendBaseClass):
         cpus_per_job = None
         self._use_memset_of_nearest_node = None
         self.resource_pinning = False # No resource pinning by default
-        requiredOptions = ['image']
+        try:
+            self._logCapture = LogCapture.getLogCaptureOptions(self.name, kwargs)
+        except LogCapture.LogCaptureException as e:
+            raise DockerBackendException(e.msg)
+        try:
+            self._telemetryInterval = Telemetry.getTelemetryInterval(self.name, kwargs)
+        except Telemetry.TelemetryException as e:
+            raise DockerBackendException(e.msg)
+        requiredOptions = ['image', 'log_capture', 'telemetry_interval']
         # handle other options
         for key, value in kwargs.items():
             if key in requiredOptions:
@@ -330,47 +409,52 @@ class DockerBackend(BackendBaseClass):
                 continue
             if key == 'resource_pinning':
                 self.resource_pinning = True
+                try:
+                    (available_cpu_ids,
+                     cpus_per_job,
+                     self._use_memset_of_nearest_node) = CpuPool.parseResourcePinningOptions(
+                        value, self.ctx.num_parallel_jobs)
+                except CpuPool.CpuPoolException as e:
+                    raise DockerBackendException(e.msg)
+                continue
+
+            if key == 'warm_containers':
                 if not isinstance(value, dict):
                     raise DockerBackendException(
-                    'resource_pinning should map to a dictionary')
-                if 'cpu_ids' not in value:
-                    raise DockerBackendException(
-                    'cpu_ids key must be present in resource_pinning')
-                available_cpu_ids = value['cpu_ids']
-                if not isinstance(available_cpu_ids, list):
-                    raise DockerBackendException(
-                    'cpu_ids must be a list')
-                # Turn into a set
-                available_cpu_ids = set(available_cpu_ids)
-                if len(available_cpu_ids) == 0:
-                    raise DockerBackendException(
-                    'cpu_ids must not be empty')
-                if 'cpus_per_job' not in value:
-                    raise DockerBackendException(
-                    'cpus_per_job key must be present in resource_pinning')
-                cpus_per_job = value['cpus_per_job']
-                if not isinstance(cpus_per_job, int):
+                        '"warm_containers" should map to a dictionary')
+                if 'pool_size' not in value:
                     raise DockerBackendException(
-                    'cpus_per_job must be an integer')
-                if cpus_per_job < 1:
+                        '"pool_size" key must be present in warm_containers')
+                self._warmContainerPoolSize = value['pool_size']
+                if not (isinstance(self._warmContainerPoolSize, int) and
+                        self._warmContainerPoolSize > 0):
                     raise DockerBackendException(
-                    'cpus_per_job >= 1')
-                self._use_memset_of_nearest_node = False # Default
-                if 'use_memset_of_nearest_node' in value:
-                    self._use_memset_of_nearest_node = value['use_memset_of_nearest_node']
-                    if not isinstance(self._use_memset_of_nearest_node, bool):
+                        '"pool_size" must be an integer > 0')
+                mounts = value.get('mounts', [])
+                if not isinstance(mounts, list):
+                    raise DockerBackendException('"mounts" must be a list')
+                for mount in mounts:
+                    if not (isinstance(mount, str) and os.path.isabs(mount)):
                         raise DockerBackendException(
-                        'cpus_per_job >= 1')
-                # Sanity check
-                if (self.ctx.num_parallel_jobs * cpus_per_job) > len(available_cpu_ids):
-                        raise DockerBackendException(
-                        'Number of cpus required exceeds number of available CPUs')
+                            '"{}" in "mounts" must be an absolute path'.format(mount))
+                    self._warmContainerMounts.append(os.path.normpath(mount))
                 continue
 
             # Not recognised option
             raise DockerBackendException(
                 '"{}" key is not a recognised option'.format(key))
 
+        if self.useWarmContainers:
+            if self._dockerStatsOnExitShimBinary:
+                raise DockerBackendException(
+                    '"docker_stats_on_exit_shim" cannot be used with "warm_containers"')
+            # Warm containers outlive a job so they mount the directory
+            # containing all the working directories rather than just
+            # this job's working directory. They (and the other
+            # mounts) are mounted at the same path as on the host.
+            self._warmContainerMounts.append(
+                os.path.dirname(os.path.abspath(self.workingDirectory)))
+
         # HACK: Try to prevent program path name being used in calls to addFileToBackend()
         if self.programPath().startswith('/tmp') and os.path.dirname(self.programPath()) == '/tmp':
             self._usedFileMapNames.add(os.path.basename(self.programPath()))
@@ -382,11 +466,7 @@ class DockerBackend(BackendBaseClass):
             if not success:
                 # There is no existing resource pool. Make one
                 self._resource_pool = ResourcePool(
-                    num_jobs=self.ctx.num_parallel_jobs,
-                    available_cpu_ids=available_cpu_ids,
-                    cpus_per_job=cpus_per_job,
-                    use_memset_of_nearest_node=self._use_memset_of_nearest_node
-                )
+                    num_jobs=self.ctx.num_parallel_jobs)
                 success = self.ctx.add_object('DockerBackend.ResourcePool', self._resource_pool)
                 # Handle race. If someone managed to make a resource pool before we did
                 # use theirs instead
@@ -400,6 +480,18 @@ class DockerBackend(BackendBaseClass):
             raise DockerBackendException(
                 'Failed to get resource pool')
 
+        # The CPU pool is shared with other backends that support pinning
+        self._cpu_pool = None
+        if self.resource_pinning:
+            try:
+                self._cpu_pool = CpuPool.getCpuPool(
+                    self.ctx,
+                    available_cpu_ids,
+                    cpus_per_job,
+                    self._use_memset_of_nearest_node)
+            except CpuPool.CpuPoolException as e:
+                raise DockerBackendException(e.msg)
+
         # Initialise the docker client
         try:
             self._dc = self._resource_pool.get_docker_client()
@@ -411,36 +503,60 @@ class DockerBackend(BackendBaseClass):
                 'Failed to connect to the Docker daemon')
 
         try:
-            # FIXME: Move this check into the resource pool so we can cache
-            # the result of this check amoung runners.
-            # Check we can find the docker image
-            images = self._dc.images()
-            assert isinstance(images, list)
-            images = list(
-                filter(lambda i: (i['RepoTags'] is not None) and self._dockerImageName in i['RepoTags'], images))
-            if len(images) == 0:
-                msg = 'Could not find docker image with name "{}"'.format(
-                    self._dockerImageName)
-                raise DockerBackendException(msg)
-            else:
-                if len(images) > 1:
-                    msg = 'Found multiple docker images:\n{}'.format(
-                        pprint.pformat(images))
-                    _logger.error(msg)
-                    raise DockerBackendException(msg)
-                self._dockerImage = images[0]
-                _logger.debug('Found Docker image:\n{}'.format(
-                    pprint.pformat(self._dockerImage)))
+            # Check we can find the docker image. The result is shared
+            # amoung all runners.
+            self._dockerImage = self.ctx.memoize(
+                ('DockerBackend.image', self._dockerImageName),
+                self._findDockerImage)
         finally:
             # HACK: To not exhaust the resource pool we need to
             # return the client now.
             self._resource_pool.release_docker_client(self._dc)
             self._dc = None
 
+    def _findDockerImage(self):
+        assert self._dc is not None
+        images = self._dc.images()
+        assert isinstance(images, list)
+        images = list(
+            filter(lambda i: (i['RepoTags'] is not None) and self._dockerImageName in i['RepoTags'], images))
+        if len(images) == 0:
+            msg = 'Could not find docker image with name "{}"'.format(
+                self._dockerImageName)
+            raise DockerBackendException(msg)
+        if len(images) > 1:
+            msg = 'Found multiple docker images:\n{}'.format(
+                pprint.pformat(images))
+            _logger.error(msg)
+            raise DockerBackendException(msg)
+        _logger.debug('Found Docker image:\n{}'.format(
+            pprint.pformat(images[0])))
+        return images[0]
+
     @property
     def name(self):
         return "Docker"
 
+    @property
+    def environmentIdentifier(self):
+        return self._dockerImage['Id']
+
+    @property
+    def useWarmContainers(self):
+        return self._warmContainerPoolSize > 0
+
+    @property
+    def warmContainerStagingDir(self):
+        # Files that are not inside a warm container mount are copied here
+        return os.path.join(self.workingDirectory, '.backend_files')
+
+    def _isInWarmContainerMount(self, hostPath):
+        hostPath = os.path.abspath(hostPath)
+        for mount in self._warmContainerMounts:
+            if hostPath == mount or hostPath.startswith(mount + os.sep):
+                return True
+        return False
+
     @property
     def dockerStatsOnExitShimPathInContainer(self):
         if self._dockerStatsOnExitShimBinary == None:
@@ -459,13 +575,12 @@ class DockerBackend(BackendBaseClass):
     def dockerStatsLogFileInContainer(self):
         return os.path.join(self.workingDirectoryInternal, self.dockerStatsLogFileName)
 
-    def run(self, cmdLine, logFilePath, envVars):
-        # Grab a docker client
-        self._dc = self._resource_pool.get_docker_client()
-
-        self._logFilePath = logFilePath
-        self._outOfMemory = False
-        outOfTime = False
+    def _getHostConfigArgs(self):
+        """
+          Returns a dictionary of arguments for ``create_host_config()``
+          that apply the resource limits for a job. If resource pinning is
+          used the CPUs for the job are taken from the resource pool.
+        """
         ulimits = []
         if self.stackLimit != None:
             # FIXME: Setting stack size in Docker seems broken right now.
@@ -500,6 +615,47 @@ class DockerBackend(BackendBaseClass):
         if len(ulimits) > 0:
             extraHostCfgArgs['ulimits'] = ulimits
 
+        if self.memoryLimit > 0:
+            # http://docs.docker.com/reference/run/#memory-constraints
+            #
+            # memory=L<inf, memory-swap=S<inf, L<=S
+            # (specify both memory and memory-swap) The container is not allowed to use more than L bytes of memory, swap *plus* memory usage is limited by S.
+            extraHostCfgArgs['mem_limit'] = '{}m'.format(self.memoryLimit)
+            extraHostCfgArgs['memswap_limit'] = '{}m'.format(self.memoryLimit)
+            _logger.info(
+                'Setting memory limit to {} MiB'.format(self.memoryLimit))
+
+        if self.resource_pinning:
+            cpu_memset_tuples = self._cpu_pool.get_cpus()
+            self._grabbed_cpus = set(map(lambda t: t[0], cpu_memset_tuples))
+            cpu_set_string=",".join(map(str, sorted(self._grabbed_cpus)))
+            extraHostCfgArgs['cpuset_cpus']=cpu_set_string
+            _logger.info('Using CPU pinning: {}'.format(cpu_set_string))
+            if self._use_memset_of_nearest_node:
+                mem_set_to_use = None
+                for _, mem_set in cpu_memset_tuples:
+                    mem_set_to_use = mem_set
+                    break
+                _logger.info('Using Memset pinning: {}'.format(mem_set_to_use))
+                assert isinstance(mem_set_to_use, int)
+                assert mem_set_to_use >= 0
+                extraHostCfgArgs['cpuset_mems'] = str(mem_set_to_use)
+
+
+        return extraHostCfgArgs
+
+    def run(self, cmdLine, logFilePath, envVars):
+        if self.useWarmContainers:
+            return self._runInWarmContainer(cmdLine, logFilePath, envVars)
+
+        # Grab a docker client
+        self._dc = self._resource_pool.get_docker_client()
+
+        self._logFilePath = LogCapture.getLogFilePath(logFilePath, self._logCapture)
+        self._outOfMemory = False
+        outOfTime = False
+        extraHostCfgArgs = self._getHostConfigArgs()
+
         # Declare the volumes
         programPathInsideContainer = self.programPath()
         bindings = dict()
@@ -526,44 +682,11 @@ class DockerBackend(BackendBaseClass):
 
         extraContainerArgs = {}
 
-        if self.memoryLimit > 0:
-            # http://docs.docker.com/reference/run/#memory-constraints
-            #
-            # memory=L<inf, memory-swap=S<inf, L<=S
-            # (specify both memory and memory-swap) The container is not allowed to use more than L bytes of memory, swap *plus* memory usage is limited by S.
-            extraHostCfgArgs['mem_limit'] = '{}m'.format(self.memoryLimit)
-            extraHostCfgArgs['memswap_limit'] = '{}m'.format(self.memoryLimit)
-            _logger.info(
-                'Setting memory limit to {} MiB'.format(self.memoryLimit))
-
         if self._userToUseInsideContainer != None:
             extraContainerArgs['user'] = self._userToUseInsideContainer
             _logger.info('Using user "{}" inside container'.format(
                 self._userToUseInsideContainer))
 
-        if self.resource_pinning:
-            cpu_memset_tuples = self._resource_pool.get_cpus()
-            self._grabbed_cpus = set(map(lambda t: t[0], cpu_memset_tuples))
-            grabbed_cpu_strs = set(map(lambda c:str(c), self._grabbed_cpus))
-            cpu_set_string=",".join(grabbed_cpu_strs)
-            extraHostCfgArgs['cpuset_cpus']=cpu_set_string
-            _logger.info('Using CPU pinning: {}'.format(cpu_set_string))
-            if self._use_memset_of_nearest_node:
-                mem_set_to_use = None
-                for _, mem_set in cpu_memset_tuples:
-                    mem_set_to_use = mem_set
-                    break
-                _logger.info('Using Memset pinning: {}'.format(mem_set_to_use))
-                assert isinstance(mem_set_to_use, int)
-                assert mem_set_to_use >= 0
-                mem_set_to_use_str=str(mem_set_to_use)
-                _logger.warning('FIXME Setting cpuset_mem is broken')
-                raise Exception('Setting cpuset_mem is broken')
-                # FIXME: Need to get this PR ( https://github.com/docker/docker-py/pull/1583 )
-                # accepted for this to work.
-                # extraHostCfgArgs['cpuset_mems'] = mem_set_to_use_str
-
-
         hostCfg = self._dc.create_host_config(
             binds=bindings,
             privileged=False,
@@ -601,8 +724,26 @@ class DockerBackend(BackendBaseClass):
         exitCode = None
         startTime = time.perf_counter()
         self._endTime = 0
+        statsSampler = None
+        telemetry = None
         try:
+            self._logWriter = LogCapture.LogWriter(self._logFilePath, self._logCapture)
             self._dc.start(container=self._container['Id'])
+            if self._telemetryInterval is not None:
+                telemetry = Telemetry.TelemetryRecorder(self._telemetryInterval)
+            # The container has not used any CPU time before it starts
+            statsSampler = _ContainerStatsSampler(
+                self._container['Id'], telemetry, startTime, 0.0)
+            statsSampler.start()
+            # Write the log to disk whilst the container runs rather than
+            # fetching all of it (which might be huge) at the end.
+            self._logPump = LogCapture.LogPump(
+                self._dc.logs(container=self._container['Id'],
+                              stdout=True, stderr=True, timestamps=False,
+                              stream=True, follow=True),
+                self._logWriter,
+                name='log_pump-{}'.format(self._container['Id'][:12]))
+            self._logPump.start()
             timeoutArg = {}
             if self.timeLimit > 0:
                 timeoutArg['timeout'] = self.timeLimit
@@ -625,18 +766,24 @@ class DockerBackend(BackendBaseClass):
             self.kill()
 
         runTime = self._endTime - startTime
-        userCPUTime = None
-        sysCPUTime = None
+        resourceUsage = {}
+        telemetryFile = None
+        if statsSampler is not None:
+            resourceUsage = statsSampler.stop(withCounters=True)
+        if telemetry is not None:
+            telemetryFile = Telemetry.getTelemetryFile(self.workingDirectory)
+            telemetry.save(telemetryFile)
 
         if self._dockerStatsOnExitShimBinary:
-            # Try to extract the needed stats
+            # Try to extract the needed stats. These are more accurate
+            # than the last sample from the stats API.
             try:
                 with open(self.dockerStatsLogFileHost, 'r') as f:
                     stats = json.load(f)
-                    userCPUTime = float(stats['cgroups']['cpu_stats']['cpu_usage'][
-                                        'usage_in_usermode']) / (10**9)
-                    sysCPUTime = float(stats['cgroups']['cpu_stats']['cpu_usage'][
-                                       'usage_in_kernelmode']) / (10**9)
+                    resourceUsage['userCpuTime'] = float(stats['cgroups']['cpu_stats']['cpu_usage'][
+                                                         'usage_in_usermode']) / (10**9)
+                    resourceUsage['sysCpuTime'] = float(stats['cgroups']['cpu_stats']['cpu_usage'][
+                                                        'usage_in_kernelmode']) / (10**9)
             except Exception as e:
                 _logger.error('Failed to retrieve stats from "{}"'.format(
                     self.dockerStatsLogFileHost))
@@ -647,10 +794,230 @@ class DockerBackend(BackendBaseClass):
                              runTime=runTime,
                              oot=outOfTime,
                              oom=self._outOfMemory,
-                             userCpuTime=userCPUTime,
-                             sysCpuTime=sysCPUTime)
+                             telemetryFile=telemetryFile,
+                             logFile=self._logFilePath,
+                             **resourceUsage)
+
+    def _getWarmContainerKey(self, extraHostCfgArgs):
+        # Containers can only be reused by jobs that need the same
+        # image, mounts, user and resource limits. The pinning is not
+        # part of the key because it is applied to the container for
+        # each job.
+        return json.dumps({
+            'image': self._dockerImage['Id'],
+            'mounts': sorted(self._warmContainerMounts),
+            'extra_mounts': self._extra_volume_mounts,
+            'user': self._userToUseInsideContainer,
+            'host_config': extraHostCfgArgs,
+        }, sort_keys=True, default=str)
+
+    def _createWarmContainer(self, extraHostCfgArgs):
+        bindings = dict()
+        for hostPath, props in self._extra_volume_mounts.items():
+            bindings[hostPath] = props
+        for mount in self._warmContainerMounts:
+            bindings[mount] = {'bind': mount, 'ro': False}
+        hostCfg = self._dc.create_host_config(
+            binds=bindings,
+            privileged=False,
+            network_mode=None,
+            **extraHostCfgArgs
+        )
+        extraContainerArgs = {}
+        if self._userToUseInsideContainer != None:
+            extraContainerArgs['user'] = self._userToUseInsideContainer
+        # The container just needs to stay alive. Jobs are run using exec.
+        container = self._dc.create_container(
+            image=self._dockerImage['Id'],
+            command=['/bin/sh', '-c', 'while true; do sleep 3600; done'],
+            volumes=list(bindings.keys()),
+            host_config=hostCfg,
+            cpu_shares=0,
+            **extraContainerArgs
+        )
+        if container['Warnings'] != None:
+            _logger.warning('Warnings emitted when creating container:{}'.format(
+                container['Warnings']))
+        self._resource_pool.add_warm_container(container['Id'])
+        self._dc.start(container=container['Id'])
+        _logger.info('Created warm container:{}'.format(container['Id']))
+        return container['Id']
+
+    def _stageFilesForWarmContainer(self):
+        # Files outside of the warm container mounts are copied into the
+        # working directory.
+        toStage = [(self.hostProgramPath, self.programPath())]
+        for hostPath, (containerPath, _) in self._additionalHostContainerFileMaps.items():
+            toStage.append((hostPath, containerPath))
+        for hostPath, containerPath in toStage:
+            if hostPath == containerPath:
+                continue
+            os.makedirs(self.warmContainerStagingDir, exist_ok=True)
+            try:
+                os.link(hostPath, containerPath)
+            except OSError:
+                shutil.copy2(hostPath, containerPath)
+
+    def _runInWarmContainer(self, cmdLine, logFilePath, envVars):
+        """
+          Run ``cmdLine`` using ``exec`` inside a warm container taken
+          from the resource pool. A container is not reused if the job
+          was killed, timed out or ran out of memory.
+        """
+        self._dc = self._resource_pool.get_docker_client()
+        self._outOfMemory = False
+        self._warmContainerDiscard = False
+        self._warmContainerFinished = False
+        self._warmContainerTimedOut = False
+        exitCode = None
+        timer = None
+        statsSampler = None
+        resourceUsage = {}
+        telemetry = None
+        telemetryFile = None
+        startTime = time.perf_counter()
+        self._endTime = 0
+        try:
+            self._stageFilesForWarmContainer()
+            extraHostCfgArgs = self._getHostConfigArgs()
+            pinningArgs = dict()
+            for key in ['cpuset_cpus', 'cpuset_mems']:
+                if key in extraHostCfgArgs:
+                    pinningArgs[key] = extraHostCfgArgs.pop(key)
+            self._warmContainerKey = self._getWarmContainerKey(extraHostCfgArgs)
+            containerId = self._resource_pool.get_warm_container(self._warmContainerKey)
+            if containerId is None:
+                containerId = self._createWarmContainer(extraHostCfgArgs)
+            else:
+                _logger.debug('Reusing warm container:{}'.format(containerId))
+            with self._killLock:
+                self._container = {'Id': containerId}
+            if len(pinningArgs) > 0:
+                self._dc.update_container(container=containerId, **pinningArgs)
+
+            # The API version we use does not support setting the working
+            # directory or environment of an exec so use the shell to do it.
+            envArgs = ['{}={}'.format(k, v) for k, v in sorted(envVars.items())]
+            finalCmdLine = (['/bin/sh', '-c', 'cd "$0" && exec env "$@"',
+                             self.workingDirectoryInternal] + envArgs + cmdLine)
+            _logger.debug('Command line inside container:\n{}'.format(
+                pprint.pformat(finalCmdLine)))
+            execArgs = {}
+            if self._userToUseInsideContainer != None:
+                execArgs['user'] = str(self._userToUseInsideContainer)
+            execId = self._dc.exec_create(
+                container=containerId, cmd=finalCmdLine, **execArgs)['Id']
+
+            startTime = time.perf_counter()
+            if self._telemetryInterval is not None:
+                telemetry = Telemetry.TelemetryRecorder(self._telemetryInterval)
+            # The CPU time the container used for earlier jobs is not
+            # known so the first sample is only used as a baseline.
+            statsSampler = _ContainerStatsSampler(containerId, telemetry, startTime)
+            statsSampler.start()
+            if self.timeLimit > 0:
+                _logger.info('Using timeout {} seconds'.format(self.timeLimit))
+                timer = threading.Timer(self.timeLimit, self._warmContainerTimeout)
+                timer.start()
+            with LogCapture.LogWriter(
+                    LogCapture.getLogFilePath(logFilePath, self._logCapture),
+                    self._logCapture) as f:
+                for chunk in self._dc.exec_start(execId, stream=True):
+                    f.write(chunk)
+            # Stop the timeout from killing the container now that the
+            # job has finished.
+            with self._killLock:
+                self._warmContainerFinished = True
+            if timer is not None:
+                timer.cancel()
+            self._endTime = time.perf_counter()
+            # The container has run other jobs so only the peak memory
+            # usage is for this job.
+            resourceUsage = statsSampler.stop(withCounters=False)
+            if telemetry is not None:
+                telemetryFile = Telemetry.getTelemetryFile(self.workingDirectory)
+                telemetry.save(telemetryFile)
+
+            with self._killLock:
+                if not self._warmContainerTimedOut:
+                    exitCode = self._dc.exec_inspect(execId)['ExitCode']
+                containerInfo = self._dc.inspect_container(container=containerId)
+                # Containers that hit the memory limit are not reused so
+                # the flag is only set by this job.
+                self._outOfMemory = containerInfo['State']['OOMKilled']
+                assert isinstance(self._outOfMemory, bool)
+                if self._outOfMemory or not containerInfo['State']['Running']:
+                    self._warmContainerDiscard = True
+        except:
+            # Don't reuse a container that might be in a bad state
+            self._warmContainerDiscard = True
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if statsSampler is not None:
+                statsSampler.stop(withCounters=False)
+            self._releaseWarmContainer()
+            shutil.rmtree(self.warmContainerStagingDir, ignore_errors=True)
+            self._resource_pool.release_docker_client(self._dc)
+            self._dc = None
+            if self.resource_pinning and self._grabbed_cpus is not None:
+                self._cpu_pool.release_cpus(self._grabbed_cpus)
+                self._grabbed_cpus = None
+
+        if self._warmContainerTimedOut:
+            _logger.info('Timeout occurred')
+        return BackendResult(exitCode=exitCode,
+                             runTime=self._endTime - startTime,
+                             oot=self._warmContainerTimedOut,
+                             oom=self._outOfMemory,
+                             telemetryFile=telemetryFile,
+                             logFile=LogCapture.getLogFilePath(logFilePath, self._logCapture),
+                             **resourceUsage)
+
+    def _warmContainerTimeout(self):
+        # Called by the timer thread
+        with self._killLock:
+            if self._warmContainerFinished:
+                return
+            self._warmContainerTimedOut = True
+        self._killWarmContainer()
+
+    def _killWarmContainer(self):
+        # There is no API to kill an exec so kill the whole container.
+        # The container is not reused.
+        with self._killLock:
+            self._warmContainerDiscard = True
+            if self._container is None or self._dc is None:
+                return
+            _logger.info('Stopping container:{}'.format(self._container['Id']))
+            try:
+                self._dc.kill(self._container['Id'])
+            except docker.errors.APIError as e:
+                _logger.error('Failed to kill container:"{}".\n{}'.format(
+                    self._container['Id'], str(e)))
+
+    def _releaseWarmContainer(self):
+        with self._killLock:
+            container = self._container
+            self._container = None
+        if container is None:
+            return
+        if not self._warmContainerDiscard and self._resource_pool.release_warm_container(
+                self._warmContainerKey, container['Id'], self._warmContainerPoolSize):
+            return
+        self._resource_pool.discard_warm_container(container['Id'])
+        _logger.info('Destroying container:{}'.format(container['Id']))
+        try:
+            self._dc.remove_container(container=container['Id'], v=True, force=True)
+        except docker.errors.APIError as e:
+            _logger.error('Failed to remove container:"{}".\n{}'.format(
+                container['Id'], str(e)))
 
     def kill(self):
+        if self.useWarmContainers:
+            self._killWarmContainer()
+            return
         try:
             self._killLock.acquire()
             self._endTime = time.perf_counter()
@@ -666,14 +1033,8 @@ class DockerBackend(BackendBaseClass):
                     _logger.error('Failed to kill container:"{}".\n{}'.format(
                         self._container['Id'], str(e)))
 
-                # Write logs to file (note we get binary in Python 3, not sure
-                # about Python 2)
-                with open(self._logFilePath, 'wb') as f:
-                    logData = self._dc.logs(container=self._container['Id'],
-                                            stdout=True, stderr=True, timestamps=False,
-                                            tail='all', stream=False)
-                    _logger.info('Writing log to {}'.format(self._logFilePath))
-                    f.write(logData)
+                # The log stream ends once the container has stopped
+                self._finishLog()
 
                 # Record if OOM occurred
                 containerInfo = self._dc.inspect_container(
@@ -698,11 +1059,28 @@ class DockerBackend(BackendBaseClass):
                 self._resource_pool.release_docker_client(self._dc)
             self._dc = None
             if self.resource_pinning and self._grabbed_cpus is not None:
-                self._resource_pool.release_cpus(self._grabbed_cpus)
+                self._cpu_pool.release_cpus(self._grabbed_cpus)
                 self._grabbed_cpus = None
             self._killLock.release()
 
+    def _finishLog(self):
+        if self._logPump is not None:
+            if not self._logPump.join(LogCapture.LogSink.PUMP_JOIN_TIMEOUT):
+                _logger.warning('Log of container "{}" is still being written. Ignoring it'.format(
+                    self._container['Id']))
+            self._logPump = None
+        if self._logWriter is not None:
+            _logger.info('Wrote log to {}'.format(self._logFilePath))
+            self._logWriter.close()
+            self._logWriter = None
+
     def programPath(self):
+        if self.useWarmContainers:
+            if self._isInWarmContainerMount(self.hostProgramPath):
+                return self.hostProgramPath
+            return os.path.join(
+                self.warmContainerStagingDir,
+                os.path.basename(self.hostProgramPath))
         return '/tmp/{}'.format(os.path.basename(self.hostProgramPath))
 
     def checkToolExists(self, toolPath):
@@ -712,13 +1090,17 @@ class DockerBackend(BackendBaseClass):
         assert os.path.isabs(toolPath)
         # HACK: Is there a better way to do this?
         _logger.debug('Checking tool "{}" exists in image'.format(toolPath))
-        tempContainer = self._dc.create_container(image=self._dockerImage['Id'],
-                                                  command=['ls', toolPath])
-        _logger.debug('Created temporary container: {}'.format(
-            tempContainer['Id']))
-        self._dc.start(container=tempContainer['Id'])
-        exitCode = self._dc.wait(container=tempContainer['Id'])
-        self._dc.remove_container(container=tempContainer['Id'], force=True)
+        dc = self._resource_pool.get_docker_client()
+        try:
+            tempContainer = dc.create_container(image=self._dockerImage['Id'],
+                                                command=['ls', toolPath])
+            _logger.debug('Created temporary container: {}'.format(
+                tempContainer['Id']))
+            dc.start(container=tempContainer['Id'])
+            exitCode = dc.wait(container=tempContainer['Id'])
+            dc.remove_container(container=tempContainer['Id'], force=True)
+        finally:
+            self._resource_pool.release_docker_client(dc)
         if exitCode != 0:
             raise DockerBackendException(
                 'Tool "{}" does not exist in Docker image'.format(toolPath))
@@ -727,6 +1109,9 @@ class DockerBackend(BackendBaseClass):
     def workingDirectoryInternal(self):
         # Return the path to the working directory that will be used inside the
         # container
+        if self.useWarmContainers:
+            # The directory is mounted at the same path as on the host
+            return self.workingDirectory
         return self._workDirInsideContainer
 
     def addFileToBackend(self, path, read_only):
@@ -741,13 +1126,26 @@ class DockerBackend(BackendBaseClass):
         if not isinstance(read_only, bool):
             raise DockerBackendException('"read_only" must be boolean')
 
+        if self.useWarmContainers:
+            if self._isInWarmContainerMount(path):
+                self._additionalHostContainerFileMaps[path] = (path, read_only)
+                return
+            if not read_only or not os.path.isfile(path):
+                raise DockerBackendException(
+                    ('"{}" must be inside one of the "mounts" of "warm_containers" '
+                     'because it is writable or a directory').format(path))
+
         # FIXME: This mapping is lame. We could do something more sophisticated
         # to avoid this limitation.
         if fileName in self._usedFileMapNames:
             raise DockerBackendException(
                 'Mapping identicaly named file is not supported')
-        self._additionalHostContainerFileMaps[
-            path] = ( os.path.join('/tmp', fileName), read_only)
+        if self.useWarmContainers:
+            self._additionalHostContainerFileMaps[
+                path] = ( os.path.join(self.warmContainerStagingDir, fileName), read_only)
+        else:
+            self._additionalHostContainerFileMaps[
+                path] = ( os.path.join('/tmp', fileName), read_only)
         _logger.debug('Adding mapping "{}" => "{}"'.format(
             path,
             self._additionalHostContainerFileMaps[path])
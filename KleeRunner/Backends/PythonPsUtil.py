@@ -1,9 +1,13 @@
 # vim: set sw=4 ts=4 softtabstop=4 expandtab:
 from . BackendBase import *
+from .. import CpuPool
+from .. import LogCapture
+from .. import Telemetry
 import logging
 import os
 import pprint
 import psutil
+import signal
 import subprocess
 import threading
 import time
@@ -21,6 +25,201 @@ class PythonPsUtilBackendException(BackendException):
     pass
 
 
+# Ways of measuring the memory usage of a process
+MEMORY_ACCOUNTING_MODES = ['vms', 'rss', 'pss']
+
+
+def _getProcessPssInMiB(pid):
+    """
+      Returns the proportional set size of a process. This is read from
+      ``/proc/<pid>/smaps_rollup`` (Linux >= 4.14) which is much cheaper
+      than summing ``/proc/<pid>/smaps``.
+    """
+    try:
+        with open('/proc/{}/smaps_rollup'.format(pid), 'rb') as f:
+            for line in f:
+                if line.startswith(b'Pss:'):
+                    # Value is in KiB
+                    return int(line.split()[1]) / 1024.0
+    except (FileNotFoundError, ProcessLookupError):
+        raise psutil.NoSuchProcess(pid)
+    # Zombies have no mappings
+    return 0.0
+
+
+class _MonitoredJob:
+    def __init__(self, process, memory_limit, on_limit_exceeded, telemetry,
+                 memory_accounting):
+        self.process = process
+        self.memory_limit = memory_limit
+        self.on_limit_exceeded = on_limit_exceeded
+        self.limit_exceeded = False
+        self.memory_accounting = memory_accounting
+        # None until the job has been polled
+        self.peak_memory_usage = None
+        self.peak_rss = None
+        self.telemetry = telemetry
+        self.start_time = time.perf_counter()
+        # (time, total CPU time) at the last telemetry sample
+        self.last_cpu_sample = (self.start_time, 0.0)
+
+
+class ProcessMonitor:
+    """
+        Enforces the memory limits of all the jobs run by
+        ``PythonPsUtilBackend``, and records their telemetry, using a
+        single thread.
+
+        Each poll the parent of every process is read once, in a single
+        pass over ``/proc``. The process tree of each job is built from
+        this, rather than having a thread per job that calls
+        ``psutil.Process.children()`` (which scans ``/proc`` each time).
+        This keeps the cost of monitoring low as the number of parallel
+        jobs grows.
+    """
+    def __init__(self, poll_period):
+        assert isinstance(poll_period, float)
+        assert poll_period > 0.0
+        self._poll_period = poll_period
+        self._jobs = set()
+        self._cond = threading.Condition()
+        # Held whilst polling so `remove()` can wait for a poll to finish
+        self._poll_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def poll_period(self):
+        return self._poll_period
+
+    def add(self, process, memory_limit, on_limit_exceeded, telemetry=None,
+            memory_accounting='vms'):
+        """
+            Start monitoring ``process`` and its children.
+            ``on_limit_exceeded(memoryUsage)`` is called from a new
+            thread if their total memory usage exceeds ``memory_limit`` MiB.
+            A ``memory_limit`` of zero means there is no limit. Samples are
+            added to ``telemetry`` (a ``Telemetry.TelemetryRecorder``) if it
+            is not None. ``memory_accounting`` is one of
+            ``MEMORY_ACCOUNTING_MODES`` and says how the memory usage of each
+            process is measured.
+            Returns a handle to pass to ``remove()``. Its
+            ``peak_memory_usage`` and ``peak_rss`` are the highest total
+            memory usage and resident set size (in MiB) seen (None if the
+            job exited before it was polled).
+        """
+        assert isinstance(process, psutil.Process)
+        assert memory_limit >= 0
+        assert memory_accounting in MEMORY_ACCOUNTING_MODES
+        job = _MonitoredJob(process, memory_limit, on_limit_exceeded, telemetry,
+                            memory_accounting)
+        with self._cond:
+            self._jobs.add(job)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._thread_body, name='memory_poller', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        _logger.info('Monitoring memory use ({}) of PID {} with polling time period of {} seconds'.format(
+            memory_accounting, process.pid, self._poll_period))
+        return job
+
+    def remove(self, job):
+        """
+            Stop monitoring ``job``. When this returns the job's telemetry
+            will not be modified again.
+        """
+        with self._cond:
+            self._jobs.discard(job)
+        with self._poll_lock:
+            pass
+
+    def _thread_body(self):
+        while True:
+            with self._cond:
+                while len(self._jobs) == 0:
+                    self._cond.wait()
+            time.sleep(self._poll_period)
+            with self._poll_lock:
+                with self._cond:
+                    jobs = [j for j in self._jobs if not j.limit_exceeded]
+                if len(jobs) == 0:
+                    continue
+                try:
+                    self._poll(jobs)
+                except Exception: # pylint: disable=broad-except
+                    _logger.exception('Failed to poll memory usage')
+
+    def _poll(self, jobs):
+        children = dict()
+        # Note: `process_iter()` does not take `attrs` in the psutil
+        # version in requirements.txt.
+        for process in psutil.process_iter():
+            try:
+                ppid = process.ppid()
+            except psutil.NoSuchProcess:
+                continue
+            children.setdefault(ppid, []).append(process)
+
+        for job in jobs:
+            now = time.perf_counter()
+            sampleTelemetry = (job.telemetry is not None and
+                               job.telemetry.wantsSample(now - job.start_time))
+            totalMemoryUsage = 0.0
+            totalRss = 0.0
+            totalCpuTime = 0.0
+            totalOpenFiles = 0
+            processCount = 0
+            toVisit = [job.process]
+            while len(toVisit) > 0:
+                process = toVisit.pop()
+                try:
+                    memoryInfo = process.memory_info()
+                    totalRss += memoryInfo.rss / (2**20)
+                    if job.memory_accounting == 'pss':
+                        totalMemoryUsage += _getProcessPssInMiB(process.pid)
+                    else:
+                        totalMemoryUsage += getattr(
+                            memoryInfo, job.memory_accounting) / (2**20)
+                    if sampleTelemetry:
+                        cpuTimes = process.cpu_times()
+                        totalCpuTime += cpuTimes.user + cpuTimes.system
+                        totalOpenFiles += process.num_fds()
+                    processCount += 1
+                except psutil.NoSuchProcess:
+                    _logger.debug(
+                        'Process {} disappeared whilst examining its memory use'.format(
+                            process.pid))
+                    # The children will have been reparented
+                    continue
+                toVisit.extend(children.get(process.pid, []))
+
+            _logger.debug('Total memory usage of PID {} in MiB:{} ({} processes)'.format(
+                job.process.pid, totalMemoryUsage, processCount))
+            if job.peak_memory_usage is None or totalMemoryUsage > job.peak_memory_usage:
+                job.peak_memory_usage = totalMemoryUsage
+            if job.peak_rss is None or totalRss > job.peak_rss:
+                job.peak_rss = totalRss
+            if sampleTelemetry:
+                lastTime, lastCpuTime = job.last_cpu_sample
+                # CPU time of processes that have exited is lost so this
+                # can go down.
+                cpuPercent = max(0.0, 100.0 * (totalCpuTime - lastCpuTime) / (now - lastTime))
+                job.last_cpu_sample = (now, totalCpuTime)
+                job.telemetry.addSample(
+                    now - job.start_time, totalRss, cpuPercent, totalOpenFiles)
+            if job.memory_limit > 0 and totalMemoryUsage > job.memory_limit:
+                with self._cond:
+                    if job not in self._jobs:
+                        continue
+                    job.limit_exceeded = True
+                # Killing can wait so don't do it on this thread.
+                threading.Thread(
+                    target=job.on_limit_exceeded,
+                    args=(totalMemoryUsage,),
+                    name='memory_limit_kill-{}'.format(job.process.pid),
+                    daemon=True).start()
+
+
 class PythonPsUtilBackend(BackendBaseClass):
 
     def __init__(self, hostProgramPath, workingDirectory, timeLimit, memoryLimit, stackLimit, ctx, **kwargs):
@@ -42,20 +241,79 @@ class PythonPsUtilBackend(BackendBaseClass):
             raise PythonPsUtilBackendException(
                 '{} must be a float > 0.0'.format(memoryLimitTimePeriodKey))
 
+        # Virtual memory size is the default for compatibility with older
+        # configs but it counts shared libraries and address space that
+        # was reserved but never used.
+        self._memoryAccounting = kwargs.get('memory_accounting', 'vms')
+        if self._memoryAccounting not in MEMORY_ACCOUNTING_MODES:
+            raise PythonPsUtilBackendException(
+                '"memory_accounting" must be one of {}'.format(MEMORY_ACCOUNTING_MODES))
+        if self._memoryAccounting == 'pss' and not os.path.exists('/proc/self/smaps_rollup'):
+            raise PythonPsUtilBackendException(
+                '"memory_accounting" of "pss" needs /proc/<pid>/smaps_rollup (Linux >= 4.14)')
+
         self._process = None
-        self._eventObj = None
+        self._processGroup = None
+
+        # CPU and memory node pinning. The CPU pool is shared with other
+        # backends that support pinning.
+        self._cpu_pool = None
+        self._grabbed_cpus = None
+        self._mem_node = None
+        if 'resource_pinning' in kwargs:
+            try:
+                self._cpu_pool = CpuPool.getCpuPool(
+                    self.ctx,
+                    *CpuPool.parseResourcePinningOptions(
+                        kwargs['resource_pinning'], self.ctx.num_parallel_jobs))
+            except CpuPool.CpuPoolException as e:
+                raise PythonPsUtilBackendException(e.msg)
+            if self._cpu_pool.use_memset_of_nearest_node:
+                # Checked here so a missing module is reported before
+                # any job runs.
+                try:
+                    import numa # pylint: disable=unused-import
+                except ImportError:
+                    raise PythonPsUtilBackendException(
+                        'The numa module is required for "use_memset_of_nearest_node"')
+
+        try:
+            self._telemetryInterval = Telemetry.getTelemetryInterval(self.name, kwargs)
+        except Telemetry.TelemetryException as e:
+            raise PythonPsUtilBackendException(e.msg)
+
+        try:
+            self._logCapture = LogCapture.getLogCaptureOptions(self.name, kwargs)
+        except LogCapture.LogCaptureException as e:
+            raise PythonPsUtilBackendException(e.msg)
+
+        # The process monitor is shared between all backends. Backends using
+        # a different polling time period get a different monitor. Jobs
+        # are monitored even without a memory limit so that the peak
+        # resident set size of the whole process tree is known.
+        pollPeriod = self.memoryLimitPollTimePeriodInSeconds
+        if self._telemetryInterval is not None:
+            pollPeriod = min(pollPeriod, self._telemetryInterval)
+        monitorName = 'PythonPsUtilBackend.ProcessMonitor.{}'.format(pollPeriod)
+        self._monitor, success = self.ctx.get_object(monitorName)
+        if not success:
+            self.ctx.add_object(
+                monitorName,
+                ProcessMonitor(pollPeriod))
+            # Handle race. If someone managed to add a monitor before we
+            # did use theirs instead.
+            self._monitor, success = self.ctx.get_object(monitorName)
+            if not success:
+                raise PythonPsUtilBackendException('Failed to setup process monitor')
 
     @property
     def name(self):
         return "PythonPsUtil"
 
     def kill(self):
-        if self._process != None:
-            try:
-                if self._process.is_running():
-                    self._terminateProcess(self._process, 0.0)
-            except psutil.NoSuchProcess:
-                pass
+        processGroup = self._processGroup
+        if processGroup is not None:
+            self._terminateProcessGroup(processGroup, 0.0)
 
     def programPath(self):
         # We run directly on the host so nothing special here
@@ -74,75 +332,128 @@ class PythonPsUtilBackend(BackendBaseClass):
         exitCode = None
         self._process = None
         startTime = time.perf_counter()
-        pollThread = None
+        monitoredJob = None
+        telemetry = None
         self._outOfMemory = False
         outOfTime = False
         runTime = 0.0
-        with open(logFilePath, 'w') as f:
+        resourceUsage = {}
+        telemetryFile = None
+        memoryAccounting = None
+        peakMemoryUsage = None
+        with LogCapture.LogSink(logFilePath, self._logCapture) as logSink:
             try:
-                _logger.info('writing to log file {}'.format(logFilePath))
+                _logger.info('writing to log file {}'.format(logSink.path))
                 preExecFn = None
                 if self.stackLimit != None:
-                    preExecFn = self._setStacksize
+                    preExecFn = self._preExec
                     _logger.info('Using stacksize limit: {} KiB'.format(
                         'unlimited' if self.stackLimit == 0 else self.stackLimit))
+                if self._cpu_pool is not None:
+                    cpu_memset_tuples = self._cpu_pool.get_cpus()
+                    self._grabbed_cpus = set(map(lambda t: t[0], cpu_memset_tuples))
+                    _logger.info('Using CPU pinning: {}'.format(
+                        ",".join(map(str, sorted(self._grabbed_cpus)))))
+                    if self._cpu_pool.use_memset_of_nearest_node:
+                        # All the CPUs are in the same node
+                        self._mem_node = next(iter(cpu_memset_tuples))[1]
+                        _logger.info('Using Memset pinning: {}'.format(self._mem_node))
+                    preExecFn = self._preExec
                 # HACK: Use subprocess.Popen and then create the psutil wrapper
                 # around it because it returns the wrong exit code.
                 # This is a workaround for https://github.com/giampaolo/psutil/issues/960
+                # The tool is put in its own session (and so process group)
+                # so that it and all its children can be killed at once.
                 self._subprocess_process = subprocess.Popen(cmdLine,
                                              cwd=self.workingDirectory,
-                                             stdout=f,
-                                             stderr=f,
+                                             stdout=logSink.stdout,
+                                             stderr=logSink.stdout,
                                              env=envVars,
-                                             preexec_fn=preExecFn)
+                                             preexec_fn=preExecFn,
+                                             start_new_session=True)
+                self._processGroup = self._subprocess_process.pid
+                logSink.processStarted()
                 try:
                     self._process = psutil.Process(pid=self._subprocess_process.pid)
                 except psutil.NoSuchProcess as e:
                     # HACK: Catch case where process has already died
                     pass
 
-                if self.memoryLimit > 0:
-                    pollThread = self._memoryLimitPolling(self._process)
+                if self._process is not None:
+                    if self._telemetryInterval is not None:
+                        telemetry = Telemetry.TelemetryRecorder(self._telemetryInterval)
+                    monitoredJob = self._monitor.add(
+                        self._process,
+                        self.memoryLimit,
+                        self._onMemoryLimitExceeded,
+                        telemetry,
+                        self._memoryAccounting)
 
                 _logger.info(
                     'Running with timeout of {} seconds'.format(self.timeLimit))
-                exitCode = self._subprocess_process.wait(timeout=self.timeLimit)
-            except subprocess.TimeoutExpired as e:
-                outOfTime = True
-                # Note the code in the finally block will sort out clean up
+                exitCode, resourceUsage, outOfTime = waitForProcess(
+                    self._subprocess_process,
+                    self.timeLimit,
+                    self.kill)
             finally:
+                if monitoredJob is not None:
+                    self._monitor.remove(monitoredJob)
+                # This also kills any children left behind by the tool
                 self.kill()
-
-                # This is a sanity check to make sure that the memory polling thread exits
-                # before this method exits
-                if pollThread != None:
-                    if self._eventObj != None:
-                        self._eventObj.set()  # Wake up polling thread if it's blocked on eventObj
-                    _logger.debug('Joining memory polling thread START')
-                    try:
-                        pollThread.join()
-                        _logger.debug('Joining memory polling thread FINISHED')
-                    except RuntimeError:
-                        _logger.error(
-                            'RuntimeError waiting for memory polling thread to terminate')
+                self._processGroup = None
                 self._process = None
+                # The monitor marks the job before killing it on another
+                # thread so this catches kills that are still in progress.
+                if monitoredJob is not None:
+                    if monitoredJob.limit_exceeded:
+                        self._outOfMemory = True
+                    memoryAccounting = monitoredJob.memory_accounting
+                    peakMemoryUsage = monitoredJob.peak_memory_usage
+                    # The rusage only has the largest process
+                    if monitoredJob.peak_rss is not None and 'peakRss' in resourceUsage:
+                        resourceUsage['peakRss'] = max(
+                            resourceUsage['peakRss'], monitoredJob.peak_rss)
+                    _logger.info('Peak memory usage ({}): {} MiB'.format(
+                        memoryAccounting, peakMemoryUsage))
+                if telemetry is not None:
+                    telemetryFile = Telemetry.getTelemetryFile(self.workingDirectory)
+                    telemetry.save(telemetryFile)
+                if self._grabbed_cpus is not None:
+                    self._cpu_pool.release_cpus(self._grabbed_cpus)
+                    self._grabbed_cpus = None
+                    self._mem_node = None
 
                 endTime = time.perf_counter()
                 runTime = endTime - startTime
 
+        # NOTE: The resource usage does not include descendants that were
+        # not waited for by their parent (e.g. those killed by `kill()`).
         return BackendResult(exitCode=exitCode,
                              runTime=runTime,
                              oot=outOfTime,
                              oom=self._outOfMemory,
-                             userCpuTime=None,  # FIXME: Find a way to record this
-                             sysCpuTime=None)  # FIXME: Find a way to record this
+                             telemetryFile=telemetryFile,
+                             memoryAccounting=memoryAccounting,
+                             peakMemoryUsage=peakMemoryUsage,
+                             logFile=logSink.path,
+                             **resourceUsage)
 
-    def _setStacksize(self):
+    def _preExec(self):
         """
           Designed to be called subprocess.POpen() after fork.
-          It will set any limits as appropriate.
+          It will set any limits and pinning as appropriate.
           Note do not try to use the _logger here are the file descriptors have been changed.
         """
+        if self.stackLimit != None:
+            self._setStacksize()
+        if self._grabbed_cpus is not None:
+            os.sched_setaffinity(0, self._grabbed_cpus)
+        if self._mem_node is not None:
+            # The memory policy is inherited across exec()
+            import numa
+            numa.set_membind({self._mem_node})
+
+    def _setStacksize(self):
         assert self.stackLimit != None
         assert isinstance(self.stackLimit, int)
         import resource
@@ -153,103 +464,46 @@ class PythonPsUtilBackend(BackendBaseClass):
             resource.setrlimit(resource.RLIMIT_STACK,
                                (self.stackLimit, self.stackLimit))
 
-    def _getProcessMemoryUsageInMiB(self, process):
-        # use Virtual memory size rather than resident set
-        return process.memory_info()[1] / (2**20)
+    def _terminateProcessGroup(self, processGroup, pause):
+        """
+          Terminate every process in the process group of the tool. If
+          ``pause`` is greater than zero the processes are sent
+          ``SIGTERM`` and given up to ``pause`` seconds to exit before
+          being sent ``SIGKILL``.
 
-    def _terminateProcess(self, process, pause):
+          Processes that the tool moved to a different process group are
+          not killed.
+        """
         assert isinstance(pause, float)
         assert pause >= 0.0
-        # Gently terminate
-        _logger.debug('Trying to terminate PID:{}'.format(process.pid))
-        children = process.children(recursive=True)
-        process.terminate()
-        for child in children:
-            try:
-                _logger.debug(
-                    'Trying to terminate child process PID:{}'.format(child.pid))
-                child.terminate()
-            except psutil.NoSuchProcess:
-                pass
-
-        # If requested give the process time to clean up after itself
-        # if it is still running
-        if self._processIsRunning(process) and pause > 0.0:
-            time.sleep(pause)
-
-        # Now aggresively kill
-        _logger.info('Trying to kill PID:{}'.format(process.pid))
-        children = process.children(recursive=True)
-        process.kill()
-        for child in children:
-            try:
-                _logger.info(
-                    'Trying to kill child process PID:{}'.format(child.pid))
-                child.kill()
-            except psutil.NoSuchProcess:
-                pass
-
-    def _processIsRunning(self, process):
-        return process.is_running() and not process.status() == psutil.STATUS_ZOMBIE
-
-    def _memoryLimitPolling(self, process):
-        """
-          This function launches a new thread that will periodically
-          poll the total memory usage of the tool that is being run.
-          If it goes over the limit will kill it
-        """
-        assert self.memoryLimitPollTimePeriodInSeconds > 0
-        assert self._outOfMemory == False
-
-        # Other parts of the runner can can set on this to prevent this thread
-        # from waiting on this Event object.
-        self._eventObj = threading.Event()
-        self._eventObj.clear()
-
-        def threadBody():
-            _logger.info('Launching memory limit polling thread for PID {} with polling time period of {} seconds'.format(
-                process.pid, self.memoryLimitPollTimePeriodInSeconds))
-            try:
-                while self._processIsRunning(process):
-                    self._eventObj.wait(
-                        self.memoryLimitPollTimePeriodInSeconds)
-                    totalMemoryUsage = 0
-                    totalMemoryUsage += self._getProcessMemoryUsageInMiB(
-                        process)
-
-                    # The process might of forked so add the memory usage of
-                    # its children too
-                    childCount = 0
-                    for childProc in process.children(recursive=True):
-                        try:
-                            totalMemoryUsage += self._getProcessMemoryUsageInMiB(
-                                childProc)
-                            childCount += 1
-                        except psutil.NoSuchProcess:
-                            _logger.warning(
-                                'Child process disappeared whilst examining it\'s memory use')
-
-                    _logger.debug(
-                        'Total memory usage in MiB:{}'.format(totalMemoryUsage))
-                    _logger.debug(
-                        'Total number of children: {}'.format(childCount))
-
-                    if totalMemoryUsage > self.memoryLimit:
-                        _logger.warning('Memory limit reached (recorded {} MiB). Killing tool with PID {}'.format(
-                            totalMemoryUsage, process.pid))
-                        self._outOfMemory = True
-                        # Give the tool a chance to clean up after itself
-                        # before aggressively killing it
-                        self._terminateProcess(process, pause=1.0)
-                        break
-            except psutil.NoSuchProcess:
-                _logger.warning('Main process no longer available')
-
-        newThreadName = 'memory_poller-{}'.format(process.pid)
-        thread = threading.Thread(
-            target=threadBody, name=newThreadName, daemon=True)
-        thread.start()
-        return thread
+        try:
+            if pause > 0.0:
+                # Gently terminate
+                _logger.debug('Trying to terminate process group {}'.format(processGroup))
+                os.killpg(processGroup, signal.SIGTERM)
+                # Give the processes time to clean up after themselves
+                endTime = time.perf_counter() + pause
+                while time.perf_counter() < endTime:
+                    time.sleep(0.01)
+                    # Raises ProcessLookupError once the group is empty
+                    os.killpg(processGroup, 0)
+            # Now aggresively kill
+            _logger.debug('Trying to kill process group {}'.format(processGroup))
+            os.killpg(processGroup, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _onMemoryLimitExceeded(self, memoryUsage):
+        # Called by the process monitor from its own thread
+        processGroup = self._processGroup
+        if processGroup is None:
+            return
+        _logger.warning('Memory limit reached (recorded {} MiB). Killing tool with PID {}'.format(
+            memoryUsage, processGroup))
+        self._outOfMemory = True
+        # Give the tool a chance to clean up after itself
+        # before aggressively killing it
+        self._terminateProcessGroup(processGroup, pause=1.0)
 
     def checkToolExists(self, toolPath):
         assert os.path.isabs(toolPath)
@@ -0,0 +1,131 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import errno
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from ..RunnerContext import RunnerContext
+from . import CGroup
+
+
+class CGroupTest(unittest.TestCase):
+    """
+      Uses a directory that looks like a cgroup v2 hierarchy so the
+      cgroupfs writes can be checked without one.
+    """
+    @classmethod
+    def setUpClass(cls):
+        # So we can see debug output
+        logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='klee-runner-test-')
+        self.cgroup_root = os.path.join(self.root, 'cgroup')
+        os.mkdir(self.cgroup_root)
+        self.work_dir = os.path.join(self.root, 'workdir')
+        os.mkdir(self.work_dir)
+        self.write_file('cgroup.controllers', 'cpuset cpu io memory pids\n')
+        self.write_file('cgroup.subtree_control', '\n')
+        self.ctx = RunnerContext(num_parallel_jobs=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write_file(self, name, content, dir=None):
+        with open(os.path.join(dir or self.cgroup_root, name), 'w') as f:
+            f.write(content)
+
+    def read_file(self, name, dir=None):
+        with open(os.path.join(dir or self.cgroup_root, name), 'r') as f:
+            return f.read()
+
+    def make_backend(self, memoryLimit=0, **kwargs):
+        return CGroup.CGroupBackend(
+            sys.executable, self.work_dir, 0, memoryLimit, None, self.ctx,
+            cgroup_root=self.cgroup_root, **kwargs)
+
+    def test_setup_root_enables_controllers(self):
+        CGroup._setupCGroupRoot(self.cgroup_root, ['memory', 'cpu'])
+        self.assertEqual(self.read_file('cgroup.subtree_control'), '+memory +cpu')
+
+    def test_setup_root_only_enables_missing_controllers(self):
+        self.write_file('cgroup.subtree_control', 'memory\n')
+        CGroup._setupCGroupRoot(self.cgroup_root, ['memory', 'cpu'])
+        self.assertEqual(self.read_file('cgroup.subtree_control'), '+cpu')
+        with mock.patch.object(CGroup, '_writeCGroupFile') as writeMock:
+            self.write_file('cgroup.subtree_control', 'memory cpu\n')
+            CGroup._setupCGroupRoot(self.cgroup_root, ['memory', 'cpu'])
+            writeMock.assert_not_called()
+
+    def test_setup_root_missing_controller(self):
+        self.write_file('cgroup.controllers', 'cpu\n')
+        with self.assertRaises(CGroup.CGroupBackendException) as cm:
+            CGroup._setupCGroupRoot(self.cgroup_root, ['memory', 'cpu'])
+        self.assertIn('memory', str(cm.exception))
+
+    def test_setup_root_does_not_exist(self):
+        with self.assertRaises(CGroup.CGroupBackendException):
+            CGroup._setupCGroupRoot(os.path.join(self.root, 'missing'), ['memory'])
+
+    def test_setup_root_containing_processes(self):
+        with mock.patch.object(
+                CGroup, '_writeCGroupFile',
+                side_effect=OSError(errno.EBUSY, os.strerror(errno.EBUSY))):
+            with self.assertRaises(CGroup.CGroupBackendException) as cm:
+                CGroup._setupCGroupRoot(self.cgroup_root, ['memory'])
+        self.assertIn('contains processes', str(cm.exception))
+
+    def test_root_setup_once(self):
+        with mock.patch.object(CGroup, '_setupCGroupRoot') as setupMock:
+            self.make_backend(memoryLimit=100)
+            self.make_backend(memoryLimit=100)
+        setupMock.assert_called_once_with(self.cgroup_root, ['memory'])
+
+    def test_create_cgroup(self):
+        backend = self.make_backend(memoryLimit=100, cpu_limit=1.5)
+        path = backend._createCGroup()
+        self.assertEqual(os.path.dirname(path), self.cgroup_root)
+        self.assertEqual(self.read_file('memory.max', path), str(100 * (2**20)))
+        self.assertEqual(self.read_file('memory.oom.group', path), '1')
+        self.assertEqual(self.read_file('cpu.max', path), '150000 100000')
+        # The kernel does not account swap
+        self.assertFalse(os.path.exists(os.path.join(path, 'memory.swap.max')))
+
+    def create_cgroup_with_swap(self, **kwargs):
+        backend = self.make_backend(memoryLimit=100, **kwargs)
+        mkdir = os.mkdir
+
+        def mkdirWithSwap(path):
+            # The kernel creates the interface files
+            mkdir(path)
+            self.write_file('memory.swap.max', 'max\n', path)
+        with mock.patch.object(CGroup.os, 'mkdir', side_effect=mkdirWithSwap):
+            path = backend._createCGroup()
+        return self.read_file('memory.swap.max', path)
+
+    def test_create_cgroup_disables_swap(self):
+        self.assertEqual(self.create_cgroup_with_swap(), '0')
+
+    def test_create_cgroup_allow_swap(self):
+        self.assertEqual(self.create_cgroup_with_swap(allow_swap=True), 'max\n')
+
+    def test_create_cgroup_removed_on_failure(self):
+        backend = self.make_backend(memoryLimit=100)
+        with mock.patch.object(
+                CGroup, '_writeCGroupFile',
+                side_effect=OSError(errno.EACCES, os.strerror(errno.EACCES))):
+            with self.assertRaises(OSError):
+                backend._createCGroup()
+        self.assertEqual(
+            sorted(os.listdir(self.cgroup_root)),
+            ['cgroup.controllers', 'cgroup.subtree_control'])
+
+    def test_read_keyed_file(self):
+        self.write_file('memory.events', 'low 0\nhigh 0\nmax 3\noom 1\noom_kill 1\n')
+        self.assertEqual(
+            CGroup.readCGroupKeyedFile(os.path.join(self.cgroup_root, 'memory.events')),
+            {'low': 0, 'high': 0, 'max': 3, 'oom': 1, 'oom_kill': 1})
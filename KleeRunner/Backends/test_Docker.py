@@ -0,0 +1,228 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from ..RunnerContext import RunnerContext
+from .. import Telemetry
+from .BackendBase import BackendException
+
+try:
+    from . import Docker
+except BackendException:
+    # The docker module is not installed
+    Docker = None
+
+_IMAGE = {'Id': 'sha256:0123456789abcdef', 'RepoTags': ['klee:latest']}
+
+
+def make_docker_client():
+    """
+        Returns a mock ``docker.APIClient`` where every exec exits
+        successfully.
+    """
+    dc = mock.MagicMock()
+    dc.images.return_value = [_IMAGE]
+    containerIds = iter('container{}'.format(i) for i in range(100))
+    dc.create_container.side_effect = lambda **kwargs: {
+        'Id': next(containerIds), 'Warnings': None}
+    dc.exec_create.return_value = {'Id': 'exec'}
+    dc.exec_start.side_effect = lambda execId, stream: iter([b'output\n'])
+    dc.exec_inspect.return_value = {'ExitCode': 0}
+    dc.inspect_container.return_value = {
+        'State': {'OOMKilled': False, 'Running': True}}
+    dc.stats.side_effect = lambda **kwargs: iter([])
+    return dc
+
+
+@unittest.skipIf(Docker is None, 'docker module is not installed')
+class WarmContainerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # So we can see debug output
+        logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='klee-runner-test-')
+        self.program = os.path.join(self.root, 'program')
+        with open(self.program, 'w') as f:
+            f.write('')
+        self.ctx = RunnerContext(num_parallel_jobs=1)
+        self.dc = make_docker_client()
+        patcher = mock.patch('docker.APIClient', return_value=self.dc)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.numWorkDirs = 0
+
+    def tearDown(self):
+        pool, success = self.ctx.get_object('DockerBackend.ResourcePool')
+        if success:
+            # Uses the mock client
+            pool.remove_warm_containers()
+        shutil.rmtree(self.root)
+
+    def make_backend(self, timeLimit=0, **kwargs):
+        workDir = os.path.join(self.root, 'workdir-{}'.format(self.numWorkDirs))
+        self.numWorkDirs += 1
+        os.mkdir(workDir)
+        return Docker.DockerBackend(
+            self.program, workDir, timeLimit, 0, None, self.ctx,
+            image='klee:latest', warm_containers={'pool_size': 1}, **kwargs)
+
+    def run_backend(self, backend):
+        return backend.run(
+            [self.program],
+            os.path.join(backend.workingDirectory, 'log.txt'),
+            {})
+
+    def test_container_reused(self):
+        for _ in range(2):
+            result = self.run_backend(self.make_backend())
+            self.assertEqual(result.exitCode, 0)
+            self.assertFalse(result.outOfTime)
+            self.assertFalse(result.outOfMemory)
+        self.assertEqual(self.dc.create_container.call_count, 1)
+        self.assertEqual(self.dc.exec_create.call_count, 2)
+        self.dc.remove_container.assert_not_called()
+
+    def test_timed_out_container_discarded(self):
+        killed = threading.Event()
+        self.dc.kill.side_effect = lambda containerId: killed.set()
+
+        def execUntilKilled(execId, stream):
+            killed.wait(30)
+            yield b'output\n'
+        self.dc.exec_start.side_effect = execUntilKilled
+        result = self.run_backend(self.make_backend(timeLimit=1))
+        self.assertTrue(result.outOfTime)
+        self.assertIsNone(result.exitCode)
+        self.dc.remove_container.assert_called_once_with(
+            container='container0', v=True, force=True)
+
+        # The next job gets a new container
+        self.dc.exec_start.side_effect = lambda execId, stream: iter([])
+        result = self.run_backend(self.make_backend())
+        self.assertEqual(result.exitCode, 0)
+        self.assertEqual(self.dc.create_container.call_count, 2)
+
+    def test_timeout_after_exit_ignored(self):
+        # The timer firing once the exec has finished must not kill
+        # the container or change the result.
+        backend = self.make_backend(timeLimit=60)
+        timer = threading.Thread(target=backend._warmContainerTimeout)
+
+        def inspectAfterTimeout(execId):
+            timer.start()
+            return {'ExitCode': 3}
+        self.dc.exec_inspect.side_effect = inspectAfterTimeout
+        result = self.run_backend(backend)
+        timer.join()
+        self.assertFalse(result.outOfTime)
+        self.assertEqual(result.exitCode, 3)
+        self.dc.kill.assert_not_called()
+        self.dc.remove_container.assert_not_called()
+
+    def test_out_of_memory_container_discarded(self):
+        self.dc.inspect_container.return_value = {
+            'State': {'OOMKilled': True, 'Running': True}}
+        result = self.run_backend(self.make_backend())
+        self.assertTrue(result.outOfMemory)
+        self.dc.remove_container.assert_called_once_with(
+            container='container0', v=True, force=True)
+
+    def test_pinning_applied_for_each_job(self):
+        pinning = {'cpu_ids': [0], 'cpus_per_job': 1, 'use_memset_of_nearest_node': False}
+        for _ in range(2):
+            result = self.run_backend(self.make_backend(resource_pinning=pinning))
+            self.assertEqual(result.exitCode, 0)
+        # The pinning is not part of what the container was created with
+        self.assertEqual(self.dc.create_container.call_count, 1)
+        self.assertNotIn('cpuset_cpus', self.dc.create_host_config.call_args[1])
+        self.assertEqual(
+            self.dc.update_container.call_args_list,
+            [mock.call(container='container0', cpuset_cpus='0')] * 2)
+
+
+def make_stats(usage, cache, user, system, read, write):
+    """
+        Returns a sample from the Docker stats API. The memory is in MiB,
+        the CPU times in seconds and the I/O in bytes.
+    """
+    return {
+        'memory_stats': {'usage': usage * 2**20, 'stats': {'cache': cache * 2**20}},
+        'cpu_stats': {'cpu_usage': {
+            'total_usage': (user + system) * 10**9,
+            'usage_in_usermode': user * 10**9,
+            'usage_in_kernelmode': system * 10**9}},
+        'blkio_stats': {'io_service_bytes_recursive': [
+            {'major': 8, 'minor': 0, 'op': 'Read', 'value': read},
+            {'major': 8, 'minor': 0, 'op': 'Write', 'value': write},
+            {'major': 8, 'minor': 0, 'op': 'Total', 'value': read + write}]},
+    }
+
+
+@unittest.skipIf(Docker is None, 'docker module is not installed')
+class ContainerStatsSamplerTest(unittest.TestCase):
+    def sample(self, stats, *args):
+        dc = make_docker_client()
+        dc.stats.side_effect = lambda **kwargs: iter(stats)
+        with mock.patch('docker.APIClient', return_value=dc):
+            sampler = Docker._ContainerStatsSampler('container0', *args)
+            sampler.start()
+            # The stream ends after the last sample
+            sampler._thread.join()
+        return sampler
+
+    def test_resource_usage(self):
+        sampler = self.sample([
+            make_stats(200, 50, 1, 1, 100, 200),
+            make_stats(180, 100, 2, 1, 300, 400),
+            # Sent once the container has stopped
+            {'memory_stats': {}, 'cpu_stats': {}},
+        ])
+        resourceUsage = sampler.stop(withCounters=True)
+        self.assertEqual(resourceUsage, {
+            'peakRss': 150.0,
+            'userCpuTime': 2.0,
+            'sysCpuTime': 1.0,
+            'blockReadBytes': 300,
+            'blockWriteBytes': 400,
+        })
+        # Only the peak is for the job if the container ran other jobs
+        self.assertEqual(sampler.stop(withCounters=False), {'peakRss': 150.0})
+
+    def test_no_samples(self):
+        sampler = self.sample([])
+        self.assertEqual(sampler.stop(withCounters=True), {'peakRss': None})
+
+    def sample_telemetry(self, stats, *args):
+        recorder = Telemetry.TelemetryRecorder(1e-6)
+        self.sample(stats, recorder, time.perf_counter(), *args)
+        root = tempfile.mkdtemp(prefix='klee-runner-test-')
+        self.addCleanup(shutil.rmtree, root)
+        path = Telemetry.getTelemetryFile(root)
+        recorder.save(path)
+        return Telemetry.loadTelemetry(path)
+
+    def test_telemetry(self):
+        telemetry = self.sample_telemetry([
+            make_stats(200, 50, 1, 1, 100, 200),
+            make_stats(180, 100, 2, 1, 300, 400),
+        ], 0.0)
+        self.assertEqual(list(telemetry.rss), [150.0, 80.0])
+        self.assertEqual(telemetry.peakRss, 150.0)
+        # Not available from the stats API
+        self.assertEqual(list(telemetry.open_files), [-1, -1])
+
+    def test_telemetry_without_start_cpu_time(self):
+        # The first sample is only used for the CPU time
+        telemetry = self.sample_telemetry([
+            make_stats(200, 50, 1, 1, 100, 200),
+            make_stats(180, 100, 2, 1, 300, 400),
+        ])
+        self.assertEqual(list(telemetry.rss), [80.0])
@@ -0,0 +1,213 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import os
+import psutil
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from ..RunnerContext import RunnerContext
+from .PythonPsUtil import PythonPsUtilBackend, PythonPsUtilBackendException, _getProcessPssInMiB
+
+# Allocates (and touches) the given number of MiB then sleeps
+_ALLOCATE_PROGRAM = 'import sys, time; x = b"a" * (int(sys.argv[1]) * 2**20); time.sleep(20)'
+
+# Runs two children that each allocate 100 MiB, then writes a file
+_TREE_PROGRAM = """
+import os, subprocess, sys
+children = [subprocess.Popen([sys.executable, '-c',
+            'import time; x = b"a" * (100 * 2**20); time.sleep(1)']) for _ in range(2)]
+for child in children:
+    child.wait()
+with open('out.bin', 'wb') as f:
+    f.write(b'a' * (4 * 2**20))
+    os.fsync(f.fileno())
+"""
+
+# Starts two children, writes the PIDs of the tree to the file given as
+# the first argument then sleeps. Every process ignores SIGTERM.
+_IGNORE_SIGTERM_PROGRAM = """
+import os, signal, subprocess, sys, time
+signal.signal(signal.SIGTERM, signal.SIG_IGN)
+children = [subprocess.Popen([sys.executable, '-c',
+            'import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(60)'])
+            for _ in range(2)]
+with open(sys.argv[1] + '.tmp', 'w') as f:
+    f.write(' '.join(str(p) for p in [os.getpid()] + [c.pid for c in children]))
+os.rename(sys.argv[1] + '.tmp', sys.argv[1])
+time.sleep(60)
+"""
+
+class PythonPsUtilTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # So we can see debug output
+        logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='klee-runner-test-')
+        self.ctx = RunnerContext(num_parallel_jobs=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def run_allocate(self, allocationInMiB, memoryLimit, timeLimit, memoryAccounting='rss'):
+        backend = PythonPsUtilBackend(
+            sys.executable,
+            self.work_dir,
+            timeLimit,
+            memoryLimit,
+            None,
+            self.ctx,
+            memory_limit_poll_time_period=0.1,
+            memory_accounting=memoryAccounting)
+        return backend.run(
+            [sys.executable, '-c', _ALLOCATE_PROGRAM, str(allocationInMiB)],
+            os.path.join(self.work_dir, 'log.txt'),
+            {})
+
+    def test_memory_limit_kills_job(self):
+        result = self.run_allocate(allocationInMiB=300, memoryLimit=100, timeLimit=60)
+        self.assertTrue(result.outOfMemory)
+        self.assertFalse(result.outOfTime)
+        self.assertNotEqual(result.exitCode, 0)
+        # Killed well before the program would have exited by itself
+        self.assertLess(result.runTime, 15.0)
+        self.assertGreater(result.peakMemoryUsage, 100.0)
+        self.assertEqual(result.memoryAccounting, 'rss')
+
+    def test_job_under_memory_limit_not_killed(self):
+        result = self.run_allocate(allocationInMiB=10, memoryLimit=500, timeLimit=1)
+        self.assertFalse(result.outOfMemory)
+        self.assertTrue(result.outOfTime)
+        self.assertIsNotNone(result.peakMemoryUsage)
+        self.assertLess(result.peakMemoryUsage, 500.0)
+
+    @unittest.skipIf(not os.path.exists('/proc/self/smaps_rollup'),
+                     '/proc/<pid>/smaps_rollup is not available')
+    def test_pss_memory_limit_kills_job(self):
+        result = self.run_allocate(
+            allocationInMiB=300, memoryLimit=100, timeLimit=60, memoryAccounting='pss')
+        self.assertTrue(result.outOfMemory)
+        self.assertLess(result.runTime, 15.0)
+        self.assertGreater(result.peakMemoryUsage, 100.0)
+        self.assertEqual(result.memoryAccounting, 'pss')
+
+    def test_vms_is_default_memory_accounting(self):
+        backend = PythonPsUtilBackend(
+            sys.executable, self.work_dir, 1, 500, None, self.ctx)
+        result = backend.run(
+            [sys.executable, '-c', _ALLOCATE_PROGRAM, '10'],
+            os.path.join(self.work_dir, 'log.txt'),
+            {})
+        self.assertEqual(result.memoryAccounting, 'vms')
+        self.assertIsNotNone(result.peakMemoryUsage)
+
+    def test_invalid_memory_accounting(self):
+        with self.assertRaises(PythonPsUtilBackendException):
+            PythonPsUtilBackend(
+                sys.executable, self.work_dir, 0, 100, None, self.ctx,
+                memory_accounting='uss')
+
+    @unittest.skipIf(not os.path.exists('/proc/self/smaps_rollup'),
+                     '/proc/<pid>/smaps_rollup is not available')
+    def test_process_pss(self):
+        pss = _getProcessPssInMiB(os.getpid())
+        self.assertGreater(pss, 0.0)
+        self.assertLessEqual(pss, psutil.Process().memory_info().rss / (2**20))
+        with self.assertRaises(psutil.NoSuchProcess):
+            # PIDs are never this large
+            _getProcessPssInMiB(2**31)
+
+    def test_resource_usage_of_process_tree(self):
+        backend = PythonPsUtilBackend(
+            sys.executable,
+            self.work_dir,
+            60,
+            0,
+            None,
+            self.ctx)
+        result = backend.run(
+            [sys.executable, '-c', _TREE_PROGRAM],
+            os.path.join(self.work_dir, 'log.txt'),
+            {})
+        self.assertEqual(result.exitCode, 0)
+        # The children are alive at the same time so the sum over the
+        # tree is larger than any single process.
+        self.assertGreater(result.peakRss, 190.0)
+        self.assertGreaterEqual(result.blockWriteBytes, 4 * 2**20)
+        self.assertIsNotNone(result.blockReadBytes)
+        self.assertGreater(result.minorPageFaults, 0)
+        self.assertGreater(result.userCpuTime + result.sysCpuTime, 0.0)
+
+    def assertProcessesGone(self, pids):
+        # SIGKILL is delivered asynchronously so the children (that were
+        # not waited for) might still be exiting.
+        endTime = time.perf_counter() + 10.0
+        for pid in pids:
+            while True:
+                try:
+                    # Children are re-parented so might not have been reaped
+                    if psutil.Process(pid).status() == psutil.STATUS_ZOMBIE:
+                        break
+                except psutil.NoSuchProcess:
+                    break
+                self.assertLess(time.perf_counter(), endTime,
+                                'Process {} is still running'.format(pid))
+                time.sleep(0.01)
+
+    def run_ignore_sigterm(self, timeLimit, memoryLimit=0, onStarted=None):
+        memoryOptions = dict()
+        if memoryLimit > 0:
+            memoryOptions = {
+                'memory_limit_poll_time_period': 0.1,
+                'memory_accounting': 'rss',
+            }
+        backend = PythonPsUtilBackend(
+            sys.executable,
+            self.work_dir,
+            timeLimit,
+            memoryLimit,
+            None,
+            self.ctx,
+            **memoryOptions)
+        pidFile = os.path.join(self.work_dir, 'pids.txt')
+        thread = None
+        if onStarted is not None:
+            def waitForPids():
+                while not os.path.exists(pidFile):
+                    time.sleep(0.01)
+                onStarted(backend)
+            thread = threading.Thread(target=waitForPids)
+            thread.start()
+        result = backend.run(
+            [sys.executable, '-c', _IGNORE_SIGTERM_PROGRAM, pidFile],
+            os.path.join(self.work_dir, 'log.txt'),
+            {})
+        if thread is not None:
+            thread.join()
+        with open(pidFile, 'r') as f:
+            pids = [int(pid) for pid in f.read().split()]
+        self.assertEqual(len(pids), 3)
+        self.assertProcessesGone(pids)
+        return result
+
+    def test_timeout_kills_process_tree_ignoring_sigterm(self):
+        result = self.run_ignore_sigterm(timeLimit=2)
+        self.assertTrue(result.outOfTime)
+        self.assertLess(result.runTime, 15.0)
+
+    def test_memory_limit_kills_process_tree_ignoring_sigterm(self):
+        # The interpreters are over the limit once they have started
+        result = self.run_ignore_sigterm(timeLimit=60, memoryLimit=1)
+        self.assertTrue(result.outOfMemory)
+        self.assertLess(result.runTime, 15.0)
+
+    def test_kill_kills_process_tree_ignoring_sigterm(self):
+        result = self.run_ignore_sigterm(
+            timeLimit=60, onStarted=lambda backend: backend.kill())
+        self.assertFalse(result.outOfTime)
+        self.assertLess(result.runTime, 15.0)
@@ -0,0 +1,239 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+"""
+Allocation of CPUs (and optionally the memory node nearest to them) to
+jobs for backends that support resource pinning. A single pool is
+shared by all the backends using a ``RunnerContext`` so jobs running in
+parallel never share a CPU.
+"""
+import functools
+import logging
+import os
+import threading
+
+_logger = logging.getLogger(__name__)
+
+
+class CpuPoolException(Exception):
+
+    def __init__(self, msg):
+        # pylint: disable=super-init-not-called
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+class CpuPool:
+    """
+        Pool of CPUs. ``get_cpus()`` hands out ``cpus_per_job`` CPUs to a
+        job which must return them using ``release_cpus()`` when it
+        finishes.
+
+        If ``use_memset_of_nearest_node`` is True the CPUs handed out are
+        all in the same NUMA node so the job's memory can be bound to
+        that node.
+    """
+    def __init__(self, available_cpu_ids, cpus_per_job, use_memset_of_nearest_node):
+        assert isinstance(available_cpu_ids, set)
+        assert len(available_cpu_ids) > 0
+        assert isinstance(cpus_per_job, int)
+        assert cpus_per_job > 0
+        assert isinstance(use_memset_of_nearest_node, bool)
+        self._available_cpu_ids = available_cpu_ids
+        self._cpus_per_job = cpus_per_job
+        self._use_memset_of_nearest_node = use_memset_of_nearest_node
+
+        self._numa_nodes = dict() # Maps NUMA node to set of CPU ids
+        self._numa_node_pool = dict() # Maps NUMa node to set of available CPU ids
+
+        self._lock = threading.Lock()
+
+    @property
+    def available_cpu_ids(self):
+        return self._available_cpu_ids
+
+    @property
+    def cpus_per_job(self):
+        return self._cpus_per_job
+
+    @property
+    def use_memset_of_nearest_node(self):
+        return self._use_memset_of_nearest_node
+
+    def _get_numa_node_cpus(self):
+        """
+            Returns a dictionary mapping each NUMA node to the list of
+            its CPU ids. If NUMA is not available and memory set pinning
+            is not required all CPUs are treated as being in node 0.
+        """
+        numa = None
+        try:
+            import numa
+            if not numa.available():
+                numa = None
+        except ImportError:
+            pass
+        if numa is None:
+            if self._use_memset_of_nearest_node:
+                raise CpuPoolException('NUMA not available')
+            _logger.info('NUMA not available. Treating all CPUs as being in node 0')
+            return { 0: sorted(os.sched_getaffinity(0)) }
+        return {
+            numa_node: numa.node_to_cpus(numa_node)
+            for numa_node in range(0, numa.get_max_node() + 1)
+        }
+
+    def _lazy_init(self):
+        # Implicitly assume lock is already held
+        if len(self._numa_nodes) != 0:
+            # Init already happened
+            return
+        cpu_count = 0
+        for numa_node, cpus in self._get_numa_node_cpus().items():
+            for cpu_id in cpus:
+                if cpu_id in self._available_cpu_ids:
+                    self._numa_nodes.setdefault(numa_node, set()).add(cpu_id)
+                    self._numa_node_pool.setdefault(numa_node, set()).add(cpu_id)
+                    _logger.info('Putting CPU {} in NUMA node {} in resource pool'.format(
+                        cpu_id, numa_node))
+                    cpu_count += 1
+                else:
+                    _logger.info('CPU {} in NUMA node {} is NOT IN resource pool'.format(
+                        cpu_id, numa_node))
+
+        if cpu_count == 0:
+            raise CpuPoolException('Found no available CPUs')
+        if cpu_count != len(self._available_cpu_ids):
+            raise CpuPoolException(
+                'Mismatch between provided available CPU ids and what was found on system')
+        assert len(self._numa_node_pool) == len(self._numa_nodes)
+
+    def get_cpus(self):
+        """
+            Returns a set of ``(CPU id, NUMA node)`` tuples for a single job
+        """
+        with self._lock:
+            self._lazy_init()
+            cpu_memset_tuples_to_return = set()
+            if self._use_memset_of_nearest_node:
+                for numa_node, available_cpus in sorted(
+                    self._numa_node_pool.items(), key=lambda x:x[0]):
+                    if len(available_cpus) >= self._cpus_per_job:
+                        for _ in range(0, self._cpus_per_job):
+                            cpu = available_cpus.pop()
+                            cpu_memset_tuples_to_return.add( (cpu, numa_node) )
+                        break # We are done
+            else:
+                # Grab any available CPU
+                available_cpus = set(functools.reduce(
+                    lambda a,b: a.union(b),
+                    self._numa_node_pool.values()))
+                cpus_to_grab = set()
+                if len(available_cpus) >= self._cpus_per_job:
+                    for _ in range(0, self._cpus_per_job):
+                        cpus_to_grab.add(available_cpus.pop())
+                    # Now remove from pool
+                    for numa_node, available_cpus_in_node in sorted(
+                        self._numa_node_pool.items(), key=lambda x:x[0]):
+                        for cpu_to_grab in cpus_to_grab:
+                            if cpu_to_grab in available_cpus_in_node:
+                                cpu_memset_tuples_to_return.add( (cpu_to_grab, numa_node) )
+                                available_cpus_in_node.remove(cpu_to_grab)
+
+            if len(cpu_memset_tuples_to_return) != self._cpus_per_job:
+                _logger.error('Failed to retrieve CPU resources required for job')
+                _logger.error('cpu_memset_tuples_to_return: {}'.format(cpu_memset_tuples_to_return))
+                _logger.error('cpus_per_job: {}'.format(self._cpus_per_job))
+                # Don't leak the CPUs we did grab
+                for cpu, numa_node in cpu_memset_tuples_to_return:
+                    self._numa_node_pool[numa_node].add(cpu)
+                raise CpuPoolException('Failed to retrieve CPU resources required for job')
+            return cpu_memset_tuples_to_return
+
+    def release_cpus(self, cpu_ids):
+        """
+            Returns a set of CPU ids
+        """
+        with self._lock:
+            self._lazy_init()
+            assert isinstance(cpu_ids, set)
+            for item in cpu_ids:
+                assert isinstance(item, int)
+            for cpu_to_release in cpu_ids:
+                released=False
+                for numa_node, available_cpu_ids in self._numa_node_pool.items():
+                    if cpu_to_release in self._numa_nodes[numa_node]:
+                        available_cpu_ids.add(cpu_to_release)
+                        released = True
+                        break
+                if not released:
+                    raise CpuPoolException('Failed to return CPU {} to pool'.format(cpu_to_release))
+
+
+def parseResourcePinningOptions(value, num_parallel_jobs):
+    """
+        Check the ``resource_pinning`` backend option ``value``.
+        Returns a tuple ``(available_cpu_ids, cpus_per_job,
+        use_memset_of_nearest_node)``.
+    """
+    if not isinstance(value, dict):
+        raise CpuPoolException(
+        'resource_pinning should map to a dictionary')
+    if 'cpu_ids' not in value:
+        raise CpuPoolException(
+        'cpu_ids key must be present in resource_pinning')
+    available_cpu_ids = value['cpu_ids']
+    if not isinstance(available_cpu_ids, list):
+        raise CpuPoolException(
+        'cpu_ids must be a list')
+    # Turn into a set
+    available_cpu_ids = set(available_cpu_ids)
+    if len(available_cpu_ids) == 0:
+        raise CpuPoolException(
+        'cpu_ids must not be empty')
+    for cpu_id in available_cpu_ids:
+        if not (isinstance(cpu_id, int) and cpu_id >= 0):
+            raise CpuPoolException(
+            'cpu_ids must only contain integers >= 0')
+    if 'cpus_per_job' not in value:
+        raise CpuPoolException(
+        'cpus_per_job key must be present in resource_pinning')
+    cpus_per_job = value['cpus_per_job']
+    if not isinstance(cpus_per_job, int):
+        raise CpuPoolException(
+        'cpus_per_job must be an integer')
+    if cpus_per_job < 1:
+        raise CpuPoolException(
+        'cpus_per_job >= 1')
+    use_memset_of_nearest_node = value.get('use_memset_of_nearest_node', False)
+    if not isinstance(use_memset_of_nearest_node, bool):
+        raise CpuPoolException(
+        'use_memset_of_nearest_node must be a bool')
+    # Sanity check
+    if (num_parallel_jobs * cpus_per_job) > len(available_cpu_ids):
+        raise CpuPoolException(
+        'Number of cpus required exceeds number of available CPUs')
+    return (available_cpu_ids, cpus_per_job, use_memset_of_nearest_node)
+
+
+def getCpuPool(ctx, available_cpu_ids, cpus_per_job, use_memset_of_nearest_node):
+    """
+        Returns the ``CpuPool`` shared by all backends using the
+        ``RunnerContext`` ``ctx``, creating it if necessary.
+    """
+    cpu_pool, success = ctx.get_object('CpuPool')
+    if not success:
+        ctx.add_object(
+            'CpuPool',
+            CpuPool(available_cpu_ids, cpus_per_job, use_memset_of_nearest_node))
+        # Handle race. If someone managed to add a pool before we did use
+        # theirs instead.
+        cpu_pool, success = ctx.get_object('CpuPool')
+        if not success:
+            raise CpuPoolException('Failed to setup CPU pool')
+    if (cpu_pool.available_cpu_ids != available_cpu_ids or
+        cpu_pool.cpus_per_job != cpus_per_job or
+        cpu_pool.use_memset_of_nearest_node != use_memset_of_nearest_node):
+        raise CpuPoolException(
+            'All backends must use the same resource_pinning options')
+    return cpu_pool
@@ -102,3 +102,35 @@ def writeYAMLOutputFile(yamlOutputFilePath, data):
         f.write('# Generated by klee-runner\n')
         f.write(result)
     return
+
+
+def writeYAMLOutputFileStreamingResults(yamlOutputFilePath, data, results):
+    """
+      Like ``writeYAMLOutputFile()`` but the ``results`` key is populated
+      from the iterable ``results`` one item at a time so that the complete
+      list of results never needs to be held in memory. The output is
+      identical to calling ``writeYAMLOutputFile()`` with ``data`` that
+      contains a ``results`` list.
+    """
+    assert isinstance(data, dict)
+    assert 'results' not in data
+    _logger.info('Writing output to {}'.format(yamlOutputFilePath))
+    with open(yamlOutputFilePath, 'w') as f:
+        f.write('# Generated by klee-runner\n')
+        # `yaml.dump()` sorts keys so emit them in the same order
+        for key in sorted(list(data.keys()) + ['results']):
+            if key != 'results':
+                f.write(yaml.dump({key: data[key]}, default_flow_style=False))
+                continue
+            f.write('results:')
+            isEmpty = True
+            for r in results:
+                if isEmpty:
+                    f.write('\n')
+                    isEmpty = False
+                f.write(yaml.dump([r], default_flow_style=False))
+            if isEmpty:
+                f.write(' []\n')
+        f.flush()
+        os.fsync(f.fileno())
+    return
@@ -50,6 +50,16 @@ class InvocationInfo:
     def KTestFile(self):
         return self._data['ktest_file']
 
+    @property
+    def KTestFiles(self):
+        # Only used by the BatchedNativeReplay runner
+        return self._data.get('ktest_files', None)
+
+    @property
+    def KTestCoverageDirs(self):
+        # Only used by the BatchedNativeReplay runner
+        return self._data.get('ktest_coverage_dirs', None)
+
     @property
     def CoverageDir(self):
         return self._data['coverage_dir']
@@ -0,0 +1,358 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+"""
+Job queue shared between a ``batch-runner.py`` coordinator and one or
+more ``batch-worker.py`` workers.
+
+The queue is a SQLite database. To use workers on several machines the
+database must be on shared storage whose file locking works (SQLite
+relies on POSIX advisory locks).
+
+Workers pull one job at a time so an idle worker always takes the next
+pending job. This keeps every worker busy until the queue drains
+without needing to move work between workers. If a worker stops
+sending heartbeats the coordinator puts its unfinished jobs back in the
+queue.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Job states
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+
+# Queue states
+QUEUE_RUNNING = 'running'
+QUEUE_FINISHED = 'finished'
+QUEUE_CANCELLED = 'cancelled'
+
+_schema = """
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE invocations (
+    idx INTEGER PRIMARY KEY,
+    invocation_info TEXT NOT NULL
+);
+CREATE TABLE jobs (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    indices TEXT NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    heartbeat INTEGER NOT NULL DEFAULT 0,
+    attempt INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX jobs_by_state ON jobs (state, position);
+CREATE TABLE results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    worker TEXT NOT NULL,
+    result TEXT NOT NULL
+);
+"""
+
+
+class JobQueueException(Exception):
+
+    def __init__(self, msg):
+        # pylint: disable=super-init-not-called
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+def _requeueJob(cursor, jobId):
+    # Only the indices without a successful result need to be run again
+    cursor.execute('SELECT indices FROM jobs WHERE id = ?', (jobId,))
+    indices = json.loads(cursor.fetchone()[0])
+    haveResult = set(
+        index for index, result in cursor.execute(
+            'SELECT idx, result FROM results WHERE job = ?', (jobId,))
+        if 'error' not in json.loads(result))
+    remaining = [i for i in indices if i not in haveResult]
+    if len(remaining) == 0:
+        cursor.execute(
+            'UPDATE jobs SET state = ?, worker = NULL WHERE id = ?',
+            (DONE, jobId))
+        return
+    _logger.warning('Requeuing indices {}'.format(remaining))
+    # The previous owner might still be running the job so the next
+    # attempt must not use the same working directories.
+    cursor.execute(
+        'UPDATE jobs SET state = ?, worker = NULL, indices = ?, attempt = attempt + 1 WHERE id = ?',
+        (PENDING, json.dumps(remaining), jobId))
+
+
+class JobQueue:
+    """
+      Wrapper around the queue database. An instance can be shared
+      between threads.
+    """
+    def __init__(self, path, busyTimeout=60.0):
+        assert isinstance(path, str)
+        self._path = path
+        self._busyTimeout = busyTimeout
+        self._conn = None
+        self._lock = threading.Lock()
+        # Used by the coordinator to detect workers that have died.
+        # Maps job id to (heartbeat counter, time counter last changed).
+        self._heartbeatsSeen = dict()
+
+    @property
+    def path(self):
+        return self._path
+
+    def open(self):
+        assert self._conn is None
+        # Transactions are managed explicitly
+        self._conn = sqlite3.connect(
+            self._path,
+            timeout=self._busyTimeout,
+            isolation_level=None,
+            check_same_thread=False)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.close()
+
+    def _transaction(self, fn):
+        """
+          Run ``fn(cursor)`` inside a write transaction and return its
+          result.
+        """
+        with self._lock:
+            if self._conn is None:
+                raise JobQueueException('Queue "{}" is not open'.format(self._path))
+            cursor = self._conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn(cursor)
+            except:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+            return result
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            if self._conn is None:
+                raise JobQueueException('Queue "{}" is not open'.format(self._path))
+            return self._conn.execute(sql, args).fetchall()
+
+    # Coordinator interface
+
+    def create(self, config, workDirsRoot, invocationInfos, jobIndices):
+        """
+          Populate an empty queue.
+
+          ``config`` is the runner config, ``invocationInfos`` maps each
+          index that might be run to its raw invocation info and
+          ``jobIndices`` is a list of lists of indices to run sequentially
+          in the order they should be dispatched.
+        """
+        assert isinstance(config, dict)
+        assert isinstance(invocationInfos, dict)
+        assert isinstance(jobIndices, list)
+        def doCreate(cursor):
+            for statement in _schema.split(';'):
+                if statement.strip() != '':
+                    cursor.execute(statement)
+            meta = {
+                'config': config,
+                'working_dirs_root': workDirsRoot,
+                'state': QUEUE_RUNNING,
+            }
+            cursor.executemany(
+                'INSERT INTO meta (key, value) VALUES (?, ?)',
+                [(k, json.dumps(v)) for k, v in meta.items()])
+            cursor.executemany(
+                'INSERT INTO invocations (idx, invocation_info) VALUES (?, ?)',
+                [(index, json.dumps(ii)) for index, ii in invocationInfos.items()])
+            cursor.executemany(
+                'INSERT INTO jobs (position, indices, state) VALUES (?, ?, ?)',
+                [(position, json.dumps(l), PENDING) for position, l in enumerate(jobIndices)])
+        self._transaction(doCreate)
+        _logger.info('Created job queue "{}" with {} jobs'.format(
+            self._path, len(jobIndices)))
+
+    def setState(self, state):
+        assert state in (QUEUE_RUNNING, QUEUE_FINISHED, QUEUE_CANCELLED)
+        self._transaction(lambda cursor: cursor.execute(
+            'UPDATE meta SET value = ? WHERE key = ?', (json.dumps(state), 'state')))
+
+    def fetchResults(self, afterId):
+        """
+          Returns a list of ``(id, index, result)`` tuples for results with
+          an id greater than ``afterId`` in the order they were added.
+        """
+        rows = self._query(
+            'SELECT id, idx, result FROM results WHERE id > ? ORDER BY id', (afterId,))
+        return [(rowId, index, json.loads(result)) for rowId, index, result in rows]
+
+    def countUnfinishedJobs(self):
+        return self._query(
+            'SELECT COUNT(*) FROM jobs WHERE state != ?', (DONE,))[0][0]
+
+    def requeueStaleJobs(self, timeout):
+        """
+          Put running jobs whose heartbeat has not changed for ``timeout``
+          seconds back in the queue. Only the indices of the job that do
+          not have a successful result are run again. Returns the number of jobs
+          requeued.
+
+          Staleness is measured using this process's clock so clock skew
+          between machines does not matter.
+        """
+        now = time.monotonic()
+        stale = []
+        running = self._query(
+            'SELECT id, heartbeat, worker FROM jobs WHERE state = ?', (RUNNING,))
+        runningIds = set()
+        for jobId, heartbeat, worker in running:
+            runningIds.add(jobId)
+            seen = self._heartbeatsSeen.get(jobId, None)
+            if seen is None or seen[0] != heartbeat:
+                self._heartbeatsSeen[jobId] = (heartbeat, now)
+            elif now - seen[1] > timeout:
+                stale.append((jobId, heartbeat, worker))
+        for jobId in list(self._heartbeatsSeen.keys()):
+            if jobId not in runningIds:
+                del self._heartbeatsSeen[jobId]
+        if len(stale) == 0:
+            return 0
+
+        def doRequeue(cursor):
+            numRequeued = 0
+            for jobId, heartbeat, worker in stale:
+                # The worker might have sent a heartbeat since we looked
+                cursor.execute(
+                    'SELECT 1 FROM jobs WHERE id = ? AND state = ? AND heartbeat = ?',
+                    (jobId, RUNNING, heartbeat))
+                if cursor.fetchone() is None:
+                    continue
+                _logger.warning('Worker "{}" stopped responding'.format(worker))
+                _requeueJob(cursor, jobId)
+                numRequeued += 1
+            return numRequeued
+        return self._transaction(doRequeue)
+
+    # Worker interface
+
+    def getState(self):
+        return json.loads(self._query(
+            'SELECT value FROM meta WHERE key = ?', ('state',))[0][0])
+
+    def getConfig(self):
+        return json.loads(self._query(
+            'SELECT value FROM meta WHERE key = ?', ('config',))[0][0])
+
+    def getWorkDirsRoot(self):
+        return json.loads(self._query(
+            'SELECT value FROM meta WHERE key = ?', ('working_dirs_root',))[0][0])
+
+    def getInvocationInfos(self):
+        """
+          Returns a dictionary mapping index to raw invocation info.
+        """
+        return {index: json.loads(ii) for index, ii in self._query(
+            'SELECT idx, invocation_info FROM invocations')}
+
+    def claimJob(self, worker):
+        """
+          Take the next pending job. Returns a tuple ``(jobId, indices,
+          attempt)`` or None if there are no pending jobs. ``attempt`` is
+          the number of times the job has been requeued.
+        """
+        def doClaim(cursor):
+            cursor.execute(
+                'SELECT id, indices, attempt FROM jobs WHERE state = ? ORDER BY position LIMIT 1',
+                (PENDING,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute(
+                'UPDATE jobs SET state = ?, worker = ?, heartbeat = heartbeat + 1 WHERE id = ?',
+                (RUNNING, worker, row[0]))
+            return (row[0], json.loads(row[1]), row[2])
+        return self._transaction(doClaim)
+
+    def heartbeat(self, worker):
+        """
+          Tell the coordinator that ``worker`` is still running its jobs.
+        """
+        self._transaction(lambda cursor: cursor.execute(
+            'UPDATE jobs SET heartbeat = heartbeat + 1 WHERE state = ? AND worker = ?',
+            (RUNNING, worker)))
+
+    def addResult(self, jobId, worker, index, result):
+        """
+          Add the result for ``index``. Returns False (and discards the
+          result) if ``worker`` no longer owns the job because it was
+          requeued.
+        """
+        assert isinstance(result, dict)
+        encoded = json.dumps(result, sort_keys=True)
+        def doAdd(cursor):
+            cursor.execute(
+                'SELECT 1 FROM jobs WHERE id = ? AND state = ? AND worker = ?',
+                (jobId, RUNNING, worker))
+            if cursor.fetchone() is None:
+                return False
+            cursor.execute(
+                'INSERT INTO results (job, idx, worker, result) VALUES (?, ?, ?, ?)',
+                (jobId, index, worker, encoded))
+            return True
+        return self._transaction(doAdd)
+
+    def releaseJob(self, jobId, worker):
+        """
+          Give up a job without finishing it so another worker can run
+          the indices that do not have a successful result.
+        """
+        def doRelease(cursor):
+            cursor.execute(
+                'SELECT 1 FROM jobs WHERE id = ? AND state = ? AND worker = ?',
+                (jobId, RUNNING, worker))
+            if cursor.fetchone() is not None:
+                _requeueJob(cursor, jobId)
+        self._transaction(doRelease)
+
+    def finishJob(self, jobId, worker):
+        self._transaction(lambda cursor: cursor.execute(
+            'UPDATE jobs SET state = ? WHERE id = ? AND state = ? AND worker = ?',
+            (DONE, jobId, RUNNING, worker)))
+
+
+class JobQueueResultSink:
+    """
+      Adapter that lets a ``RunnerJob`` send its results to the queue
+      instead of a ``ResultJournal``.
+    """
+    def __init__(self, queue, jobId, worker):
+        self._queue = queue
+        self._jobId = jobId
+        self._worker = worker
+
+    def append(self, index, result):
+        if not self._queue.addResult(self._jobId, self._worker, index, result):
+            _logger.warning(
+                'Discarding result for index {} because job {} was given to another worker'.format(
+                    index, self._jobId))
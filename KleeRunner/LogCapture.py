@@ -0,0 +1,288 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+"""
+Capture of the output of a job to its log file.
+
+Output is written to disk as it is produced rather than being held in
+memory. Optionally only the first ``head_bytes`` and last
+``tail_bytes`` bytes are kept (a marker recording how much was dropped
+is written between them) and the log can be compressed with gzip or
+zstd (needs the ``zstandard`` module). Compressed logs get a ``.gz`` or
+``.zst`` suffix.
+"""
+import gzip
+import logging
+import os
+import selectors
+import threading
+
+_logger = logging.getLogger(__name__)
+
+COMPRESSION_SUFFIXES = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+
+class LogCaptureException(Exception):
+
+    def __init__(self, msg):
+        # pylint: disable=super-init-not-called
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+class LogCaptureOptions:
+    """
+      ``head_bytes`` and ``tail_bytes`` of zero for both means the size of
+      the log is not capped. ``compression`` is None or a key of
+      ``COMPRESSION_SUFFIXES``.
+    """
+    def __init__(self, head_bytes=0, tail_bytes=0, compression=None):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.compression = compression
+
+    @property
+    def capped(self):
+        return self.head_bytes > 0 or self.tail_bytes > 0
+
+
+def getLogCaptureOptions(backendName, kwargs):
+    """
+      Get and check the ``log_capture`` backend option from ``kwargs``.
+      Returns None if it is not set.
+    """
+    value = kwargs.get('log_capture', None)
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise LogCaptureException(
+            '{} backend option "log_capture" must map to a dictionary'.format(backendName))
+    options = LogCaptureOptions()
+    for key, optionValue in value.items():
+        if key in ['head_bytes', 'tail_bytes']:
+            if not (isinstance(optionValue, int) and optionValue >= 0):
+                raise LogCaptureException(
+                    '"log_capture" option "{}" must be an integer >= 0'.format(key))
+            setattr(options, key, optionValue)
+            continue
+        if key == 'compression':
+            if optionValue not in COMPRESSION_SUFFIXES:
+                raise LogCaptureException(
+                    '"log_capture" option "compression" must be one of {}'.format(
+                        sorted(COMPRESSION_SUFFIXES.keys())))
+            if optionValue == 'zstd':
+                try:
+                    import zstandard # pylint: disable=unused-import
+                except ImportError:
+                    raise LogCaptureException(
+                        'The zstandard module is required for "zstd" compression')
+            options.compression = optionValue
+            continue
+        raise LogCaptureException(
+            '"{}" is not a recognised "log_capture" option'.format(key))
+    return options
+
+
+def getLogFilePath(logFilePath, options):
+    """
+      Returns the path the log is actually written to.
+    """
+    if options is None or options.compression is None:
+        return logFilePath
+    return logFilePath + COMPRESSION_SUFFIXES[options.compression]
+
+
+def _openCompressed(path, compression):
+    if compression is None:
+        return open(path, 'wb')
+    if compression == 'gzip':
+        # Low compression level because logs can be written quickly
+        return gzip.open(path, 'wb', compresslevel=1)
+    assert compression == 'zstd'
+    import zstandard
+    f = open(path, 'wb')
+    try:
+        return zstandard.ZstdCompressor().stream_writer(f, closefd=True)
+    except:
+        f.close()
+        raise
+
+
+class LogWriter:
+    """
+      File-like object that writes a log according to a
+      ``LogCaptureOptions``. The head of the log is written as it
+      arrives. The tail is kept in memory until ``close()``.
+
+      This is not thread safe.
+    """
+    def __init__(self, path, options):
+        if options is None:
+            options = LogCaptureOptions()
+        self._options = options
+        self._file = _openCompressed(path, options.compression)
+        self._headRemaining = options.head_bytes
+        self._tail = bytearray()
+        self._bytesSeen = 0
+        self._bytesWritten = 0
+        self._closed = False
+
+    def write(self, data):
+        self._bytesSeen += len(data)
+        if not self._options.capped:
+            self._file.write(data)
+            self._bytesWritten += len(data)
+            return
+        if self._headRemaining > 0:
+            head = data[:self._headRemaining]
+            self._file.write(head)
+            self._bytesWritten += len(head)
+            self._headRemaining -= len(head)
+            data = data[len(head):]
+        if self._options.tail_bytes == 0 or len(data) == 0:
+            return
+        self._tail.extend(data)
+        # Trim in bulk so the cost is amortised
+        if len(self._tail) > 2 * self._options.tail_bytes:
+            del self._tail[:-self._options.tail_bytes]
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            tail = self._tail[-self._options.tail_bytes:] if self._options.tail_bytes > 0 else b''
+            self._tail = None
+            omitted = self._bytesSeen - self._bytesWritten - len(tail)
+            if omitted > 0:
+                _logger.info('Omitted {} bytes from the middle of the log'.format(omitted))
+                self._file.write(
+                    '\n[klee-runner: {} bytes of output omitted]\n'.format(omitted).encode())
+            self._file.write(tail)
+            self._bytesWritten += len(tail)
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class LogPump:
+    """
+      Thread that writes each chunk from the iterable ``chunks`` to the
+      ``LogWriter`` ``writer``.
+    """
+    def __init__(self, chunks, writer, name):
+        self._chunks = chunks
+        self._writer = writer
+        self._thread = threading.Thread(target=self._threadBody, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def join(self, timeout=None):
+        """
+          Returns False if the thread is still running after ``timeout``.
+        """
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _threadBody(self):
+        try:
+            for chunk in self._chunks:
+                self._writer.write(chunk)
+        except Exception: # pylint: disable=broad-except
+            _logger.exception('Failed to capture log')
+
+
+class LogSink:
+    """
+      Context manager providing the ``stdout`` to give to
+      ``subprocess.Popen()`` so that output is written to ``logFilePath``
+      according to ``options`` (a ``LogCaptureOptions`` or None).
+
+      If no options are set the process writes to the log file directly.
+      Otherwise it writes to a pipe which is read by a ``LogPump``.
+      ``processStarted()`` must be called once the process has been
+      started.
+    """
+    # How long to wait for processes that escaped being killed to stop
+    # writing to the pipe.
+    PUMP_JOIN_TIMEOUT = 5.0
+
+    def __init__(self, logFilePath, options):
+        self._path = getLogFilePath(logFilePath, options)
+        self._options = options
+        self._file = None
+        self._writer = None
+        self._readFd = None
+        self._writeFd = None
+        self._pump = None
+        self._stopPump = threading.Event()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def stdout(self):
+        if self._file is not None:
+            return self._file
+        return self._writeFd
+
+    def __enter__(self):
+        if self._options is None:
+            self._file = open(self._path, 'wb')
+            return self
+        self._writer = LogWriter(self._path, self._options)
+        self._readFd, self._writeFd = os.pipe()
+        return self
+
+    def processStarted(self):
+        if self._writer is None:
+            return
+        # The child has its own copy. Closing ours means we see EOF when
+        # the child (and its children) exit.
+        os.close(self._writeFd)
+        self._writeFd = None
+        self._pump = LogPump(
+            self._readPipe(),
+            self._writer,
+            name='log_pump-{}'.format(os.path.basename(os.path.dirname(self._path))))
+        self._pump.start()
+
+    def _readPipe(self):
+        # `select.select()` can't be used because it does not support
+        # file descriptors >= FD_SETSIZE (usually 1024) which are common
+        # when many jobs run in parallel.
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._readFd, selectors.EVENT_READ)
+            while not self._stopPump.is_set():
+                if len(selector.select(0.1)) == 0:
+                    continue
+                data = os.read(self._readFd, 2**16)
+                if len(data) == 0:
+                    return
+                yield data
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._file is not None:
+            self._file.close()
+            return
+        try:
+            if self._writeFd is not None:
+                os.close(self._writeFd)
+            if self._pump is not None and not self._pump.join(self.PUMP_JOIN_TIMEOUT):
+                _logger.warning('Output is still being written to "{}". Ignoring it'.format(
+                    self._path))
+                self._stopPump.set()
+                self._pump.join()
+        finally:
+            os.close(self._readFd)
+            self._writer.close()
@@ -0,0 +1,152 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class ResourceBudgetException(Exception):
+
+    def __init__(self, msg):
+        # pylint: disable=super-init-not-called
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+def getAvailableMemoryInMiB():
+    """
+      Returns the amount of memory (in MiB) that can be given to new
+      processes without the host swapping.
+    """
+    import psutil
+    return psutil.virtual_memory().available / (2**20)
+
+
+def getTotalMemoryInMiB():
+    import psutil
+    return psutil.virtual_memory().total / (2**20)
+
+
+class ResourceBudget:
+    """
+      Tracks the resources reserved by running jobs against a budget for
+      the host. A job should only be started if ``tryReserve()`` succeeds
+      and must ``release()`` its reservation when it finishes.
+
+      A budget of ``None`` means that resource is not limited.
+
+      If ``respectFreeMemory`` is True then a memory reservation is also
+      refused if the available memory on the host is less than the amount
+      requested. This catches memory used by things other than our jobs.
+      Jobs take a while to allocate their memory so the available memory
+      is only measured every ``freeMemorySamplePeriod`` seconds and each
+      reservation is subtracted from the measurement. Otherwise many jobs
+      would be admitted against the same free memory.
+    """
+    def __init__(self, memoryBudgetInMiB=None, cpuBudget=None, respectFreeMemory=True,
+                 freeMemorySamplePeriod=5.0):
+        if memoryBudgetInMiB is not None:
+            if not (isinstance(memoryBudgetInMiB, int) and memoryBudgetInMiB > 0):
+                raise ResourceBudgetException(
+                    'memory budget must be an integer > 0')
+        if cpuBudget is not None:
+            if not (isinstance(cpuBudget, int) and cpuBudget > 0):
+                raise ResourceBudgetException(
+                    'cpu budget must be an integer > 0')
+        self._memoryBudgetInMiB = memoryBudgetInMiB
+        self._cpuBudget = cpuBudget
+        self._respectFreeMemory = respectFreeMemory
+        self._freeMemorySamplePeriod = freeMemorySamplePeriod
+        # The available memory in MiB less the reservations made since it
+        # was measured, and when it was measured.
+        self._availableMemoryInMiB = None
+        self._availableMemoryTime = None
+        self._reservedMemoryInMiB = 0
+        self._reservedCpus = 0
+        self._numReservations = 0
+        self._lock = threading.Lock()
+
+    @property
+    def memoryBudgetInMiB(self):
+        return self._memoryBudgetInMiB
+
+    @property
+    def cpuBudget(self):
+        return self._cpuBudget
+
+    @property
+    def reservedMemoryInMiB(self):
+        return self._reservedMemoryInMiB
+
+    @property
+    def reservedCpus(self):
+        return self._reservedCpus
+
+    def checkReservationCanFit(self, memoryInMiB, cpus):
+        """
+          Raises ``ResourceBudgetException`` if a reservation could never
+          be satisfied, even when nothing else is running.
+        """
+        if self._memoryBudgetInMiB is not None and memoryInMiB > self._memoryBudgetInMiB:
+            raise ResourceBudgetException(
+                'Job requires {} MiB of memory which exceeds the budget of {} MiB'.format(
+                    memoryInMiB, self._memoryBudgetInMiB))
+        if self._cpuBudget is not None and cpus > self._cpuBudget:
+            raise ResourceBudgetException(
+                'Job requires {} CPUs which exceeds the budget of {} CPUs'.format(
+                    cpus, self._cpuBudget))
+
+    def tryReserve(self, memoryInMiB, cpus):
+        """
+          Try to reserve ``memoryInMiB`` MiB of memory and ``cpus`` CPUs.
+          Returns True if the reservation was made.
+        """
+        assert isinstance(memoryInMiB, int) and memoryInMiB >= 0
+        assert isinstance(cpus, int) and cpus >= 0
+        with self._lock:
+            if (self._memoryBudgetInMiB is not None and
+                    self._reservedMemoryInMiB + memoryInMiB > self._memoryBudgetInMiB):
+                return False
+            if (self._cpuBudget is not None and
+                    self._reservedCpus + cpus > self._cpuBudget):
+                return False
+            if self._respectFreeMemory and memoryInMiB > 0:
+                available = self._getAvailableMemoryInMiB()
+                if available < memoryInMiB:
+                    if self._numReservations > 0:
+                        _logger.debug(
+                            'Only {:.0f} MiB available. Waiting for {} MiB'.format(
+                                available, memoryInMiB))
+                        return False
+                    # Waiting won't help because none of our jobs are
+                    # running.
+                    _logger.warning(
+                        'Only {:.0f} MiB available but job requires {} MiB'.format(
+                            available, memoryInMiB))
+            if self._availableMemoryInMiB is not None:
+                self._availableMemoryInMiB -= memoryInMiB
+            self._reservedMemoryInMiB += memoryInMiB
+            self._reservedCpus += cpus
+            self._numReservations += 1
+            return True
+
+    def _getAvailableMemoryInMiB(self):
+        # Assumes the lock is held
+        now = time.monotonic()
+        if (self._availableMemoryInMiB is None or
+                now - self._availableMemoryTime >= self._freeMemorySamplePeriod):
+            self._availableMemoryInMiB = getAvailableMemoryInMiB()
+            self._availableMemoryTime = now
+        return self._availableMemoryInMiB
+
+    def release(self, memoryInMiB, cpus):
+        with self._lock:
+            assert self._numReservations > 0
+            assert self._reservedMemoryInMiB >= memoryInMiB
+            assert self._reservedCpus >= cpus
+            self._reservedMemoryInMiB -= memoryInMiB
+            self._reservedCpus -= cpus
+            self._numReservations -= 1
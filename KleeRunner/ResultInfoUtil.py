@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import copy
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -54,3 +55,46 @@ def group_result_infos_by(result_infos_list, key_fn=get_result_info_key):
                 key_to_result_infos[key][result_infos_index] = r
 
     return (key_to_result_infos, rejected_result_infos)
+
+# Keys in a raw `ResultInfo` that record the resource usage of a run.
+# These might be missing from `ResultInfo`s produced by older versions.
+RESOURCE_USAGE_KEYS = [
+    'user_cpu_time',
+    'sys_cpu_time',
+    'peak_rss',
+    'minor_page_faults',
+    'major_page_faults',
+    'voluntary_context_switches',
+    'involuntary_context_switches',
+    'block_read_bytes',
+    'block_write_bytes',
+    'peak_memory_usage',
+]
+
+def expand_batched_native_replay_result(ri):
+    """
+    Given a raw `ResultInfo` from the `BatchedNativeReplay` runner return a
+    list of raw `ResultInfo`s, one for each replayed test case, that look
+    like they came from the `NativeReplay` runner. Other `ResultInfo`s are
+    returned unchanged in a list of length one.
+    """
+    if 'replays' not in ri:
+        return [ri]
+    expanded = []
+    for replay in ri['replays']:
+        r = copy.deepcopy(ri)
+        del r['replays']
+        ii = r['invocation_info']
+        del ii['ktest_files']
+        ii['ktest_file'] = replay['ktest_file']
+        ii['coverage_dir'] = replay['coverage_dir']
+        for key in ['exit_code', 'wallclock_time', 'backend_timeout',
+                    'out_of_memory', 'log_file']:
+            r[key] = replay[key]
+        # Resource usage is only known for the whole batch
+        for key in RESOURCE_USAGE_KEYS:
+            if key in r:
+                r[key] = None
+        r['replayed'] = replay['replayed']
+        expanded.append(r)
+    return expanded
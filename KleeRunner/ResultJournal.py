@@ -0,0 +1,182 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+"""
+Append-only journal of results produced during a batch run.
+
+Each record is written as a single line of JSON which is flushed and
+fsync'd before ``append()`` returns. This means that if the driver
+crashes (or is killed) only the record being written at the time can
+be lost.
+"""
+import json
+import logging
+import os
+import threading
+
+_logger = logging.getLogger(__name__)
+
+
+class ResultJournalException(Exception):
+
+    def __init__(self, msg):
+        # pylint: disable=super-init-not-called
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+def _fsyncDirectory(path):
+    # Make sure the directory entry for a newly created file is durable.
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _repairTail(path):
+    """
+      If the driver died whilst writing a record the journal will end with a
+      partial line. Truncate it so that new records start on a fresh line.
+    """
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+        # Walk backwards to the last complete record
+        offset = size - 1
+        blockSize = 4096
+        lastNewLine = -1
+        while offset > 0 and lastNewLine == -1:
+            start = max(0, offset - blockSize)
+            f.seek(start)
+            block = f.read(offset - start)
+            lastNewLine = block.rfind(b'\n')
+            if lastNewLine != -1:
+                lastNewLine += start
+            offset = start
+        _logger.warning('Removing partial record from end of journal "{}"'.format(path))
+        f.truncate(lastNewLine + 1)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class ResultJournal:
+    """
+      Journal that records the result of each job as soon as it is known.
+      Records are keyed by the index of the job in the invocation info.
+
+      It is safe to call ``append()`` from multiple threads.
+    """
+    def __init__(self, path):
+        assert isinstance(path, str)
+        self._path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self._path
+
+    def open(self):
+        assert self._file is None
+        exists = os.path.exists(self._path)
+        if exists:
+            _repairTail(self._path)
+        self._file = open(self._path, 'a')
+        if not exists:
+            _fsyncDirectory(os.path.dirname(os.path.abspath(self._path)))
+        _logger.info('Journaling results to "{}"'.format(self._path))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.close()
+
+    def append(self, index, result):
+        """
+          Durably record ``result`` (a raw result info dictionary) for the
+          job with index ``index``.
+        """
+        assert isinstance(index, int)
+        assert isinstance(result, dict)
+        line = json.dumps({'index': index, 'result': result}, sort_keys=True)
+        assert '\n' not in line
+        with self._lock:
+            if self._file is None:
+                raise ResultJournalException(
+                    'Journal "{}" is not open'.format(self._path))
+            self._file.write(line)
+            self._file.write('\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+
+def iterRecords(path):
+    """
+      Generator that yields ``(index, result)`` tuples in the order they were
+      appended to the journal at ``path``. Only one record is held in memory
+      at a time.
+    """
+    with open(path, 'r') as f:
+        for lineNumber, line in enumerate(f):
+            if not line.endswith('\n'):
+                # The driver died whilst writing this record
+                _logger.warning(
+                    'Ignoring partial record on line {} of journal "{}"'.format(
+                        lineNumber + 1, path))
+                return
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise ResultJournalException(
+                    'Failed to parse line {} of journal "{}"'.format(
+                        lineNumber + 1, path))
+            yield (record['index'], record['result'])
+
+
+def getLatestRecordLineNumbers(path):
+    """
+      Returns a dictionary mapping each job index in the journal at ``path``
+      to the line number of the last record appended for that index. Later
+      records supersede earlier ones (e.g. when a failed job is re-run).
+    """
+    indexToLineNumber = dict()
+    for lineNumber, (index, _) in enumerate(iterRecords(path)):
+        indexToLineNumber[index] = lineNumber
+    return indexToLineNumber
+
+
+def iterLatestRecords(path):
+    """
+      Like ``iterRecords()`` but only yields the last record appended for
+      each job index.
+    """
+    latestLineNumbers = set(getLatestRecordLineNumbers(path).values())
+    for lineNumber, record in enumerate(iterRecords(path)):
+        if lineNumber in latestLineNumbers:
+            yield record
+
+
+def getCompletedIndices(path):
+    """
+      Returns the set of job indices whose most recent record in the journal
+      at ``path`` is a result rather than an error.
+    """
+    completed = set()
+    for index, result in iterLatestRecords(path):
+        if 'error' not in result:
+            completed.add(index)
+    return completed
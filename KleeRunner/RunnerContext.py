@@ -8,9 +8,18 @@ import os
 _logger = logging.getLogger(__name__)
 
 
+class _MemoizedResult:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.computed = False
+        self.value = None
+        self.exception = None
+
+
 class RunnerContext:
     def __init__(self, num_parallel_jobs):
         self._context_global_objects = dict()
+        self._memoized_results = dict()
         self._num_parallel_jobs = num_parallel_jobs
         self._lock = threading.Lock()
         assert isinstance(self._num_parallel_jobs, int)
@@ -35,3 +44,34 @@ class RunnerContext:
             else:
                 self._context_global_objects[name] = obj
                 return True
+
+    def memoize(self, key, fn):
+        """
+        Return the result of calling ``fn()`` where ``fn()`` is only
+        called the first time ``key`` is seen. If ``fn()`` raised an
+        exception the same exception is raised for later calls with the
+        same ``key``.
+
+        This is useful for expensive checks that runners would otherwise
+        all repeat (e.g. checking a tool exists inside a Docker image).
+        Callers using the same ``key`` at the same time wait for the
+        first one to finish rather than repeating the work.
+        """
+        with self._lock:
+            try:
+                entry = self._memoized_results[key]
+            except KeyError:
+                entry = _MemoizedResult()
+                self._memoized_results[key] = entry
+        with entry.lock:
+            if not entry.computed:
+                try:
+                    entry.value = fn()
+                except Exception as e:
+                    entry.exception = e
+                entry.computed = True
+            else:
+                _logger.debug('Using memoized result for {}'.format(key))
+        if entry.exception is not None:
+            raise entry.exception
+        return entry.value
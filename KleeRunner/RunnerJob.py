@@ -0,0 +1,179 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import os
+import shutil
+import threading
+import traceback
+
+_logger = logging.getLogger(__name__)
+
+
+class RunnerBuilder:
+    """
+    Creates the runner (and its working directory) for a particular
+    invocation index. This is done on demand so that only the runners
+    that are currently running exist at any one time.
+
+    ``workDirSuffix`` is appended to the name of each working directory.
+    """
+    def __init__(self, RunnerClass, invocationInfoObjects, workDirsRoot, rc, ctx, removeExisting,
+                 scratchSpace=None, workDirSuffix=''):
+        self._RunnerClass = RunnerClass
+        self._invocationInfoObjects = invocationInfoObjects
+        self._workDirsRoot = workDirsRoot
+        self._rc = rc
+        self._ctx = ctx
+        self._removeExisting = removeExisting
+        # If not None a ``ScratchSpace`` that chooses where working
+        # directories are created.
+        self._scratchSpace = scratchSpace
+        self._workDirSuffix = workDirSuffix
+
+    def workDirFor(self, index):
+        return os.path.join(
+            self._workDirsRoot, 'workdir-{}{}'.format(index, self._workDirSuffix))
+
+    def build(self, index):
+        invocationInfo = self._invocationInfoObjects[index]
+        _logger.info('Creating runner {} out of {}'.format(
+            index + 1,
+            len(self._invocationInfoObjects)))
+        # Create working directory for this runner
+        workDir = self.workDirFor(index)
+        if self._removeExisting and os.path.exists(workDir):
+            # Left over from a job that did not complete
+            _logger.warning(
+                'Removing incomplete working directory "{}"'.format(workDir))
+            shutil.rmtree(workDir)
+        if self._scratchSpace is not None:
+            workDir = self._scratchSpace.workDirFor(index, workDir)
+        os.mkdir(workDir)
+
+        # Do coverage_dir subtitution if necessary
+        if invocationInfo.CoverageDir is not None:
+            coverage_dir = invocationInfo.CoverageDir
+            assert isinstance(coverage_dir, str)
+            new_coverage_dir = coverage_dir.replace('@global_work_dir@', self._workDirsRoot)
+            _logger.info('Replacing coverage dir "{}" with "{}"'.format(
+                coverage_dir,
+                new_coverage_dir)
+            )
+            invocationInfo.GetInternalRepr()['coverage_dir'] = new_coverage_dir
+            # Create the directory if necessary. Other jobs might be
+            # doing this at the same time.
+            if not os.path.exists(new_coverage_dir):
+                _logger.info('Creating coverage directory "{}"'.format(new_coverage_dir))
+                os.makedirs(new_coverage_dir, exist_ok=True)
+
+        # Pass in a copy of rc so that if a runner accidently modifies
+        # a config it won't affect other runners.
+        return self._RunnerClass(invocationInfo, workDir, self._rc.copy(), self._ctx)
+
+    def errorRecord(self, index, error):
+        errorLog = {}
+        errorLog['working_directory'] = self.workDirFor(index)
+        errorLog['invocation_info'] = self._invocationInfoObjects[index].GetInternalRepr()
+        errorLog['error'] = error
+        return errorLog
+
+
+class RunnerJob:
+    """
+    A unit of work given to a worker. It runs the invocations with the
+    indices in ``indices`` one after the other (this is how forced
+    sequential execution is done during a parallel run). Each runner is
+    created just before it is run and is released once its result has
+    been written to the journal.
+
+    ``journal`` can be any object with an ``append(index, result)``
+    method (e.g. a ``ResultJournal``).
+    """
+    def __init__(self, indices, builder, journal):
+        assert isinstance(indices, list)
+        assert len(indices) > 0
+        self._indices = indices
+        self._builder = builder
+        self._journal = journal
+        self._currentRunner = None
+        self._killed = False
+        self._lock = threading.Lock()
+        self.hadError = False
+
+    @property
+    def indices(self):
+        return self._indices
+
+    def run(self):
+        """
+        Returns the number of results written to the journal
+        """
+        numResults = 0
+        for position, index in enumerate(self._indices):
+            with self._lock:
+                if self._killed:
+                    _logger.warning('Sequential loop killed')
+                    break
+            if len(self._indices) > 1:
+                _logger.info('Doing sequential run {}/{} of index {}'.format(
+                    position + 1,
+                    len(self._indices),
+                    index))
+            self._journal.append(index, self._runIndex(index))
+            numResults += 1
+        return numResults
+
+    def _runIndex(self, index):
+        runner = None
+        interrupted = False
+        try:
+            runner = self._builder.build(index)
+            with self._lock:
+                if self._killed:
+                    return self._builder.errorRecord(index, 'Job was cancelled')
+                self._currentRunner = runner
+            runner.run()
+            with self._lock:
+                if self._killed:
+                    # The runner may have been killed part way through
+                    # so don't record this as a complete result.
+                    return self._builder.errorRecord(index, 'Job was cancelled')
+            return runner.getResults()
+        except KeyboardInterrupt:
+            # Keep the current runner so that the caller can `kill()` it
+            interrupted = True
+            raise
+        except Exception: # pylint: disable=broad-except
+            error = traceback.format_exc()
+            self.hadError = True
+            _logger.error('Runner for index {} hit exception:\n{}'.format(
+                index, error))
+            return self._builder.errorRecord(index, error)
+        finally:
+            if not interrupted:
+                with self._lock:
+                    self._currentRunner = None
+
+    def kill(self):
+        with self._lock:
+            self._killed = True
+            runner = self._currentRunner
+        if runner is not None:
+            runner.kill()
+
+
+def killJobs(jobs):
+    """
+    Kill the ``RunnerJob``s in ``jobs`` in parallel. Killing a job can
+    be slow (e.g. stopping a Docker container) so this avoids the time
+    taken growing with the number of jobs. Returns once every job has
+    been killed.
+    """
+    threads = []
+    for job in jobs:
+        thread = threading.Thread(
+            target=job.kill,
+            name='kill-{}'.format(job.indices[0]))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
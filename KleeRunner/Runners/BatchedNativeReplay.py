@@ -0,0 +1,364 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import os
+import shlex
+import shutil
+from . RunnerBase import RunnerBaseClass
+from . NativeReplay import NativeReplayRunnerException
+
+_logger = logging.getLogger(__name__)
+
+
+def getKTestFilesFromPaths(paths):
+    """
+      Expand ``paths`` (a list of ktest files and directories containing
+      ktest files) into a list of ktest files.
+    """
+    ktestFiles = []
+    for path in paths:
+        if os.path.isdir(path):
+            ktestFiles.extend(sorted(
+                os.path.join(path, f) for f in os.listdir(path)
+                if f.endswith('.ktest')))
+        elif os.path.exists(path):
+            ktestFiles.append(path)
+        else:
+            raise NativeReplayRunnerException(
+                'KTest file "{}" does not exist'.format(path))
+    return ktestFiles
+
+
+class BatchedNativeReplayRunner(RunnerBaseClass):
+    """
+      Replays several KLEE generated test cases on a native binary linked
+      against ``libkleeRuntest.so`` using a single backend invocation.
+
+      A shell script is generated that runs each replay in turn. It records
+      the exit code and run time of each replay so that the outcome of each
+      test appears in the results under ``replays``. ``max_time`` is the
+      time limit for each replay. Replays that hit it are recorded
+      explicitly rather than being inferred from the exit code, which the
+      program could have returned itself.
+
+      If ``fork_server`` is set in the runner config it is the path to the
+      shim built from ``forkserver/klee_fork_server.c``. The program is then
+      started once with the shim preloaded, and the shim forks a child for
+      each replay. This avoids paying for ``execve()``, dynamic linking and
+      start up for every test case.
+    """
+
+    def __init__(self, invocationInfo, workingDirectory, rc, ctx):
+        _logger.debug('Initialising {}'.format(invocationInfo.Program))
+
+        # Tool path doesn't mean anything here
+        if 'tool_path' in rc:
+            raise NativeReplayRunnerException(
+                '"tool_path" should not be specified')
+
+        if invocationInfo.KTestFiles is None:
+            raise NativeReplayRunnerException('"ktest_files" must be specified')
+        if invocationInfo.KTestFile is not None:
+            raise NativeReplayRunnerException(
+                '"ktest_file" cannot be used with "ktest_files"')
+        self._ktestFiles = getKTestFilesFromPaths(invocationInfo.KTestFiles)
+        if len(self._ktestFiles) == 0:
+            raise NativeReplayRunnerException('No KTest files found')
+
+        if invocationInfo.AttachGDB:
+            raise NativeReplayRunnerException(
+                '"attach_gdb" is not supported when replaying several KTest files')
+
+        self._perTestCoverageDirs = rc.get('per_test_coverage_dirs', False)
+        if not isinstance(self._perTestCoverageDirs, bool):
+            raise NativeReplayRunnerException(
+                '"per_test_coverage_dirs" should be a bool')
+
+        # Names of the per test coverage directories
+        self._coverageDirNames = None
+        if invocationInfo.KTestCoverageDirs is not None:
+            self._coverageDirNames = invocationInfo.KTestCoverageDirs
+            if len(self._coverageDirNames) != len(invocationInfo.KTestFiles):
+                raise NativeReplayRunnerException(
+                    '"ktest_coverage_dirs" must have an entry for each of "ktest_files"')
+            if len(self._ktestFiles) != len(invocationInfo.KTestFiles):
+                raise NativeReplayRunnerException(
+                    '"ktest_files" cannot contain directories when "ktest_coverage_dirs" is used')
+            for name in self._coverageDirNames:
+                if (os.path.isabs(name) or
+                        os.path.normpath(name).split(os.sep)[0] in ('', '.', '..')):
+                    raise NativeReplayRunnerException(
+                        '"{}" is not a sub directory of the coverage directory'.format(name))
+        elif self._perTestCoverageDirs:
+            self._coverageDirNames = [
+                str(index) for index in range(0, len(self._ktestFiles))]
+
+        self._forkServer = rc.get('fork_server', None)
+        if self._forkServer is not None:
+            if not isinstance(self._forkServer, str):
+                raise NativeReplayRunnerException(
+                    '"fork_server" should be a path to the fork server shim')
+            if not os.path.isfile(self._forkServer):
+                raise NativeReplayRunnerException(
+                    'Fork server shim "{}" does not exist'.format(self._forkServer))
+            self._forkServer = os.path.abspath(self._forkServer)
+
+        super(BatchedNativeReplayRunner, self).__init__(
+            invocationInfo, workingDirectory, rc, ctx)
+        self.toolPath = None
+        self._replays = None
+
+        # Disallow client using environment variables which we use
+        envVarsUsed = ['KTEST_FILE', 'GCOV_PREFIX', 'GCOV_PREFIX_STRIP']
+        if self._forkServer is not None:
+            envVarsUsed.extend(
+                ['LD_PRELOAD', 'KLEE_FORK_SERVER', 'KLEE_FORK_SERVER_TIMEOUT'])
+        for env_var_to_check in envVarsUsed:
+            if (env_var_to_check in invocationInfo.EnvironmentVariables or
+                env_var_to_check in self.toolEnvironmentVariables):
+                raise NativeReplayRunnerException(
+                    '"{}" is not allowed as an environment variable'.format(env_var_to_check))
+
+        if invocationInfo.CoverageDir is not None:
+            if not os.path.isdir(invocationInfo.CoverageDir):
+                raise NativeReplayRunnerException(
+                    'Coverage directory "{}" is not a directory'.format(invocationInfo.CoverageDir))
+
+    def _setupMaxTime(self, rc):
+        super(BatchedNativeReplayRunner, self)._setupMaxTime(rc)
+        # `max_time` applies to each replay. The backend gets enough time
+        # for all of them (plus the time `timeout` waits before sending
+        # SIGKILL).
+        self.perTestMaxTimeInSeconds = self.maxTimeInSeconds
+        if self.maxTimeInSeconds > 0:
+            self.maxTimeInSeconds = (self.maxTimeInSeconds + 1) * len(self._ktestFiles)
+
+    @property
+    def name(self):
+        return "Batched native replay"
+
+    @property
+    def ktestFiles(self):
+        return self._ktestFiles
+
+    @property
+    def statusFile(self):
+        return os.path.join(self.workingDirectory, 'replay_status.txt')
+
+    @property
+    def forkServerRequestsFile(self):
+        return os.path.join(self.workingDirectory, 'fork_server_requests.txt')
+
+    @property
+    def forkServerLogFile(self):
+        return os.path.join(self.workingDirectory, 'fork_server_log.txt')
+
+    @property
+    def scriptFile(self):
+        return os.path.join(self.workingDirectory, 'replay.sh')
+
+    @property
+    def timeoutLogFile(self):
+        return os.path.join(self.workingDirectory, 'timeout_log.txt')
+
+    def replayLogFile(self, index):
+        return os.path.join(self.workingDirectory, 'logs', '{}.txt'.format(index))
+
+    def replayCoverageDir(self, index):
+        if self.InvocationInfo.CoverageDir is None:
+            return None
+        if self._coverageDirNames is not None:
+            return os.path.join(
+                self.InvocationInfo.CoverageDir, self._coverageDirNames[index])
+        return self.InvocationInfo.CoverageDir
+
+    def _checkToolExistsInBackend(self):
+        # There is no "tool" here so don't check if it exists.
+        pass
+
+    def _setupToolPath(self, rc):
+        self.toolPath = None
+
+    def _inBackend(self, hostPath):
+        # Path inside the backend of a file inside the working directory
+        relativePath = os.path.relpath(hostPath, self.workingDirectory)
+        return os.path.join(self.workingDirectoryInBackend, relativePath)
+
+    def _writeScript(self):
+        # KTest files are put in the working directory so the backend does
+        # not need to make each one available individually.
+        ktestDir = os.path.join(self.workingDirectory, 'ktests')
+        os.mkdir(ktestDir)
+        os.mkdir(os.path.join(self.workingDirectory, 'logs'))
+
+        coverageDirInBackend = None
+        if self.InvocationInfo.CoverageDir is not None:
+            # NOTE: Coverage directory must be writable
+            self._backend.addFileToBackend(self.InvocationInfo.CoverageDir, read_only=False)
+            coverageDirInBackend = self._backend.getFilePathInBackend(
+                self.InvocationInfo.CoverageDir)
+
+        cmdLine = ([self.programPathArgument] + self.additionalArgs +
+                   self.InvocationInfo.CommandLineArguments)
+        quotedCmdLine = ' '.join(shlex.quote(arg) for arg in cmdLine)
+        useTimeout = self.perTestMaxTimeInSeconds > 0 and self._forkServer is None
+
+        lines = [
+            '#!/bin/sh',
+            '# Generated by klee-runner',
+            'STATUS={}'.format(shlex.quote(self._inBackend(self.statusFile))),
+        ]
+        if useTimeout:
+            lines.append('TIMEOUT_LOG={}'.format(
+                shlex.quote(self._inBackend(self.timeoutLogFile))))
+        requests = []
+        for index, ktestFile in enumerate(self._ktestFiles):
+            ktestCopy = os.path.join(ktestDir, '{}.ktest'.format(index))
+            try:
+                os.link(ktestFile, ktestCopy)
+            except OSError:
+                shutil.copy2(ktestFile, ktestCopy)
+            env = {'KTEST_FILE': self._inBackend(ktestCopy)}
+            if coverageDirInBackend is not None:
+                # This is Gcov specific. This will tell the instrumented binary
+                # to emit all `*.gcda` files into a path prefixed by this path.
+                if self._coverageDirNames is not None:
+                    os.makedirs(self.replayCoverageDir(index), exist_ok=True)
+                    env['GCOV_PREFIX'] = os.path.join(
+                        coverageDirInBackend, self._coverageDirNames[index])
+                else:
+                    env['GCOV_PREFIX'] = coverageDirInBackend
+                # Don't strip anything off the initial hardwired paths.
+                env['GCOV_PREFIX_STRIP'] = '0'
+            logFileInBackend = self._inBackend(self.replayLogFile(index))
+            if self._forkServer is not None:
+                fields = [
+                    str(index),
+                    env['KTEST_FILE'],
+                    logFileInBackend,
+                    env.get('GCOV_PREFIX', '')]
+                for field in fields:
+                    if '\t' in field or '\n' in field:
+                        raise NativeReplayRunnerException(
+                            'Path "{}" cannot be used with the fork server'.format(field))
+                requests.append('\t'.join(fields))
+                continue
+            envPrefix = ' '.join(
+                '{}={}'.format(k, shlex.quote(v)) for k, v in sorted(env.items()))
+            lines.append('echo "start {} $(date +%s.%N)" >> "$STATUS"'.format(index))
+            if useTimeout:
+                # `timeout` only writes to its stderr (which is kept apart
+                # from the log) if it had to send a signal. The program's
+                # exit code is kept so it is not confused with the time
+                # limit being hit. The subshell stops the shell's own
+                # report of death by signal going to the same file.
+                lines.append(
+                    "({} timeout --verbose --preserve-status -k 1 {} "
+                    "/bin/sh -c 'exec \"$@\" > \"$0\" 2>&1' {} {} "
+                    "2> \"$TIMEOUT_LOG\" < /dev/null)".format(
+                        envPrefix,
+                        self.perTestMaxTimeInSeconds,
+                        shlex.quote(logFileInBackend),
+                        quotedCmdLine))
+                lines.append('rc=$?')
+                lines.append('if [ -s "$TIMEOUT_LOG" ]; then echo "timeout {}" >> "$STATUS"; fi'.format(
+                    index))
+            else:
+                lines.append('{} {} > {} 2>&1 < /dev/null'.format(
+                    envPrefix,
+                    quotedCmdLine,
+                    shlex.quote(logFileInBackend)))
+                lines.append('rc=$?')
+            lines.append('echo "end {} $rc $(date +%s.%N)" >> "$STATUS"'.format(index))
+
+        if self._forkServer is not None:
+            with open(self.forkServerRequestsFile, 'w') as f:
+                for request in requests:
+                    f.write(request)
+                    f.write('\n')
+            self._backend.addFileToBackend(self._forkServer, read_only=True)
+            env = {
+                'LD_PRELOAD': self._backend.getFilePathInBackend(self._forkServer),
+                'KLEE_FORK_SERVER': '1',
+            }
+            if self.perTestMaxTimeInSeconds > 0:
+                env['KLEE_FORK_SERVER_TIMEOUT'] = str(self.perTestMaxTimeInSeconds)
+            envPrefix = ' '.join(
+                '{}={}'.format(k, shlex.quote(v)) for k, v in sorted(env.items()))
+            # The shim reads requests from fd 8 and reports on fd 9
+            lines.append('{} {} 8< {} 9>> "$STATUS" > {} 2>&1 < /dev/null'.format(
+                envPrefix,
+                quotedCmdLine,
+                shlex.quote(self._inBackend(self.forkServerRequestsFile)),
+                shlex.quote(self._inBackend(self.forkServerLogFile))))
+
+        with open(self.scriptFile, 'w') as f:
+            f.write('\n'.join(lines))
+            f.write('\n')
+
+    def run(self):
+        self._writeScript()
+        backendResult = self.runTool(
+            ['/bin/sh', self._inBackend(self.scriptFile)],
+            envExtra=self.InvocationInfo.EnvironmentVariables)
+        if backendResult.outOfTime:
+            _logger.warning('Hard timeout hit')
+        self._replays = self._readReplayStatus(backendResult)
+
+    def _readReplayStatus(self, backendResult):
+        started = dict()
+        ended = dict()
+        timedOut = set()
+        if os.path.exists(self.statusFile):
+            with open(self.statusFile, 'r') as f:
+                for line in f:
+                    parts = line.split()
+                    try:
+                        if len(parts) == 3 and parts[0] == 'start':
+                            started[int(parts[1])] = float(parts[2])
+                        elif len(parts) == 2 and parts[0] == 'timeout':
+                            timedOut.add(int(parts[1]))
+                        elif len(parts) == 4 and parts[0] == 'end':
+                            ended[int(parts[1])] = (int(parts[2]), float(parts[3]))
+                    except ValueError:
+                        # `date` might not support `%N`
+                        if parts[0] == 'end':
+                            ended[int(parts[1])] = (int(parts[2]), None)
+        replays = []
+        for index, ktestFile in enumerate(self._ktestFiles):
+            replay = {
+                'ktest_file': ktestFile,
+                'log_file': self.replayLogFile(index),
+                'coverage_dir': self.replayCoverageDir(index),
+                'replayed': index in ended,
+                'exit_code': None,
+                'wallclock_time': None,
+                'backend_timeout': False,
+                'out_of_memory': False,
+            }
+            if index in ended:
+                exitCode, endTime = ended[index]
+                if index in timedOut:
+                    replay['backend_timeout'] = True
+                elif exitCode > 128:
+                    # The shell reports death by signal N as 128 + N. Use the
+                    # same convention as the PythonPsUtil backend.
+                    replay['exit_code'] = -(exitCode - 128)
+                else:
+                    replay['exit_code'] = exitCode
+                if endTime is not None and started.get(index, None) is not None:
+                    replay['wallclock_time'] = endTime - started[index]
+            elif index in started:
+                # The replay running when the backend stopped
+                replay['backend_timeout'] = backendResult.outOfTime
+                replay['out_of_memory'] = bool(backendResult.outOfMemory)
+            replays.append(replay)
+        return replays
+
+    def getResults(self):
+        r = super(BatchedNativeReplayRunner, self).getResults()
+        r['replays'] = self._replays
+        return r
+
+
+def get():
+    return BatchedNativeReplayRunner
@@ -182,7 +182,13 @@ class RunnerBaseClass(metaclass=abc.ABCMeta):
         # Check the tool exists in the backend.
         # This is provided as a method so sub-classes can override this
         # behaviour.
-        self._backend.checkToolExists(self.toolPath)
+        # The result is shared between all runners using the same context
+        # so the check is only done once for each backend environment.
+        key = ('checkToolExists',
+               self._backend.name,
+               self._backend.environmentIdentifier,
+               self.toolPath)
+        self._ctx.memoize(key, lambda: self._backend.checkToolExists(self.toolPath))
 
     def _readConfig(self, rc):
         if not isinstance(rc, dict):
@@ -211,24 +217,24 @@ class RunnerBaseClass(metaclass=abc.ABCMeta):
     _initLock = threading.Lock()
 
     def __init__(self, invocationInfo, workingDirectory, rc, ctx):
-        with RunnerBaseClass._initLock:
-            _logger.debug('Initialising {}'.format(invocationInfo.Program))
+        _logger.debug('Initialising {}'.format(invocationInfo.Program))
 
-            # Unique ID (we assume this constructor is never called in
-            # parallel)
+        # Unique ID. Runners may be constructed in parallel so only
+        # the counter is protected by the lock.
+        with RunnerBaseClass._initLock:
             self.uid = RunnerBaseClass.staticCounter
             RunnerBaseClass.staticCounter += 1
 
-            self._backendResult = None
-            self._invocationInfo = invocationInfo
+        self._backendResult = None
+        self._invocationInfo = invocationInfo
 
-            self._checkProgramPath()
-            self._setupWorkingDirectory(workingDirectory)
+        self._checkProgramPath()
+        self._setupWorkingDirectory(workingDirectory)
 
-            self._readConfig(rc)
-            self._ctx = ctx
-            assert isinstance(self._ctx, RunnerContext.RunnerContext)
-            self._setupBackend(rc)
+        self._readConfig(rc)
+        self._ctx = ctx
+        assert isinstance(self._ctx, RunnerContext.RunnerContext)
+        self._setupBackend(rc)
 
     @property
     def logFile(self):
@@ -262,9 +268,20 @@ class RunnerBaseClass(metaclass=abc.ABCMeta):
         results['working_directory'] = self.workingDirectory
         results['exit_code'] = self.exitCode
         results['out_of_memory'] = self.ranOutOfMemory
-        results['log_file'] = self.logFile
+        results['log_file'] = self._backendResult.logFile or self.logFile
         results['user_cpu_time'] = self._backendResult.userCpuTime
         results['sys_cpu_time'] = self._backendResult.sysCpuTime
+        results['peak_rss'] = self._backendResult.peakRss
+        results['minor_page_faults'] = self._backendResult.minorPageFaults
+        results['major_page_faults'] = self._backendResult.majorPageFaults
+        results['voluntary_context_switches'] = self._backendResult.voluntaryContextSwitches
+        results['involuntary_context_switches'] = self._backendResult.involuntaryContextSwitches
+        results['block_read_bytes'] = self._backendResult.blockReadBytes
+        results['block_write_bytes'] = self._backendResult.blockWriteBytes
+        results['memory_accounting'] = self._backendResult.memoryAccounting
+        results['peak_memory_usage'] = self._backendResult.peakMemoryUsage
+        if self._backendResult.telemetryFile is not None:
+            results['telemetry_file'] = self._backendResult.telemetryFile
         results['backend_timeout'] = self._backendResult.outOfTime
         results['invocation_info'] = copy.deepcopy(
             self.InvocationInfo.GetInternalRepr())
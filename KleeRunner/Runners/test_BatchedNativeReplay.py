@@ -0,0 +1,137 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import unittest
+
+from ..InvocationInfo import InvocationInfo
+from ..RunnerContext import RunnerContext
+from .BatchedNativeReplay import BatchedNativeReplayRunner
+
+# Does what the ktest file says: exits with the given code, sleeps or
+# kills itself.
+_REPLAY_SCRIPT = """#!/bin/sh
+read action < "$KTEST_FILE"
+echo "replaying $action"
+case "$action" in
+    sleep) exec sleep 30 ;;
+    kill) kill -KILL $$ ;;
+    *) exit "$action" ;;
+esac
+"""
+
+# The same as `_REPLAY_SCRIPT` for the fork server, which needs a program
+# that it can be preloaded into.
+_REPLAY_PROGRAM = r"""
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+
+int main(void) {
+  char action[32] = "";
+  FILE *f = fopen(getenv("KTEST_FILE"), "r");
+  if (!f || fscanf(f, "%31s", action) != 1)
+    return 1;
+  fclose(f);
+  printf("replaying %s\n", action);
+  fflush(stdout);
+  if (strcmp(action, "sleep") == 0)
+    sleep(30);
+  else if (strcmp(action, "kill") == 0)
+    raise(SIGKILL);
+  return atoi(action);
+}
+"""
+
+_FORK_SERVER_SOURCE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..', '..', 'forkserver', 'klee_fork_server.c')
+
+
+class BatchedNativeReplayTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # So we can see debug output
+        logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='klee-runner-test-')
+        self.work_dir = os.path.join(self.root, 'workdir')
+        os.mkdir(self.work_dir)
+        self.ctx = RunnerContext(num_parallel_jobs=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write_ktest_files(self, actions):
+        ktestFiles = []
+        for index, action in enumerate(actions):
+            path = os.path.join(self.root, '{}.ktest'.format(index))
+            with open(path, 'w') as f:
+                f.write('{}\n'.format(action))
+            ktestFiles.append(path)
+        return ktestFiles
+
+    def replay(self, program, actions, **rcExtra):
+        rc = {
+            'backend': {'name': 'PythonPsUtil', 'config': {}},
+            'max_time': 1,
+        }
+        rc.update(rcExtra)
+        invocationInfo = InvocationInfo({
+            'program': program,
+            'command_line_arguments': [],
+            'environment_variables': {},
+            'ktest_files': self.write_ktest_files(actions),
+        })
+        runner = BatchedNativeReplayRunner(invocationInfo, self.work_dir, rc, self.ctx)
+        runner.run()
+        replays = runner.getResults()['replays']
+        self.assertEqual(len(replays), len(actions))
+        for replay in replays:
+            self.assertTrue(replay['replayed'])
+        return replays
+
+    def write_script(self):
+        program = os.path.join(self.root, 'replay.sh')
+        with open(program, 'w') as f:
+            f.write(_REPLAY_SCRIPT)
+        os.chmod(program, os.stat(program).st_mode | stat.S_IXUSR)
+        return program
+
+    def test_outcomes(self):
+        replays = self.replay(self.write_script(), ['3', '124', 'kill', 'sleep', '0'])
+        # A program can exit with the code `timeout` uses
+        self.assertEqual(
+            [(r['exit_code'], r['backend_timeout']) for r in replays],
+            [(3, False), (124, False), (-9, False), (None, True), (0, False)])
+        with open(replays[0]['log_file'], 'r') as f:
+            self.assertEqual(f.read(), 'replaying 3\n')
+
+    def compile(self, output, sourceFile, *flags):
+        subprocess.check_call(['cc'] + list(flags) + ['-o', output, sourceFile])
+        return output
+
+    @unittest.skipIf(shutil.which('cc') is None, 'cc is not available')
+    def test_fork_server_outcomes(self):
+        forkServer = self.compile(
+            os.path.join(self.root, 'libkleeforkserver.so'),
+            _FORK_SERVER_SOURCE, '-O2', '-shared', '-fPIC')
+        programSource = os.path.join(self.root, 'replay.c')
+        with open(programSource, 'w') as f:
+            f.write(_REPLAY_PROGRAM)
+        program = self.compile(os.path.join(self.root, 'replay'), programSource)
+        replays = self.replay(
+            program, ['3', '124', 'kill', 'sleep', '0'], fork_server=forkServer)
+        self.assertEqual(
+            [(r['exit_code'], r['backend_timeout']) for r in replays],
+            [(3, False), (124, False), (-9, False), (None, True), (0, False)])
+        # Each replay has its own log
+        for replay, action in zip(replays, ['3', '124', 'kill']):
+            with open(replay['log_file'], 'r') as f:
+                self.assertEqual(f.read(), 'replaying {}\n'.format(action))
@@ -0,0 +1,251 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+"""
+Persistent history of how long jobs took to run. This is used to
+predict the run time of jobs so that the longest jobs can be started
+first.
+
+Entries are keyed by the program and a hash of the runner configuration
+and the rest of the invocation info, so the same program run with a
+different configuration has a separate entry.
+"""
+import hashlib
+import heapq
+import json
+import logging
+import os
+import threading
+
+_logger = logging.getLogger(__name__)
+
+# Fields of an invocation info that affect run time. `coverage_dir` is
+# excluded because it often contains a per run path.
+_invocationInfoKeysToHash = [
+    'command_line_arguments',
+    'environment_variables',
+    'extra_klee_arguments',
+    'ktest_file',
+    'ktest_files',
+]
+
+
+class RuntimeHistoryException(Exception):
+
+    def __init__(self, msg):
+        # pylint: disable=super-init-not-called
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+def computeConfigHash(runnerName, runnerConfig, invocationInfo):
+    """
+      Returns a hash of the configuration used to run ``invocationInfo``
+      (a raw invocation info dictionary) with the runner ``runnerName``
+      configured with ``runnerConfig``.
+    """
+    assert isinstance(runnerName, str)
+    assert isinstance(runnerConfig, dict)
+    assert isinstance(invocationInfo, dict)
+    data = {
+        'runner': runnerName,
+        'runner_config': runnerConfig,
+        'invocation_info': {k: invocationInfo.get(k, None) for k in _invocationInfoKeysToHash},
+    }
+    encoded = json.dumps(data, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def getRuntimeSamples(result):
+    """
+      Returns a list of ``(wallclockTime, timedOut)`` tuples for the raw
+      result info ``result``. Results in the merge format give multiple
+      samples. Errors or results without timing information give none.
+    """
+    if 'error' in result:
+        return []
+    wallclockTimes = result.get('wallclock_time', None)
+    timeouts = result.get('backend_timeout', False)
+    if wallclockTimes is None:
+        return []
+    if not isinstance(wallclockTimes, list):
+        wallclockTimes = [wallclockTimes]
+        timeouts = [timeouts]
+    elif not isinstance(timeouts, list):
+        timeouts = [timeouts] * len(wallclockTimes)
+    samples = []
+    for wallclockTime, timedOut in zip(wallclockTimes, timeouts):
+        if not isinstance(wallclockTime, (int, float)):
+            continue
+        samples.append((float(wallclockTime), bool(timedOut)))
+    return samples
+
+
+def predictMakespan(durations, numWorkers):
+    """
+      Returns the time needed to run jobs with the run times in
+      ``durations`` (in dispatch order) on ``numWorkers`` workers where each
+      job is given to the first worker that becomes free.
+    """
+    assert isinstance(numWorkers, int) and numWorkers > 0
+    workerFreeAt = [0.0] * numWorkers
+    for duration in durations:
+        start = heapq.heappop(workerFreeAt)
+        heapq.heappush(workerFreeAt, start + duration)
+    return max(workerFreeAt)
+
+
+def orderJobsByPredictedRunTime(jobIndices, invocationInfoObjects, runnerName, rc, history):
+    """
+      Sort ``jobIndices`` (a list of lists of indices that run sequentially)
+      so the groups with the longest predicted run time come first.
+      Jobs with no history are predicted to take the mean of the jobs that
+      do have history.
+
+      Returns a tuple ``(sortedJobIndices, predictedDurations,
+      numPredicted)`` where ``predictedDurations`` gives the predicted run
+      time of each group in ``sortedJobIndices``.
+    """
+    predictions = dict()
+    for l in jobIndices:
+        for index in l:
+            ii = invocationInfoObjects[index].GetInternalRepr()
+            predictions[index] = history.predict(
+                ii['program'],
+                computeConfigHash(runnerName, rc, ii))
+    known = [t for t in predictions.values() if t is not None]
+    numPredicted = len(known)
+    fallback = (sum(known) / len(known)) if len(known) > 0 else 0.0
+    groupDurations = [
+        (l, sum(fallback if predictions[i] is None else predictions[i] for i in l))
+        for l in jobIndices]
+    # `sorted()` is stable so jobs with the same prediction keep their order
+    groupDurations = sorted(groupDurations, key=lambda t: t[1], reverse=True)
+    return ([l for l, _ in groupDurations],
+            [d for _, d in groupDurations],
+            numPredicted)
+
+
+class RuntimeHistory:
+    """
+      Map from (program, config hash) to a predicted run time in seconds.
+
+      Each entry keeps a running mean of the observed wall clock times.
+      The mean is computed over at most ``maxSamples`` samples so that
+      it follows changes in run time. A run that hit the timeout only
+      gives a lower bound on the run time so it can only increase the
+      prediction.
+
+      It is safe to call ``record()`` from multiple threads.
+    """
+    schemaVersion = 0
+
+    def __init__(self, path, maxSamples=10):
+        assert isinstance(path, str)
+        assert isinstance(maxSamples, int) and maxSamples > 0
+        self._path = path
+        self._maxSamples = maxSamples
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self._path
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _makeKey(program, configHash):
+        return '{}:{}'.format(configHash, program)
+
+    def load(self):
+        """
+          Load the history from disk. A missing file is treated as an
+          empty history.
+        """
+        if not os.path.exists(self._path):
+            _logger.info('Runtime history "{}" does not exist. Starting with empty history'.format(
+                self._path))
+            return
+        try:
+            with open(self._path, 'r') as f:
+                data = json.load(f)
+        except ValueError as e:
+            raise RuntimeHistoryException(
+                'Failed to parse runtime history "{}": {}'.format(self._path, e))
+        if not isinstance(data, dict) or data.get('schema_version', None) != self.schemaVersion:
+            raise RuntimeHistoryException(
+                'Runtime history "{}" has unsupported format'.format(self._path))
+        with self._lock:
+            self._entries = data['entries']
+        _logger.info('Loaded {} entries from runtime history "{}"'.format(
+            len(self._entries), self._path))
+
+    def save(self):
+        """
+          Write the history to disk. The file is replaced atomically so an
+          interrupted save does not lose the existing history.
+        """
+        with self._lock:
+            data = {
+                'schema_version': self.schemaVersion,
+                'entries': self._entries,
+            }
+            tmpPath = self._path + '.tmp'
+            with open(tmpPath, 'w') as f:
+                json.dump(data, f, sort_keys=True, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmpPath, self._path)
+        _logger.info('Wrote {} entries to runtime history "{}"'.format(
+            len(self._entries), self._path))
+
+    def predict(self, program, configHash):
+        """
+          Returns the predicted run time in seconds or None if there is no
+          history for this job.
+        """
+        with self._lock:
+            entry = self._entries.get(self._makeKey(program, configHash), None)
+            if entry is None:
+                return None
+            return entry['wallclock_time']
+
+    def record(self, program, configHash, wallclockTime, timedOut=False):
+        assert isinstance(wallclockTime, float)
+        key = self._makeKey(program, configHash)
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                self._entries[key] = {
+                    'program': program,
+                    'config_hash': configHash,
+                    'wallclock_time': wallclockTime,
+                    'samples': 1,
+                    'timed_out': timedOut,
+                }
+                return
+            if timedOut:
+                # The real run time is at least `wallclockTime`
+                entry['wallclock_time'] = max(entry['wallclock_time'], wallclockTime)
+            else:
+                n = min(entry['samples'], self._maxSamples - 1)
+                entry['wallclock_time'] = (
+                    (entry['wallclock_time'] * n) + wallclockTime) / (n + 1)
+            entry['samples'] += 1
+            entry['timed_out'] = timedOut
+
+    def recordResult(self, runnerName, runnerConfig, result):
+        """
+          Record the run times in the raw result info ``result``. Returns
+          the number of samples recorded.
+        """
+        samples = getRuntimeSamples(result)
+        if len(samples) == 0:
+            return 0
+        invocationInfo = result['invocation_info']
+        configHash = computeConfigHash(runnerName, runnerConfig, invocationInfo)
+        for wallclockTime, timedOut in samples:
+            self.record(invocationInfo['program'], configHash, wallclockTime, timedOut)
+        return len(samples)
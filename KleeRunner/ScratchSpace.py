@@ -0,0 +1,224 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+"""
+Working directories on fast scratch storage (e.g. a tmpfs).
+
+Jobs like KLEE create thousands of small files in their working
+directory. When many jobs do this on the same slow (e.g. network) disk
+the metadata I/O becomes the bottleneck. Instead a job's working
+directory can be placed in a scratch directory and moved to
+``working_dirs_root`` by a background thread once the job finishes.
+
+A job's result is only appended to the journal once its working
+directory has been copied and synced to persistent storage. If the
+driver dies before then the job is run again when resuming.
+"""
+import logging
+import os
+import queue
+import shutil
+import stat
+import tempfile
+import threading
+
+_logger = logging.getLogger(__name__)
+
+
+class ScratchSpaceException(Exception):
+
+    def __init__(self, msg):
+        # pylint: disable=super-init-not-called
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+def _rewritePaths(value, oldPrefix, newPrefix):
+    if isinstance(value, str):
+        if value == oldPrefix or value.startswith(oldPrefix + os.sep):
+            return newPrefix + value[len(oldPrefix):]
+        return value
+    if isinstance(value, dict):
+        return {k: _rewritePaths(v, oldPrefix, newPrefix) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rewritePaths(v, oldPrefix, newPrefix) for v in value]
+    return value
+
+
+def _fsyncPath(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsyncTree(root):
+    """
+      fsync every file and directory in ``root`` and the directory
+      containing ``root``. Unlike ``os.sync()`` this does not wait for
+      writes from other jobs to be flushed.
+    """
+    for dirPath, _, fileNames in os.walk(root):
+        for fileName in fileNames:
+            path = os.path.join(dirPath, fileName)
+            # Skip symlinks, FIFOs, etc.
+            if stat.S_ISREG(os.lstat(path).st_mode):
+                _fsyncPath(path)
+        _fsyncPath(dirPath)
+    _fsyncPath(os.path.dirname(root))
+
+
+class ScratchSpace:
+    """
+      Places working directories in ``scratchRoot`` and moves them to
+      their final location in the background.
+
+      This wraps ``journal`` (any object with an ``append(index,
+      result)`` method) and can be used in its place. Results for jobs
+      whose working directory is in scratch space are appended to
+      ``journal`` once the directory has been moved and any paths in the
+      result refer to the final location.
+
+      If ``budgetInMiB`` is not None each working directory placed in
+      scratch space reserves ``reservationInMiB`` MiB of the budget until
+      it has been moved. A new working directory is placed in its final
+      location instead if the reservation would exceed the budget or if
+      the scratch file system has less than ``reservationInMiB`` MiB free.
+      The reservations are used rather than the file system's usage
+      because a job's usage grows after its directory is placed and the
+      file system might be used by others.
+    """
+    def __init__(self, scratchRoot, journal, budgetInMiB=None, reservationInMiB=None):
+        if not os.path.isdir(scratchRoot):
+            raise ScratchSpaceException(
+                'Scratch directory "{}" does not exist'.format(scratchRoot))
+        if budgetInMiB is not None:
+            if budgetInMiB <= 0:
+                raise ScratchSpaceException('scratch budget must be > 0')
+            if reservationInMiB is None:
+                raise ScratchSpaceException(
+                    'A reservation must be given when using a scratch budget')
+            if not (0 < reservationInMiB <= budgetInMiB):
+                raise ScratchSpaceException(
+                    'scratch reservation must be > 0 and not exceed the budget')
+        self._scratchRoot = scratchRoot
+        self._journal = journal
+        self._budgetInMiB = budgetInMiB
+        self._reservationInMiB = reservationInMiB
+        self._reservedInMiB = 0
+        # Unique to this run so concurrent runs don't collide
+        self._scratchDir = None
+        # Maps index to (scratch working directory, final working directory)
+        self._onScratch = dict()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        self._scratchDir = tempfile.mkdtemp(prefix='klee-runner-', dir=self._scratchRoot)
+        _logger.info('Using scratch directory "{}"'.format(self._scratchDir))
+        self._thread = threading.Thread(
+            target=self._threadBody, name='scratch_spill', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+          Wait for all working directories to be moved.
+        """
+        if self._thread is None:
+            return
+        _logger.info('Waiting for working directories to be moved out of scratch space')
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        try:
+            os.rmdir(self._scratchDir)
+        except OSError as e:
+            _logger.warning('Failed to remove scratch directory "{}": {}'.format(
+                self._scratchDir, e))
+
+    @property
+    def reservedInMiB(self):
+        return self._reservedInMiB
+
+    def workDirFor(self, index, finalWorkDir):
+        """
+          Returns the working directory the job with index ``index`` should
+          use. ``finalWorkDir`` is where it will end up.
+        """
+        assert self._scratchDir is not None
+        scratchWorkDir = os.path.join(self._scratchDir, os.path.basename(finalWorkDir))
+        with self._lock:
+            if self._budgetInMiB is not None:
+                if self._reservedInMiB + self._reservationInMiB > self._budgetInMiB:
+                    _logger.info(('{} MiB of scratch space is reserved. Not using it for '
+                                  'index {}').format(self._reservedInMiB, index))
+                    return finalWorkDir
+                free = shutil.disk_usage(self._scratchDir).free / (2**20)
+                if free < self._reservationInMiB:
+                    _logger.info(('Scratch space has {:.1f} MiB free. Not using it for '
+                                  'index {}').format(free, index))
+                    return finalWorkDir
+                self._reservedInMiB += self._reservationInMiB
+            self._onScratch[index] = (scratchWorkDir, finalWorkDir)
+        return scratchWorkDir
+
+    def _release(self):
+        if self._budgetInMiB is None:
+            return
+        with self._lock:
+            assert self._reservedInMiB >= self._reservationInMiB
+            self._reservedInMiB -= self._reservationInMiB
+
+    def append(self, index, result):
+        with self._lock:
+            paths = self._onScratch.pop(index, None)
+        if paths is None:
+            self._journal.append(index, result)
+            return
+        self._queue.put((index, result, paths[0], paths[1]))
+
+    def _threadBody(self):
+        done = False
+        while not done:
+            # Take everything that is waiting
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                done = True
+                batch.pop()
+            try:
+                self._spill(batch)
+            except Exception: # pylint: disable=broad-except
+                _logger.exception('Failed to move working directories out of scratch space')
+
+    def _spill(self, batch):
+        copied = []
+        for index, result, scratchWorkDir, finalWorkDir in batch:
+            try:
+                shutil.copytree(scratchWorkDir, finalWorkDir, symlinks=True)
+                _fsyncTree(finalWorkDir)
+                copied.append((index, result, scratchWorkDir, finalWorkDir))
+            except Exception as e: # pylint: disable=broad-except
+                _logger.error('Failed to move "{}" to "{}": {}'.format(
+                    scratchWorkDir, finalWorkDir, e))
+                # Leave the working directory where it is so it is
+                # not lost. This is not a complete result.
+                result = dict(result)
+                result['error'] = 'Failed to move working directory "{}": {}'.format(
+                    scratchWorkDir, e)
+                self._journal.append(index, result)
+                if not os.path.exists(scratchWorkDir):
+                    # Otherwise it still uses its reservation
+                    self._release()
+        for index, result, scratchWorkDir, finalWorkDir in copied:
+            self._journal.append(
+                index, _rewritePaths(result, scratchWorkDir, finalWorkDir))
+            shutil.rmtree(scratchWorkDir, ignore_errors=True)
+            self._release()
+            _logger.debug('Moved "{}" to "{}"'.format(scratchWorkDir, finalWorkDir))
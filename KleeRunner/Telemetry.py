@@ -0,0 +1,203 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+"""
+Resource usage time series recorded whilst a job runs.
+
+A backend samples the process tree of a job every ``interval`` seconds
+and the samples are written to a binary sidecar file in the job's
+working directory. To keep the file small the number of samples is
+bounded. When the bound is reached adjacent samples are merged and the
+interval is doubled, so long jobs are covered at a coarser resolution.
+
+File format (little endian)::
+
+    header: magic (4 bytes), version (uint16), reserved (uint16),
+            interval in seconds (double), number of samples (uint32)
+    columns: times, rss, cpu_percent (doubles), open_files (int64)
+
+Each column contains one value per sample.
+"""
+import array
+import logging
+import os
+import struct
+import sys
+
+_logger = logging.getLogger(__name__)
+
+TELEMETRY_FILE_NAME = 'telemetry.bin'
+
+_MAGIC = b'KRTS'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHHdI')
+# (column name, array type code)
+_COLUMNS = [
+    ('times', 'd'),
+    ('rss', 'd'),
+    ('cpu_percent', 'd'),
+    ('open_files', 'q'),
+]
+
+
+class TelemetryException(Exception):
+
+    def __init__(self, msg):
+        # pylint: disable=super-init-not-called
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+class Telemetry:
+    """
+      Time series loaded from a telemetry file.
+
+      ``times`` are seconds since the job started, ``rss`` is the total
+      resident set size of the process tree in MiB, ``cpu_percent`` is
+      the CPU use of the process tree since the previous sample (100
+      is one CPU fully used) and ``open_files`` is the total number of
+      open file descriptors in the process tree (-1 if the backend
+      cannot count them).
+    """
+    def __init__(self, interval, times, rss, cpu_percent, open_files):
+        self.interval = interval
+        self.times = times
+        self.rss = rss
+        self.cpu_percent = cpu_percent
+        self.open_files = open_files
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def peakRss(self):
+        return max(self.rss) if len(self.rss) > 0 else None
+
+    @property
+    def timeOfPeakRss(self):
+        if len(self.rss) == 0:
+            return None
+        return self.times[max(range(len(self.rss)), key=lambda i: self.rss[i])]
+
+
+class TelemetryRecorder:
+    """
+      Collects samples for a single job. Samples offered more often
+      than every ``interval`` seconds are dropped. At most
+      ``maxSamples`` samples are kept.
+
+      This is not thread safe. Only the thread sampling the job should
+      use it until sampling has finished.
+    """
+    def __init__(self, interval, maxSamples=1024):
+        assert isinstance(interval, float)
+        assert interval > 0.0
+        assert maxSamples >= 2
+        self._interval = interval
+        self._maxSamples = maxSamples
+        self._columns = {name: array.array(typeCode) for name, typeCode in _COLUMNS}
+        self._nextTime = 0.0
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def peakRss(self):
+        rss = self._columns['rss']
+        return max(rss) if len(rss) > 0 else None
+
+    def wantsSample(self, time):
+        return time >= self._nextTime
+
+    def addSample(self, time, rss, cpuPercent, openFiles):
+        """
+          ``time`` is seconds since the job started.
+        """
+        if not self.wantsSample(time):
+            return
+        self._columns['times'].append(time)
+        self._columns['rss'].append(rss)
+        self._columns['cpu_percent'].append(cpuPercent)
+        self._columns['open_files'].append(openFiles)
+        if len(self._columns['times']) >= self._maxSamples:
+            self._downsample()
+        self._nextTime = self._columns['times'][-1] + self._interval
+
+    def _downsample(self):
+        # Merge pairs of samples. The peaks are kept because they are
+        # usually what is interesting.
+        merged = {name: array.array(typeCode) for name, typeCode in _COLUMNS}
+        numSamples = len(self._columns['times'])
+        for i in range(0, numSamples - 1, 2):
+            merged['times'].append(self._columns['times'][i])
+            merged['rss'].append(max(self._columns['rss'][i], self._columns['rss'][i + 1]))
+            merged['cpu_percent'].append(
+                (self._columns['cpu_percent'][i] + self._columns['cpu_percent'][i + 1]) / 2.0)
+            merged['open_files'].append(
+                max(self._columns['open_files'][i], self._columns['open_files'][i + 1]))
+        if numSamples % 2 == 1:
+            for name, _ in _COLUMNS:
+                merged[name].append(self._columns[name][-1])
+        self._columns = merged
+        self._interval *= 2.0
+
+    def save(self, path):
+        numSamples = len(self._columns['times'])
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, 0, self._interval, numSamples))
+            for name, _ in _COLUMNS:
+                column = self._columns[name]
+                if sys.byteorder != 'little':
+                    column = array.array(column.typecode, column)
+                    column.byteswap()
+                column.tofile(f)
+        _logger.debug('Wrote {} telemetry samples to "{}"'.format(numSamples, path))
+
+
+def loadTelemetry(path):
+    """
+      Load the telemetry file at ``path``. Returns a ``Telemetry``.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise TelemetryException('"{}" is truncated'.format(path))
+        magic, version, _, interval, numSamples = _HEADER.unpack(header)
+        if magic != _MAGIC:
+            raise TelemetryException('"{}" is not a telemetry file'.format(path))
+        if version != _VERSION:
+            raise TelemetryException('"{}" has unsupported version {}'.format(path, version))
+        columns = dict()
+        for name, typeCode in _COLUMNS:
+            column = array.array(typeCode)
+            try:
+                column.fromfile(f, numSamples)
+            except (EOFError, ValueError):
+                # `ValueError` is raised if the file ends part way
+                # through a value.
+                raise TelemetryException('"{}" is truncated'.format(path))
+            if sys.byteorder != 'little':
+                column.byteswap()
+            columns[name] = column
+    return Telemetry(interval, **columns)
+
+
+def getTelemetryInterval(backendName, kwargs):
+    """
+      Get and check the ``telemetry_interval`` backend option from
+      ``kwargs``. Returns None if telemetry is disabled.
+    """
+    interval = kwargs.get('telemetry_interval', None)
+    if interval is None:
+        return None
+    if isinstance(interval, int):
+        interval = float(interval)
+    if not (isinstance(interval, float) and interval > 0.0):
+        raise TelemetryException(
+            '{} backend option "telemetry_interval" must be a number > 0'.format(backendName))
+    return interval
+
+
+def getTelemetryFile(workingDirectory):
+    return os.path.join(workingDirectory, TELEMETRY_FILE_NAME)
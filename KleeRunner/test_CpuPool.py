@@ -0,0 +1,102 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import unittest
+from unittest import mock
+
+from . import CpuPool
+from .RunnerContext import RunnerContext
+
+# NUMA node to CPU ids of a fake machine
+_TOPOLOGY = {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}
+
+@mock.patch.object(CpuPool.CpuPool, '_get_numa_node_cpus', return_value=_TOPOLOGY)
+class CpuPoolTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # So we can see debug output
+        logging.basicConfig(level=logging.DEBUG)
+
+    def test_jobs_do_not_share_cpus(self, _):
+        pool = CpuPool.CpuPool({0, 1, 2, 4, 5, 6}, 2, False)
+        allocations = [pool.get_cpus() for _ in range(0, 3)]
+        cpus = [cpu for allocation in allocations for cpu, _ in allocation]
+        self.assertEqual(sorted(cpus), [0, 1, 2, 4, 5, 6])
+        for allocation in allocations:
+            for cpu, node in allocation:
+                self.assertIn(cpu, _TOPOLOGY[node])
+        # Exhausted
+        with self.assertRaises(CpuPool.CpuPoolException):
+            pool.get_cpus()
+        # Released CPUs can be handed out again
+        released = set(cpu for cpu, _ in allocations[1])
+        pool.release_cpus(released)
+        self.assertEqual(set(cpu for cpu, _ in pool.get_cpus()), released)
+
+    def test_memset_of_nearest_node(self, _):
+        pool = CpuPool.CpuPool({0, 1, 2, 4, 5, 6}, 2, True)
+        first = pool.get_cpus()
+        second = pool.get_cpus()
+        # Each job's CPUs are in a single node
+        for allocation in [first, second]:
+            self.assertEqual(len(set(node for _, node in allocation)), 1)
+        self.assertEqual(set(node for _, node in first), {0})
+        self.assertEqual(set(node for _, node in second), {1})
+        # Each node only has one CPU left so a job can't be placed even
+        # though two CPUs are free.
+        with self.assertRaises(CpuPool.CpuPoolException):
+            pool.get_cpus()
+        pool.release_cpus(set(cpu for cpu, _ in first))
+        self.assertEqual(set(node for _, node in pool.get_cpus()), {0})
+
+    def test_memset_needs_cpus_in_one_node(self, _):
+        pool = CpuPool.CpuPool({0, 4}, 2, True)
+        with self.assertRaises(CpuPool.CpuPoolException):
+            pool.get_cpus()
+        # Without the memory set the CPUs can come from different nodes
+        pool = CpuPool.CpuPool({0, 4}, 2, False)
+        self.assertEqual(pool.get_cpus(), {(0, 0), (4, 1)})
+
+    def test_release_unknown_cpu(self, _):
+        pool = CpuPool.CpuPool({0, 1}, 1, False)
+        with self.assertRaises(CpuPool.CpuPoolException):
+            pool.release_cpus({7})
+
+    def test_unknown_available_cpu(self, _):
+        pool = CpuPool.CpuPool({0, 99}, 1, False)
+        with self.assertRaises(CpuPool.CpuPoolException):
+            pool.get_cpus()
+
+    def test_shared_pool(self, _):
+        ctx = RunnerContext(num_parallel_jobs=2)
+        pool = CpuPool.getCpuPool(ctx, {0, 1}, 1, False)
+        self.assertIs(CpuPool.getCpuPool(ctx, {0, 1}, 1, False), pool)
+        with self.assertRaises(CpuPool.CpuPoolException):
+            CpuPool.getCpuPool(ctx, {0, 1}, 2, False)
+
+
+class ParseResourcePinningOptionsTest(unittest.TestCase):
+    def test_valid(self):
+        self.assertEqual(
+            CpuPool.parseResourcePinningOptions(
+                {'cpu_ids': [0, 1, 2, 3], 'cpus_per_job': 2}, 2),
+            ({0, 1, 2, 3}, 2, False))
+        self.assertEqual(
+            CpuPool.parseResourcePinningOptions(
+                {'cpu_ids': [0, 1], 'cpus_per_job': 1, 'use_memset_of_nearest_node': True}, 1),
+            ({0, 1}, 1, True))
+
+    def test_invalid(self):
+        invalid = [
+            [],
+            {'cpus_per_job': 1},
+            {'cpu_ids': [], 'cpus_per_job': 1},
+            {'cpu_ids': [-1], 'cpus_per_job': 1},
+            {'cpu_ids': [0]},
+            {'cpu_ids': [0], 'cpus_per_job': 0},
+            {'cpu_ids': [0], 'cpus_per_job': 1, 'use_memset_of_nearest_node': 1},
+            # Not enough CPUs for two parallel jobs
+            {'cpu_ids': [0, 1, 2], 'cpus_per_job': 2},
+        ]
+        for value in invalid:
+            with self.assertRaises(CpuPool.CpuPoolException):
+                CpuPool.parseResourcePinningOptions(value, 2)
@@ -0,0 +1,126 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from . import JobQueue
+
+class JobQueueTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # So we can see debug output
+        logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='klee-runner-test-')
+        self.path = os.path.join(self.temp_dir, 'queue.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def create(self, jobIndices):
+        indices = [i for l in jobIndices for i in l]
+        with JobQueue.JobQueue(self.path) as queue:
+            queue.create(
+                {'runner': 'Mock', 'runner_config': {}},
+                self.temp_dir,
+                {i: {'program': 'p{}'.format(i)} for i in indices},
+                jobIndices)
+
+    def runWorker(self, name, claimed):
+        """
+          Run every job that can be claimed until the queue is no longer
+          running. Claimed jobs are appended to ``claimed``.
+        """
+        with JobQueue.JobQueue(self.path) as queue:
+            while True:
+                job = queue.claimJob(name)
+                if job is None:
+                    if queue.getState() != JobQueue.QUEUE_RUNNING:
+                        return
+                    time.sleep(0.01)
+                    continue
+                claimed.append(job)
+                jobId, indices, _ = job
+                for index in indices:
+                    queue.heartbeat(name)
+                    self.assertTrue(queue.addResult(
+                        jobId, name, index, {'exit_code': 0, 'worker': name}))
+                queue.finishJob(jobId, name)
+
+    def runCoordinator(self, workerTimeout):
+        """
+          Returns a list of ``(index, result)`` tuples in the order they
+          were received.
+        """
+        results = []
+        lastResultId = 0
+        with JobQueue.JobQueue(self.path) as queue:
+            deadline = time.monotonic() + 30.0
+            while time.monotonic() < deadline:
+                isFinished = queue.countUnfinishedJobs() == 0
+                for lastResultId, index, result in queue.fetchResults(lastResultId):
+                    results.append((index, result))
+                if isFinished:
+                    queue.setState(JobQueue.QUEUE_FINISHED)
+                    return results
+                queue.requeueStaleJobs(workerTimeout)
+                time.sleep(0.05)
+            queue.setState(JobQueue.QUEUE_CANCELLED)
+        self.fail('Coordinator timed out')
+
+    def test_two_workers_with_requeue(self):
+        self.create([[0, 1], [2], [3], [4, 5], [6]])
+
+        # A worker that claims the first job, finishes part of it then
+        # stops sending heartbeats.
+        slow = JobQueue.JobQueue(self.path)
+        slow.open()
+        slowJobId, slowIndices, slowAttempt = slow.claimJob('slow')
+        self.assertEqual(slowIndices, [0, 1])
+        self.assertEqual(slowAttempt, 0)
+        self.assertTrue(slow.addResult(slowJobId, 'slow', 0, {'exit_code': 0}))
+
+        claimed = {'a': [], 'b': []}
+        workers = [
+            threading.Thread(target=self.runWorker, args=(name, claimed[name]))
+            for name in sorted(claimed.keys())]
+        for worker in workers:
+            worker.start()
+        results = self.runCoordinator(workerTimeout=0.2)
+        for worker in workers:
+            worker.join()
+
+        # The slow worker lost its job so its late results are discarded
+        self.assertFalse(slow.addResult(slowJobId, 'slow', 1, {'exit_code': 0}))
+        slow.finishJob(slowJobId, 'slow')
+        slow.close()
+
+        # Every index has exactly one result
+        self.assertEqual(sorted(index for index, _ in results), list(range(0, 7)))
+        # Only the unfinished index was requeued and it was given a new
+        # attempt number so it does not reuse the slow worker's working
+        # directories.
+        allClaimed = claimed['a'] + claimed['b']
+        self.assertIn((slowJobId, [1], 1), allClaimed)
+        self.assertEqual(
+            sorted(i for _, indices, _ in allClaimed for i in indices),
+            list(range(1, 7)))
+        with JobQueue.JobQueue(self.path) as queue:
+            self.assertEqual(queue.countUnfinishedJobs(), 0)
+            self.assertEqual(queue.getState(), JobQueue.QUEUE_FINISHED)
+
+    def test_release_requeues_failed_indices(self):
+        self.create([[0, 1, 2]])
+        with JobQueue.JobQueue(self.path) as queue:
+            jobId, indices, attempt = queue.claimJob('w')
+            self.assertEqual((indices, attempt), ([0, 1, 2], 0))
+            self.assertTrue(queue.addResult(jobId, 'w', 0, {'exit_code': 0}))
+            self.assertTrue(queue.addResult(jobId, 'w', 1, {'error': 'boom'}))
+            queue.releaseJob(jobId, 'w')
+            self.assertEqual(queue.claimJob('w'), (jobId, [1, 2], 1))
+            self.assertIsNone(queue.claimJob('w'))
@@ -0,0 +1,114 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import gzip
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from . import LogCapture
+
+class LogCaptureTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # So we can see debug output
+        logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='klee-runner-test-')
+        self.path = os.path.join(self.temp_dir, 'log.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_log(self, chunks, options):
+        with LogCapture.LogWriter(self.path, options) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_uncapped(self):
+        chunks = [b'abc', b'def' * 1000]
+        self.assertEqual(self.write_log(chunks, None), b''.join(chunks))
+        self.assertEqual(
+            self.write_log(chunks, LogCapture.LogCaptureOptions()), b''.join(chunks))
+
+    def test_head_and_tail(self):
+        options = LogCapture.LogCaptureOptions(head_bytes=4, tail_bytes=3)
+        data = self.write_log([b'01', b'2345', b'6789'], options)
+        self.assertEqual(data, b'0123\n[klee-runner: 3 bytes of output omitted]\n789')
+
+    def test_head_only(self):
+        options = LogCapture.LogCaptureOptions(head_bytes=4)
+        data = self.write_log([b'0123456789'], options)
+        self.assertEqual(data, b'0123\n[klee-runner: 6 bytes of output omitted]\n')
+
+    def test_tail_only(self):
+        options = LogCapture.LogCaptureOptions(tail_bytes=5)
+        # Many small chunks so the tail is trimmed several times
+        data = self.write_log([bytes([c]) for c in b'abcdefghijklmnopqrstuvwxyz'], options)
+        self.assertEqual(data, b'\n[klee-runner: 21 bytes of output omitted]\nvwxyz')
+
+    def test_shorter_than_cap(self):
+        options = LogCapture.LogCaptureOptions(head_bytes=4, tail_bytes=4)
+        self.assertEqual(self.write_log([b'012', b'345'], options), b'012345')
+
+    def test_gzip(self):
+        options = LogCapture.LogCaptureOptions(head_bytes=2, tail_bytes=2, compression='gzip')
+        path = LogCapture.getLogFilePath(self.path, options)
+        self.assertEqual(path, self.path + '.gz')
+        with LogCapture.LogWriter(path, options) as writer:
+            writer.write(b'0123456')
+        with gzip.open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'01\n[klee-runner: 3 bytes of output omitted]\n56')
+
+    def test_options(self):
+        self.assertIsNone(LogCapture.getLogCaptureOptions('Test', {}))
+        options = LogCapture.getLogCaptureOptions(
+            'Test', {'log_capture': {'head_bytes': 10, 'compression': 'gzip'}})
+        self.assertEqual(options.head_bytes, 10)
+        self.assertEqual(options.tail_bytes, 0)
+        self.assertEqual(options.compression, 'gzip')
+        self.assertTrue(options.capped)
+        for bad in [[], {'head_bytes': -1}, {'compression': 'lzma'}, {'foo': 1}]:
+            with self.assertRaises(LogCapture.LogCaptureException):
+                LogCapture.getLogCaptureOptions('Test', {'log_capture': bad})
+
+    def run_with_sink(self, options):
+        with LogCapture.LogSink(self.path, options) as sink:
+            process = subprocess.Popen(
+                ['/bin/sh', '-c', 'echo hello; echo world'],
+                stdout=sink.stdout,
+                stderr=subprocess.STDOUT)
+            sink.processStarted()
+            process.wait()
+        with open(sink.path, 'rb') as f:
+            return f.read()
+
+    def test_sink(self):
+        self.assertEqual(self.run_with_sink(None), b'hello\nworld\n')
+        options = LogCapture.LogCaptureOptions(head_bytes=3, tail_bytes=3)
+        self.assertEqual(
+            self.run_with_sink(options),
+            b'hel\n[klee-runner: 6 bytes of output omitted]\nld\n')
+
+    def test_sink_large_fd(self):
+        # The pipe is read correctly when its file descriptors are larger
+        # than `select.select()` supports.
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY and hard < 1100:
+            self.skipTest('Cannot open enough file descriptors')
+        resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, 1100), hard))
+        fds = []
+        try:
+            while len(fds) == 0 or fds[-1] < 1024:
+                fds.append(os.open(os.devnull, os.O_RDONLY))
+            options = LogCapture.LogCaptureOptions(head_bytes=100)
+            self.assertEqual(self.run_with_sink(options), b'hello\nworld\n')
+        finally:
+            for fd in fds:
+                os.close(fd)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
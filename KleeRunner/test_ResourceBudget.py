@@ -0,0 +1,90 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import unittest
+from unittest import mock
+
+from . import ResourceBudget
+
+class ResourceBudgetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # So we can see debug output
+        logging.basicConfig(level=logging.DEBUG)
+
+    def test_invalid_budget(self):
+        with self.assertRaises(ResourceBudget.ResourceBudgetException):
+            ResourceBudget.ResourceBudget(memoryBudgetInMiB=0)
+        with self.assertRaises(ResourceBudget.ResourceBudgetException):
+            ResourceBudget.ResourceBudget(cpuBudget=-1)
+
+    def test_reserve_and_release(self):
+        budget = ResourceBudget.ResourceBudget(
+            memoryBudgetInMiB=1000, cpuBudget=4, respectFreeMemory=False)
+        self.assertTrue(budget.tryReserve(600, 2))
+        self.assertTrue(budget.tryReserve(400, 1))
+        self.assertEqual(budget.reservedMemoryInMiB, 1000)
+        self.assertEqual(budget.reservedCpus, 3)
+        # Memory exhausted
+        self.assertFalse(budget.tryReserve(1, 0))
+        # Failed reservations don't change what is reserved
+        self.assertEqual(budget.reservedMemoryInMiB, 1000)
+        self.assertEqual(budget.reservedCpus, 3)
+
+        budget.release(600, 2)
+        self.assertEqual(budget.reservedMemoryInMiB, 400)
+        self.assertEqual(budget.reservedCpus, 1)
+        # CPUs exhausted
+        self.assertFalse(budget.tryReserve(100, 4))
+        self.assertTrue(budget.tryReserve(100, 3))
+
+        budget.release(400, 1)
+        budget.release(100, 3)
+        self.assertEqual(budget.reservedMemoryInMiB, 0)
+        self.assertEqual(budget.reservedCpus, 0)
+
+    def test_unlimited(self):
+        budget = ResourceBudget.ResourceBudget(respectFreeMemory=False)
+        for _ in range(10):
+            self.assertTrue(budget.tryReserve(2**20, 64))
+        self.assertEqual(budget.reservedCpus, 640)
+
+    def test_check_reservation_can_fit(self):
+        budget = ResourceBudget.ResourceBudget(
+            memoryBudgetInMiB=1000, cpuBudget=4, respectFreeMemory=False)
+        budget.checkReservationCanFit(1000, 4)
+        with self.assertRaises(ResourceBudget.ResourceBudgetException):
+            budget.checkReservationCanFit(1001, 1)
+        with self.assertRaises(ResourceBudget.ResourceBudgetException):
+            budget.checkReservationCanFit(1, 5)
+
+    @mock.patch.object(ResourceBudget, 'getAvailableMemoryInMiB', return_value=500)
+    def test_respect_free_memory(self, _):
+        budget = ResourceBudget.ResourceBudget(
+            memoryBudgetInMiB=10000, respectFreeMemory=True)
+        # Nothing of ours is running so waiting won't help. The
+        # reservation is allowed.
+        self.assertTrue(budget.tryReserve(600, 0))
+        # Wait for our running job to finish
+        self.assertFalse(budget.tryReserve(400, 0))
+        budget.release(600, 0)
+        self.assertTrue(budget.tryReserve(400, 0))
+        self.assertEqual(budget.reservedMemoryInMiB, 400)
+
+    @mock.patch.object(ResourceBudget, 'getAvailableMemoryInMiB', return_value=1000)
+    def test_free_memory_reduced_by_reservations(self, getAvailableMemory):
+        # Also applies without a memory budget
+        budget = ResourceBudget.ResourceBudget(respectFreeMemory=True)
+        self.assertTrue(budget.tryReserve(600, 0))
+        # The job has not allocated its memory yet so the measurement
+        # still says 1000 MiB is free.
+        self.assertFalse(budget.tryReserve(600, 0))
+        self.assertTrue(budget.tryReserve(400, 0))
+        self.assertEqual(getAvailableMemory.call_count, 1)
+
+    @mock.patch.object(ResourceBudget, 'getAvailableMemoryInMiB', return_value=1000)
+    def test_free_memory_measured_again(self, getAvailableMemory):
+        budget = ResourceBudget.ResourceBudget(
+            respectFreeMemory=True, freeMemorySamplePeriod=0.0)
+        self.assertTrue(budget.tryReserve(600, 0))
+        self.assertTrue(budget.tryReserve(600, 0))
+        self.assertEqual(getAvailableMemory.call_count, 2)
@@ -0,0 +1,108 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import ResultJournal
+
+class ResultJournalTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # So we can see debug output
+        logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='klee-runner-test-')
+        self.path = os.path.join(self.temp_dir, 'output.yml.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_records(self, records):
+        with ResultJournal.ResultJournal(self.path) as journal:
+            for index, result in records:
+                journal.append(index, result)
+
+    def test_round_trip(self):
+        records = [(0, {'exit_code': 0}), (2, {'exit_code': 1}), (1, {'error': 'boom'})]
+        self.write_records(records)
+        self.assertEqual(list(ResultJournal.iterRecords(self.path)), records)
+
+    def test_repair_partial_tail(self):
+        self.write_records([(0, {'exit_code': 0}), (1, {'exit_code': 0})])
+        # Simulate the driver dying whilst writing a record
+        with open(self.path, 'a') as f:
+            f.write('{"index": 2, "res')
+        self.assertEqual(
+            [i for i, _ in ResultJournal.iterRecords(self.path)], [0, 1])
+
+        # Opening the journal removes the partial record so new records
+        # start on their own line.
+        self.write_records([(2, {'exit_code': 0})])
+        with open(self.path, 'r') as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(all(l.endswith('\n') for l in lines))
+        self.assertEqual(
+            [i for i, _ in ResultJournal.iterRecords(self.path)], [0, 1, 2])
+
+    def test_repair_partial_only_record(self):
+        with open(self.path, 'w') as f:
+            f.write('{"index": 0')
+        self.write_records([(0, {'exit_code': 0})])
+        self.assertEqual(
+            list(ResultJournal.iterRecords(self.path)), [(0, {'exit_code': 0})])
+
+    def test_repair_partial_tail_longer_than_block(self):
+        self.write_records([(0, {'exit_code': 0})])
+        with open(self.path, 'a') as f:
+            f.write('{"index": 1, "result": "' + 'x' * 10000)
+        self.write_records([(1, {'exit_code': 0})])
+        self.assertEqual(
+            [i for i, _ in ResultJournal.iterRecords(self.path)], [0, 1])
+
+    def test_completed_indices(self):
+        self.write_records([
+            (0, {'exit_code': 0}),
+            # Failed then succeeded when re-run
+            (1, {'error': 'boom'}),
+            (1, {'exit_code': 0}),
+            # Succeeded then failed when re-run
+            (2, {'exit_code': 0}),
+            (2, {'error': 'boom'}),
+            (3, {'error': 'boom'}),
+        ])
+        self.assertEqual(ResultJournal.getCompletedIndices(self.path), {0, 1})
+
+    def test_latest_records(self):
+        self.write_records([
+            (0, {'exit_code': 1}),
+            (1, {'exit_code': 0}),
+            (0, {'exit_code': 2}),
+        ])
+        self.assertEqual(
+            list(ResultJournal.iterLatestRecords(self.path)),
+            [(1, {'exit_code': 0}), (0, {'exit_code': 2})])
+
+    def test_resume(self):
+        # First run: job 1 was cancelled and the driver died writing job 2
+        self.write_records([(0, {'exit_code': 0}), (1, {'error': 'Job was cancelled'})])
+        with open(self.path, 'a') as f:
+            f.write('{"index": 2, "res')
+        completed = ResultJournal.getCompletedIndices(self.path)
+        self.assertEqual(completed, {0})
+
+        # Resumed run only runs the jobs that did not complete
+        self.write_records(
+            [(i, {'exit_code': i}) for i in range(0, 3) if i not in completed])
+        self.assertEqual(
+            sorted(ResultJournal.iterLatestRecords(self.path)),
+            [(0, {'exit_code': 0}), (1, {'exit_code': 1}), (2, {'exit_code': 2})])
+        self.assertEqual(ResultJournal.getCompletedIndices(self.path), {0, 1, 2})
+
+    def test_append_when_closed(self):
+        journal = ResultJournal.ResultJournal(self.path)
+        with self.assertRaises(ResultJournal.ResultJournalException):
+            journal.append(0, {})
@@ -0,0 +1,74 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import threading
+import time
+import unittest
+
+from .RunnerContext import RunnerContext
+
+class RunnerContextMemoizeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # So we can see debug output
+        logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.ctx = RunnerContext(num_parallel_jobs=4)
+        self.calls = []
+
+    def make_fn(self, value):
+        def fn():
+            self.calls.append(value)
+            return value
+        return fn
+
+    def test_called_once_per_key(self):
+        self.assertEqual(self.ctx.memoize('a', self.make_fn(1)), 1)
+        self.assertEqual(self.ctx.memoize('a', self.make_fn(2)), 1)
+        self.assertEqual(self.ctx.memoize(('b', None), self.make_fn(3)), 3)
+        self.assertEqual(self.calls, [1, 3])
+
+    def test_none_result_memoized(self):
+        self.assertIsNone(self.ctx.memoize('a', lambda: self.calls.append(1)))
+        self.assertIsNone(self.ctx.memoize('a', lambda: self.calls.append(2)))
+        self.assertEqual(self.calls, [1])
+
+    def test_exception_memoized(self):
+        def fail():
+            self.calls.append('fail')
+            raise ValueError('boom')
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                self.ctx.memoize('a', fail)
+        self.assertEqual(self.calls, ['fail'])
+
+    def test_concurrent_callers_wait(self):
+        def slow():
+            self.calls.append('slow')
+            time.sleep(0.2)
+            return 'result'
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.ctx.memoize('a', slow)))
+            for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['result'] * 4)
+        self.assertEqual(self.calls, ['slow'])
+
+    def test_different_keys_not_serialised(self):
+        # A slow call must not hold up callers with other keys
+        started = threading.Event()
+        finish = threading.Event()
+        def blocking():
+            started.set()
+            finish.wait(10)
+            return 'a'
+        thread = threading.Thread(target=self.ctx.memoize, args=('a', blocking))
+        thread.start()
+        started.wait(10)
+        self.assertEqual(self.ctx.memoize('b', self.make_fn('b')), 'b')
+        finish.set()
+        thread.join()
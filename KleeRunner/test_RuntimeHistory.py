@@ -0,0 +1,115 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import RuntimeHistory
+
+class MockInvocationInfo:
+    def __init__(self, program, **kwargs):
+        self._data = {'program': program}
+        self._data.update(kwargs)
+
+    def GetInternalRepr(self):
+        return self._data
+
+class RuntimeHistoryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # So we can see debug output
+        logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='klee-runner-test-')
+        self.history = RuntimeHistory.RuntimeHistory(
+            os.path.join(self.temp_dir, 'history.json'), maxSamples=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def order(self, jobIndices, invocationInfoObjects):
+        return RuntimeHistory.orderJobsByPredictedRunTime(
+            jobIndices, invocationInfoObjects, 'Klee', {}, self.history)
+
+    def recordFor(self, ii, wallclockTime, timedOut=False):
+        self.history.record(
+            ii.GetInternalRepr()['program'],
+            RuntimeHistory.computeConfigHash('Klee', {}, ii.GetInternalRepr()),
+            wallclockTime,
+            timedOut)
+
+    def test_record_running_mean(self):
+        self.history.record('a', 'h', 10.0)
+        self.history.record('a', 'h', 20.0)
+        self.assertEqual(self.history.predict('a', 'h'), 15.0)
+        # Only `maxSamples` samples are used
+        self.history.record('a', 'h', 35.0)
+        self.assertEqual(self.history.predict('a', 'h'), 25.0)
+        # A timeout can only increase the prediction
+        self.history.record('a', 'h', 5.0, timedOut=True)
+        self.assertEqual(self.history.predict('a', 'h'), 25.0)
+        self.history.record('a', 'h', 100.0, timedOut=True)
+        self.assertEqual(self.history.predict('a', 'h'), 100.0)
+        self.assertIsNone(self.history.predict('a', 'other'))
+
+    def test_save_load(self):
+        self.history.record('a', 'h', 10.0)
+        self.history.save()
+        loaded = RuntimeHistory.RuntimeHistory(self.history.path)
+        loaded.load()
+        self.assertEqual(len(loaded), 1)
+        self.assertEqual(loaded.predict('a', 'h'), 10.0)
+
+    def test_config_hash_depends_on_ktest_files(self):
+        a = {'program': 'p', 'ktest_files': ['a.ktest']}
+        b = {'program': 'p', 'ktest_files': ['b.ktest']}
+        self.assertNotEqual(
+            RuntimeHistory.computeConfigHash('Klee', {}, a),
+            RuntimeHistory.computeConfigHash('Klee', {}, b))
+        # `coverage_dir` does not affect run time
+        c = dict(a, coverage_dir='/tmp/x')
+        self.assertEqual(
+            RuntimeHistory.computeConfigHash('Klee', {}, a),
+            RuntimeHistory.computeConfigHash('Klee', {}, c))
+
+    def test_order_longest_first(self):
+        iis = [MockInvocationInfo(p) for p in ['short', 'long', 'medium']]
+        self.recordFor(iis[0], 1.0)
+        self.recordFor(iis[1], 100.0)
+        self.recordFor(iis[2], 10.0)
+        jobIndices, durations, numPredicted = self.order([[0], [1], [2]], iis)
+        self.assertEqual(jobIndices, [[1], [2], [0]])
+        self.assertEqual(durations, [100.0, 10.0, 1.0])
+        self.assertEqual(numPredicted, 3)
+
+    def test_order_unknown_uses_mean(self):
+        iis = [MockInvocationInfo(p) for p in ['unknown', 'long', 'short']]
+        self.recordFor(iis[1], 30.0)
+        self.recordFor(iis[2], 10.0)
+        jobIndices, durations, numPredicted = self.order([[0], [1], [2]], iis)
+        self.assertEqual(jobIndices, [[1], [0], [2]])
+        self.assertEqual(durations, [30.0, 20.0, 10.0])
+        self.assertEqual(numPredicted, 2)
+
+    def test_order_groups_and_ties(self):
+        iis = [MockInvocationInfo(p) for p in ['a', 'b', 'c', 'd']]
+        for ii in iis:
+            self.recordFor(ii, 5.0)
+        # Groups are ordered by their total run time. Groups with the
+        # same prediction keep their order.
+        jobIndices, durations, _ = self.order([[0], [1], [2, 3]], iis)
+        self.assertEqual(jobIndices, [[2, 3], [0], [1]])
+        self.assertEqual(durations, [10.0, 5.0, 5.0])
+
+    def test_order_no_history(self):
+        iis = [MockInvocationInfo(p) for p in ['a', 'b']]
+        jobIndices, durations, numPredicted = self.order([[0], [1]], iis)
+        self.assertEqual(jobIndices, [[0], [1]])
+        self.assertEqual(durations, [0.0, 0.0])
+        self.assertEqual(numPredicted, 0)
+
+    def test_predict_makespan(self):
+        self.assertEqual(RuntimeHistory.predictMakespan([10.0, 5.0, 5.0], 2), 10.0)
+        self.assertEqual(RuntimeHistory.predictMakespan([5.0, 5.0, 10.0], 2), 15.0)
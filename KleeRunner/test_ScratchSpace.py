@@ -0,0 +1,159 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from . import ScratchSpace
+
+class ListJournal:
+    def __init__(self):
+        self.records = []
+
+    def append(self, index, result):
+        self.records.append((index, result))
+
+class ScratchSpaceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # So we can see debug output
+        logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='klee-runner-test-')
+        self.scratch_root = os.path.join(self.temp_dir, 'scratch')
+        self.work_dirs_root = os.path.join(self.temp_dir, 'work')
+        os.mkdir(self.scratch_root)
+        os.mkdir(self.work_dirs_root)
+        self.journal = ListJournal()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def final_work_dir(self, index):
+        return os.path.join(self.work_dirs_root, 'workdir-{}'.format(index))
+
+    def run_job(self, scratch, index):
+        """
+          Create a working directory like a job would and append its
+          result.
+        """
+        workDir = scratch.workDirFor(index, self.final_work_dir(index))
+        os.mkdir(workDir)
+        with open(os.path.join(workDir, 'log.txt'), 'w') as f:
+            f.write('index {}\n'.format(index))
+        scratch.append(index, {
+            'working_directory': workDir,
+            'log_file': os.path.join(workDir, 'log.txt'),
+            'replays': [{'log_file': os.path.join(workDir, 'logs', '0.txt')}],
+            'program': '/bin/true',
+        })
+        return workDir
+
+    def test_spill_rewrites_paths(self):
+        scratch = ScratchSpace.ScratchSpace(self.scratch_root, self.journal)
+        scratch.open()
+        workDirs = [self.run_job(scratch, index) for index in range(0, 3)]
+        scratch.close()
+
+        for workDir in workDirs:
+            self.assertTrue(workDir.startswith(self.scratch_root + os.sep))
+            self.assertFalse(os.path.exists(workDir))
+        # Only the per run directory was created in the scratch root and
+        # it is removed when closed.
+        self.assertEqual(os.listdir(self.scratch_root), [])
+
+        self.assertEqual(sorted(i for i, _ in self.journal.records), [0, 1, 2])
+        for index, result in self.journal.records:
+            finalWorkDir = self.final_work_dir(index)
+            self.assertEqual(result['working_directory'], finalWorkDir)
+            self.assertEqual(result['log_file'], os.path.join(finalWorkDir, 'log.txt'))
+            self.assertEqual(
+                result['replays'][0]['log_file'],
+                os.path.join(finalWorkDir, 'logs', '0.txt'))
+            self.assertEqual(result['program'], '/bin/true')
+            with open(result['log_file'], 'r') as f:
+                self.assertEqual(f.read(), 'index {}\n'.format(index))
+
+    def test_budget_reservations(self):
+        scratch = ScratchSpace.ScratchSpace(
+            self.scratch_root, self.journal, budgetInMiB=2, reservationInMiB=1)
+        scratch.open()
+        try:
+            first = scratch.workDirFor(0, self.final_work_dir(0))
+            second = scratch.workDirFor(1, self.final_work_dir(1))
+            self.assertTrue(first.startswith(self.scratch_root + os.sep))
+            self.assertTrue(second.startswith(self.scratch_root + os.sep))
+            self.assertEqual(scratch.reservedInMiB, 2)
+            # The budget is reserved even though nothing has been written
+            self.assertEqual(
+                scratch.workDirFor(2, self.final_work_dir(2)), self.final_work_dir(2))
+            # A job not on scratch space goes straight to the journal
+            scratch.append(2, {'working_directory': self.final_work_dir(2)})
+            self.assertEqual(
+                self.journal.records,
+                [(2, {'working_directory': self.final_work_dir(2)})])
+            for index, workDir in [(0, first), (1, second)]:
+                os.mkdir(workDir)
+                scratch.append(index, {'working_directory': workDir})
+        finally:
+            scratch.close()
+        # Reservations are released once the directories are moved
+        self.assertEqual(scratch.reservedInMiB, 0)
+        self.assertTrue(os.path.isdir(self.final_work_dir(0)))
+        self.assertTrue(os.path.isdir(self.final_work_dir(1)))
+
+    def test_failed_move(self):
+        scratch = ScratchSpace.ScratchSpace(
+            self.scratch_root, self.journal, budgetInMiB=1, reservationInMiB=1)
+        scratch.open()
+        # The job failed before creating its working directory
+        workDir = scratch.workDirFor(0, self.final_work_dir(0))
+        scratch.append(0, {'working_directory': workDir})
+        scratch.close()
+        self.assertEqual(len(self.journal.records), 1)
+        self.assertIn('error', self.journal.records[0][1])
+        self.assertEqual(scratch.reservedInMiB, 0)
+
+    def test_moved_files_synced(self):
+        synced = []
+        fsyncPath = ScratchSpace._fsyncPath
+        def recordFsync(path):
+            synced.append(path)
+            fsyncPath(path)
+        scratch = ScratchSpace.ScratchSpace(self.scratch_root, self.journal)
+        with mock.patch.object(ScratchSpace, '_fsyncPath', side_effect=recordFsync), \
+                mock.patch('os.sync') as syncMock:
+            scratch.open()
+            workDir = self.run_job(scratch, 0)
+            os.symlink('log.txt', os.path.join(workDir, 'link'))
+            scratch.close()
+        syncMock.assert_not_called()
+        self.assertEqual(sorted(synced), [
+            self.work_dirs_root,
+            self.final_work_dir(0),
+            os.path.join(self.final_work_dir(0), 'log.txt'),
+        ])
+
+    def test_failed_sync(self):
+        scratch = ScratchSpace.ScratchSpace(self.scratch_root, self.journal)
+        with mock.patch.object(ScratchSpace, '_fsyncPath', side_effect=OSError('EIO')):
+            scratch.open()
+            workDir = self.run_job(scratch, 0)
+            scratch.close()
+        # The result is not complete and the working directory is kept
+        self.assertEqual(len(self.journal.records), 1)
+        self.assertIn('error', self.journal.records[0][1])
+        self.assertTrue(os.path.exists(os.path.join(workDir, 'log.txt')))
+
+    def test_invalid(self):
+        with self.assertRaises(ScratchSpace.ScratchSpaceException):
+            ScratchSpace.ScratchSpace(
+                os.path.join(self.temp_dir, 'missing'), self.journal)
+        with self.assertRaises(ScratchSpace.ScratchSpaceException):
+            ScratchSpace.ScratchSpace(self.scratch_root, self.journal, budgetInMiB=10)
+        with self.assertRaises(ScratchSpace.ScratchSpaceException):
+            ScratchSpace.ScratchSpace(
+                self.scratch_root, self.journal, budgetInMiB=10, reservationInMiB=11)
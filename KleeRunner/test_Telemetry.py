@@ -0,0 +1,98 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import Telemetry
+
+class TelemetryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # So we can see debug output
+        logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='klee-runner-test-')
+        self.path = Telemetry.getTelemetryFile(self.temp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def add_samples(self, recorder, times):
+        for t in times:
+            recorder.addSample(float(t), t * 10.0, float(t), t)
+
+    def test_save_load_round_trip(self):
+        recorder = Telemetry.TelemetryRecorder(0.5)
+        self.assertIsNone(recorder.peakRss)
+        self.add_samples(recorder, [0, 1, 2])
+        self.assertEqual(recorder.peakRss, 20.0)
+        recorder.save(self.path)
+        telemetry = Telemetry.loadTelemetry(self.path)
+        self.assertEqual(len(telemetry), 3)
+        self.assertEqual(telemetry.interval, 0.5)
+        self.assertEqual(list(telemetry.times), [0.0, 1.0, 2.0])
+        self.assertEqual(list(telemetry.rss), [0.0, 10.0, 20.0])
+        self.assertEqual(list(telemetry.cpu_percent), [0.0, 1.0, 2.0])
+        self.assertEqual(list(telemetry.open_files), [0, 1, 2])
+        self.assertEqual(telemetry.peakRss, 20.0)
+        self.assertEqual(telemetry.timeOfPeakRss, 2.0)
+
+    def test_samples_faster_than_interval_dropped(self):
+        recorder = Telemetry.TelemetryRecorder(1.0)
+        for t in [0.0, 0.2, 0.9, 1.0, 1.5, 2.1]:
+            recorder.addSample(t, 1.0, 1.0, 1)
+        recorder.save(self.path)
+        self.assertEqual(list(Telemetry.loadTelemetry(self.path).times), [0.0, 1.0, 2.1])
+
+    def test_save_load_round_trip_with_downsampling(self):
+        recorder = Telemetry.TelemetryRecorder(1.0, maxSamples=4)
+        # Hitting the bound merges pairs of samples and doubles the
+        # interval
+        self.add_samples(recorder, [0, 1, 2, 3])
+        self.assertEqual(recorder.interval, 2.0)
+        # t = 5 is dropped because of the larger interval
+        self.add_samples(recorder, [4, 5, 6])
+        self.assertEqual(recorder.interval, 4.0)
+        recorder.save(self.path)
+
+        telemetry = Telemetry.loadTelemetry(self.path)
+        self.assertEqual(telemetry.interval, 4.0)
+        self.assertEqual(list(telemetry.times), [0.0, 4.0])
+        # Peaks are kept
+        self.assertEqual(list(telemetry.rss), [30.0, 60.0])
+        self.assertEqual(list(telemetry.open_files), [3, 6])
+        # CPU use is averaged
+        self.assertEqual(list(telemetry.cpu_percent), [1.5, 5.0])
+
+    def test_empty(self):
+        Telemetry.TelemetryRecorder(1.0).save(self.path)
+        telemetry = Telemetry.loadTelemetry(self.path)
+        self.assertEqual(len(telemetry), 0)
+        self.assertIsNone(telemetry.peakRss)
+        self.assertIsNone(telemetry.timeOfPeakRss)
+
+    def test_load_invalid(self):
+        recorder = Telemetry.TelemetryRecorder(1.0)
+        self.add_samples(recorder, [0, 1])
+        recorder.save(self.path)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(data[:-1])
+        with self.assertRaises(Telemetry.TelemetryException):
+            Telemetry.loadTelemetry(self.path)
+        with open(self.path, 'wb') as f:
+            f.write(b'XXXX' + data[4:])
+        with self.assertRaises(Telemetry.TelemetryException):
+            Telemetry.loadTelemetry(self.path)
+
+    def test_get_telemetry_interval(self):
+        self.assertIsNone(Telemetry.getTelemetryInterval('Test', {}))
+        self.assertEqual(
+            Telemetry.getTelemetryInterval('Test', {'telemetry_interval': 2}), 2.0)
+        for bad in [0, -1.0, 'fast']:
+            with self.assertRaises(Telemetry.TelemetryException):
+                Telemetry.getTelemetryInterval('Test', {'telemetry_interval': bad})
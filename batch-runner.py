@@ -4,84 +4,107 @@
     Script to run a Runner over a set of programs.
 """
 import argparse
+import collections
 import datetime
 import logging
+import math
 import os
 import traceback
 import signal
 import sys
+import time
 from KleeRunner import RunnerFactory
 from KleeRunner import InvocationInfo
+from KleeRunner import JobQueue
 from KleeRunner import DriverUtil
 from KleeRunner import ResultInfo
+from KleeRunner import ResourceBudget
+from KleeRunner import ResultJournal
+from KleeRunner import RuntimeHistory
 from KleeRunner import RunnerContext
+from KleeRunner import ScratchSpace
+from KleeRunner.RunnerJob import RunnerBuilder, RunnerJob, killJobs
 
 _logger = None
-futureToRunners = None
+futureToJobs = None
+cancelRequested = False
 
 
 def handleInterrupt(signum, _):
+    global cancelRequested
     logging.info('Received signal {}'.format(signum))
-    if futureToRunners != None:
-        cancel(futureToRunners)
+    if futureToJobs != None:
+        cancel(futureToJobs)
+    else:
+        # Coordinator mode
+        cancelRequested = True
 
 
-def cancel(futureToRunnersMap):
+def cancel(futureToJobsMap):
+    global cancelRequested
+    # Setting this stops any more jobs from being dispatched
+    cancelRequested = True
     _logger.warning('Cancelling futures')
     # Cancel all futures first. If we tried
     # to kill the runner at the same time then
     # other futures would start which we don't want
-    for future in futureToRunnersMap.keys():
+    for future in list(futureToJobsMap.keys()):
         future.cancel()
 
     # Then we can kill the runners if required
     _logger.warning('Killing runners')
-    for runner_list in futureToRunnersMap.values():
-        if isinstance(runner_list, list):
-            for runner in runner_list:
-                runner.kill()
-        else:
-            assert isinstance(runner_list, SequentialRunnerHolder)
-            runner_list.kill()
-
-class SequentialRunnerHolder:
+    killJobs(list(futureToJobsMap.values()))
+
+
+def getJobReservation(rc):
     """
-    Convenient wrapper for doing force sequentialised execution
-    during a parallel run
+    Returns a tuple (memoryInMiB, cpus) of the resources a single job
+    declares it needs in the runner config ``rc``.
     """
-    def __init__(self, seq_runners):
-        assert isinstance(seq_runners, list)
-        self._seq_runners = seq_runners
-        assert len(self._seq_runners) > 0
-        self._completed_runs = []
-        self._killSequentialLoop = False
-
-    def run(self):
-        for index, r in enumerate(self._seq_runners):
-            if self._killSequentialLoop is True:
-                _logger.warning('Sequential loop killed')
-                break
-            _logger.info('Doing sequential run {}/{} with runner "{}"'.format(
-                index+1,
-                len(self._seq_runners),
-                r.programPathArgument))
-            r.run()
-            self._completed_runs.append(r)
-        return
-
-    def kill(self):
-        _logger.info('Killing SequentialRunnerHolder')
-        self._killSequentialLoop = True
-        for r in self._seq_runners:
-            r.kill()
-
-    def completed_runs(self):
-        return self._completed_runs
+    # "max_memory" is checked when the runners are made. Round up so a
+    # fractional value is not under reserved.
+    memoryInMiB = int(math.ceil(rc.get('max_memory', 0)))
+    cpus = 1
+    try:
+        cpus = rc['backend']['config']['resource_pinning']['cpus_per_job']
+    except (KeyError, TypeError):
+        pass
+    return (memoryInMiB, cpus)
+
+
+def runCoordinator(queue, journal, numInvocationsToRun, workerTimeout, pollPeriod):
+    """
+      Wait for workers to run the jobs in ``queue``, appending results to
+      ``journal`` as they arrive. Returns when every job is finished or a
+      cancel is requested.
+    """
+    lastResultId = 0
+    completedInvocationCounter = 0
+    while not cancelRequested:
+        # Check if everything is finished before fetching results so that
+        # no result can be missed.
+        isFinished = queue.countUnfinishedJobs() == 0
+        for lastResultId, index, result in queue.fetchResults(lastResultId):
+            journal.append(index, result)
+            completedInvocationCounter += 1
+            _logger.info('Received result for index {}. {}/{} ({:.1f}%)'.format(
+                index,
+                completedInvocationCounter,
+                numInvocationsToRun,
+                100 * (float(completedInvocationCounter) / numInvocationsToRun)))
+        if isFinished:
+            queue.setState(JobQueue.QUEUE_FINISHED)
+            return
+        queue.requeueStaleJobs(workerTimeout)
+        time.sleep(pollPeriod)
+    _logger.warning('Cancelling queue. Workers will kill their jobs')
+    queue.setState(JobQueue.QUEUE_CANCELLED)
+
 
 def entryPoint(args):
     # pylint: disable=global-statement,too-many-branches,too-many-statements
     # pylint: disable=too-many-return-statements
-    global _logger, futureToRunners
+    global _logger, futureToJobs
     parser = argparse.ArgumentParser(description=__doc__)
     DriverUtil.parserAddLoggerArg(parser)
     parser.add_argument("--dry", action='store_true',
@@ -97,6 +120,77 @@ def entryPoint(args):
     parser.add_argument("working_dirs_root",
                         help="Directory to create working directories inside")
     parser.add_argument("yaml_output", help="path to write YAML output to")
+    parser.add_argument("--journal",
+                        default=None,
+                        help=("Path to journal that results are appended to as "
+                              "they complete (Default <yaml_output>.journal)"))
+    parser.add_argument("--resume",
+                        action='store_true',
+                        default=False,
+                        help=("Resume an interrupted run using the existing "
+                              "journal and working_dirs_root. Jobs that already "
+                              "have a result in the journal are not run again"))
+    parser.add_argument("--runtime-history",
+                        dest="runtime_history",
+                        default=None,
+                        help=("Path to a runtime history file. If given jobs "
+                              "with the longest predicted run time are "
+                              "started first and the run times of this run "
+                              "are added to the history. (Default not used)"))
+    parser.add_argument("--queue",
+                        default=None,
+                        help=("Run as a coordinator. Jobs are put in a job queue "
+                              "at this path (e.g. on shared storage) and are run "
+                              "by batch-worker.py processes instead of this "
+                              "process. -j is only used to predict the makespan"))
+    parser.add_argument("--worker-timeout",
+                        dest="worker_timeout",
+                        type=float,
+                        default=60.0,
+                        help=("When using --queue, the time in seconds after "
+                              "which jobs of a worker that has stopped sending "
+                              "heartbeats are given to another worker "
+                              "(Default %(default)s)"))
+    parser.add_argument("--memory-budget",
+                        dest="memory_budget",
+                        type=int,
+                        default=None,
+                        help=("Total memory in MiB that running jobs may reserve. "
+                              "Each job reserves the runner's \"max_memory\". "
+                              "If 0 the total physical memory is used. "
+                              "(Default no limit)"))
+    parser.add_argument("--cpu-budget",
+                        dest="cpu_budget",
+                        type=int,
+                        default=None,
+                        help=("Total number of CPUs that running jobs may reserve. "
+                              "Each job reserves \"cpus_per_job\" if resource "
+                              "pinning is used, otherwise 1. (Default no limit)"))
+    parser.add_argument("--ignore-free-memory",
+                        dest="ignore_free_memory",
+                        action='store_true',
+                        default=False,
+                        help=("Do not wait for the measured free memory to be "
+                              "large enough for a job's \"max_memory\""))
+    parser.add_argument("--scratch-dir",
+                        dest="scratch_dir",
+                        default=None,
+                        help=("Create working directories in this directory (e.g. "
+                              "a tmpfs) and move them to working_dirs_root in the "
+                              "background when each job finishes"))
+    parser.add_argument("--scratch-budget",
+                        dest="scratch_budget",
+                        type=int,
+                        default=None,
+                        help=("Maximum number of MiB of --scratch-dir that working "
+                              "directories can reserve. (Default no limit)"))
+    parser.add_argument("--scratch-reservation",
+                        dest="scratch_reservation",
+                        type=int,
+                        default=None,
+                        help=("Number of MiB of --scratch-budget each working "
+                              "directory reserves until it has been moved. "
+                              "(Default --scratch-budget divided by --jobs)"))
 
     pargs = parser.parse_args(args)
 
@@ -170,13 +264,66 @@ def entryPoint(args):
     yamlOutputFile = os.path.abspath(pargs.yaml_output)
 
     if os.path.exists(yamlOutputFile):
+        if not pargs.resume:
+            _logger.error(
+                'yaml_output file ("{}") already exists'.format(yamlOutputFile))
+            return 1
+        _logger.warning(
+            'yaml_output file ("{}") will be overwritten'.format(yamlOutputFile))
+
+    journalFile = pargs.journal
+    if journalFile is None:
+        journalFile = yamlOutputFile + '.journal'
+    journalFile = os.path.abspath(journalFile)
+    completedIndices = set()
+    if pargs.resume:
+        if not os.path.exists(journalFile):
+            _logger.error(
+                'Cannot resume. journal file ("{}") does not exist'.format(
+                    journalFile))
+            return 1
+        try:
+            completedIndices = ResultJournal.getCompletedIndices(journalFile)
+        except Exception as e: # pylint: disable=broad-except
+            _logger.error('Failed to read journal "{}"'.format(journalFile))
+            _logger.error(e)
+            _logger.debug(traceback.format_exc())
+            return 1
+        invalidIndices = completedIndices.difference(
+            range(0, len(invocationInfoObjects)))
+        if len(invalidIndices) > 0:
+            _logger.error(
+                'journal refers to indices not in the invocation info: {}'.format(
+                    invalidIndices))
+            return 1
+        _logger.info('Resuming. {} out of {} jobs already completed'.format(
+            len(completedIndices),
+            len(invocationInfoObjects)))
+    elif os.path.exists(journalFile):
         _logger.error(
-            'yaml_output file ("{}") already exists'.format(yamlOutputFile))
+            'journal file ("{}") already exists'.format(journalFile))
         return 1
 
+    queueFile = None
+    if pargs.queue is not None:
+        queueFile = os.path.abspath(pargs.queue)
+        if os.path.exists(queueFile):
+            if not pargs.resume:
+                _logger.error(
+                    'queue file ("{}") already exists'.format(queueFile))
+                return 1
+            _logger.warning('Removing old queue file "{}"'.format(queueFile))
+            os.remove(queueFile)
+        output_misc_data['queue'] = queueFile
+
     # Setup the directory to hold working directories
     workDirsRoot = os.path.abspath(pargs.working_dirs_root)
-    if os.path.exists(workDirsRoot):
+    if pargs.resume:
+        if not os.path.isdir(workDirsRoot):
+            _logger.error(
+                'Cannot resume. "{}" is not a directory'.format(workDirsRoot))
+            return 1
+    elif os.path.exists(workDirsRoot):
         # Check its a directory and its empty
         if not os.path.isdir(workDirsRoot):
             _logger.error(
@@ -215,50 +362,113 @@ def entryPoint(args):
 
     rc = config['runner_config']
 
-    # Create the runners
-    runners = []
-    for index, invocationInfo in enumerate(invocationInfoObjects):
-        _logger.info('Creating runner {} out of {} ({:.1f}%)'.format(
-            index + 1,
-            len(invocationInfoObjects),
-            100 * float(index + 1) / len(invocationInfoObjects)))
-        # Create working directory for this runner
-        workDir = os.path.join(workDirsRoot, 'workdir-{}'.format(index))
-        assert not os.path.exists(workDir)
+    # Setup admission control
+    memoryBudget = pargs.memory_budget
+    if memoryBudget is not None:
+        if memoryBudget < 0:
+            _logger.error('--memory-budget must be >= 0')
+            return 1
+        if memoryBudget == 0:
+            memoryBudget = int(ResourceBudget.getTotalMemoryInMiB())
+        _logger.info('Using memory budget of {} MiB'.format(memoryBudget))
+    jobReservation = getJobReservation(rc)
+    try:
+        resourceBudget = ResourceBudget.ResourceBudget(
+            memoryBudgetInMiB=memoryBudget,
+            cpuBudget=pargs.cpu_budget,
+            respectFreeMemory=not pargs.ignore_free_memory)
+        resourceBudget.checkReservationCanFit(*jobReservation)
+    except ResourceBudget.ResourceBudgetException as e:
+        _logger.error(e)
+        return 1
+    if memoryBudget is not None and jobReservation[0] == 0:
+        _logger.warning('"max_memory" is not set so jobs do not reserve any memory')
 
+    history = None
+    if pargs.runtime_history is not None:
+        history = RuntimeHistory.RuntimeHistory(os.path.abspath(pargs.runtime_history))
         try:
-            os.mkdir(workDir)
-        except Exception as e: # pylint: disable=broad-except
-            _logger.error(
-                'Failed to create working directory "{}"'.format(workDir))
+            history.load()
+        except RuntimeHistory.RuntimeHistoryException as e:
             _logger.error(e)
-            _logger.debug(traceback.format_exc())
             return 1
 
-        # Do coverage_dir subtitution if necessary
-        if invocationInfo.CoverageDir is not None:
-            coverage_dir = invocationInfo.CoverageDir
-            assert isinstance(coverage_dir, str)
-            new_coverage_dir = coverage_dir.replace('@global_work_dir@', workDirsRoot)
-            _logger.info('Replacing coverage dir "{}" with "{}"'.format(
-                coverage_dir,
-                new_coverage_dir)
-            )
-            invocationInfo.GetInternalRepr()['coverage_dir'] = new_coverage_dir
-            # Create the directory if necessary
-            if not os.path.exists(new_coverage_dir):
-                _logger.info('Creating coverage directory "{}"'.format(new_coverage_dir))
-                os.makedirs(new_coverage_dir)
-
-        # Pass in a copy of rc so that if a runner accidently modifies
-        # a config it won't affect other runners.
-        runners.append(RunnerClass(invocationInfo, workDir, rc.copy(), runner_ctx))
-
-    # Run the runners and build the report
-    reports = []
+    journal = ResultJournal.ResultJournal(journalFile)
+
+    scratchSpace = None
+    if pargs.scratch_dir is not None and not pargs.dry:
+        if queueFile is not None:
+            _logger.error('--scratch-dir cannot be used with --queue')
+            return 1
+        scratchReservation = pargs.scratch_reservation
+        if scratchReservation is None and pargs.scratch_budget is not None:
+            scratchReservation = max(1, pargs.scratch_budget // pargs.jobs)
+        try:
+            scratchSpace = ScratchSpace.ScratchSpace(
+                os.path.abspath(pargs.scratch_dir),
+                journal,
+                pargs.scratch_budget,
+                scratchReservation)
+        except ScratchSpace.ScratchSpaceException as e:
+            _logger.error(e)
+            return 1
+
+    builder = RunnerBuilder(
+        RunnerClass,
+        invocationInfoObjects,
+        workDirsRoot,
+        rc,
+        runner_ctx,
+        removeExisting=pargs.resume,
+        scratchSpace=scratchSpace)
+
+    # Work out the groups of indices that will be dispatched to workers.
+    # Jobs completed by a previous run are not run again.
+    if sequential_execution_indices and (pargs.jobs > 1 or queueFile is not None):
+        # Force sequential execution of runners where appropriate
+        jobIndices = []
+        for l in sequential_execution_indices:
+            l = [i for i in l if i not in completedIndices]
+            if len(l) == 0:
+                continue
+            _logger.info('Forcing indicies "{}" to run sequentially'.format(l))
+            jobIndices.append(l)
+    else:
+        # Simple: One invocation per job
+        jobIndices = [[i] for i in range(0, len(invocationInfoObjects))
+                      if i not in completedIndices]
+    numInvocationsToRun = sum(len(l) for l in jobIndices)
+    indicesToRun = set(i for l in jobIndices for i in l)
+
+    predictedMakespan = None
+    if history is not None:
+        # Start the longest jobs first so that a long job started near the
+        # end does not leave the other workers idle.
+        jobIndices, predictedDurations, numPredicted = RuntimeHistory.orderJobsByPredictedRunTime(
+            jobIndices, invocationInfoObjects, config['runner'], rc, history)
+        _logger.info('Runtime history has predictions for {}/{} invocations'.format(
+            numPredicted, numInvocationsToRun))
+        if numPredicted > 0:
+            predictedMakespan = RuntimeHistory.predictMakespan(
+                predictedDurations, pargs.jobs)
+            _logger.info('Predicted makespan: {:.1f} seconds'.format(predictedMakespan))
+            output_misc_data['predicted_makespan'] = predictedMakespan
+
+    # Run the runners. Results are written to the journal as soon
+    # as they are available so they survive the driver crashing.
     exitCode = 0
 
     if pargs.dry:
+        # Runners are normally created on demand. Create each one
+        # here to check they can be initialised.
+        for l in jobIndices:
+            for index in l:
+                try:
+                    builder.build(index)
+                except Exception: # pylint: disable=broad-except
+                    _logger.error('Failed to create runner for index {}'.format(index))
+                    _logger.error(traceback.format_exc())
+                    return 1
         _logger.info('Not running runners')
         return exitCode
 
@@ -266,27 +476,49 @@ def entryPoint(args):
     _logger.info('Starting {}'.format(startTime.isoformat(' ')))
     output_misc_data['start_time'] = str(startTime.isoformat(' '))
 
-    if pargs.jobs == 1:
+    journal.open()
+    # Where completed jobs send their results
+    resultSink = journal
+    if scratchSpace is not None:
+        scratchSpace.open()
+        resultSink = scratchSpace
+
+    if queueFile is not None:
+        signal.signal(signal.SIGINT, handleInterrupt)
+        signal.signal(signal.SIGTERM, handleInterrupt)
+        queue = JobQueue.JobQueue(queueFile)
+        queue.open()
+        try:
+            queue.create(
+                config,
+                workDirsRoot,
+                {i: invocationInfoObjects[i].GetInternalRepr() for i in indicesToRun},
+                jobIndices)
+            _logger.info('Waiting for workers. Run "batch-worker.py {}" to start a worker'.format(
+                queueFile))
+            runCoordinator(
+                queue,
+                journal,
+                numInvocationsToRun,
+                pargs.worker_timeout,
+                pollPeriod=1.0)
+        finally:
+            queue.close()
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    elif pargs.jobs == 1:
         _logger.info('Running jobs sequentially')
-        for r in runners:
+        for l in jobIndices:
+            job = RunnerJob(l, builder, resultSink)
             try:
-                r.run()
-                reports.append(r.getResults())
+                job.run()
             except KeyboardInterrupt:
                 _logger.error('Keyboard interrupt')
-                # This is slightly redundant because the runner
-                # currently kills itself if KeyboardInterrupt is thrown
-                r.kill()
+                # The job keeps the interrupted runner so that this
+                # makes sure the tool is not left running.
+                job.kill()
                 break
-            except Exception: # pylint: disable=broad-except
-                _logger.error("Error handling:{}".format(r.program))
-                _logger.error(traceback.format_exc())
-
-                # Attempt to add the error to the reports
-                errorLog = {}
-                errorLog['invocation_info'] = r.InvocationInfo
-                errorLog['error'] = traceback.format_exc()
-                reports.append(errorLog)
+            if job.hadError:
                 exitCode = 1
     else:
 
@@ -296,76 +528,58 @@ def entryPoint(args):
         signal.signal(signal.SIGTERM, handleInterrupt)
 
         _logger.info('Running jobs in parallel')
-        completedFutureCounter = 0
+        completedInvocationCounter = 0
+        pendingJobIndices = collections.deque(jobIndices)
+        # How often to retry admitting a job that is waiting for memory
+        admissionPollPeriod = 1.0
+        del jobIndices
         import concurrent.futures
         try:
             with concurrent.futures.ThreadPoolExecutor(max_workers=pargs.jobs) as executor:
-                if sequential_execution_indices:
-                    # Force sequential execution of runners where appropriate
-                    futureToRunners = {}
-                    for l in sequential_execution_indices:
-                        # Create list of runners to run sequentially
-                        _logger.info('Forcing indicies "{}" to run sequentially'.format(l))
-                        seq_runners = []
-                        for runner_index in l:
-                            seq_runners.append(runners[runner_index])
-
-                        # Use wrapper to force sequential execution
-                        seq_runner = SequentialRunnerHolder(seq_runners)
-                        future = executor.submit(seq_runner.run)
-                        futureToRunners[future] = seq_runner
-                else:
-                    # Simple: One runner to one future mapping.
-                    futureToRunners = {executor.submit(r.run): [r] for r in runners}
-                for future in concurrent.futures.as_completed(futureToRunners):
-                    completed_runner_list = None
-                    if isinstance(futureToRunners[future], list):
-                        completed_runner_list = futureToRunners[future]
-                    else:
-                        assert isinstance(futureToRunners[future], SequentialRunnerHolder)
-                        completed_runner_list = futureToRunners[future].completed_runs()
-                    for r in completed_runner_list:
-                        _logger.debug('{} runner finished'.format(
-                            r.programPathArgument))
-
-                        if future.done() and not future.cancelled():
-                            completedFutureCounter += 1
-                            _logger.info('Completed {}/{} ({:.1f}%)'.format(
-                                completedFutureCounter,
-                                len(runners),
-                                100 * (float(completedFutureCounter) / len(runners))
-                                ))
-
-                        excep = None
-                        try:
-                            if future.exception():
-                                excep = future.exception()
-                        except concurrent.futures.CancelledError as e:
-                            excep = e
-
-                        if excep != None:
-                            # Attempt to log the error reports
-                            errorLog = {}
-                            r_work_dir = None
-                            try:
-                                r_work_dir = r.workingDirectory
-                            except Exception:
-                                pass
-                            errorLog['working_directory'] = r_work_dir
-                            errorLog['invocation_info'] = r.InvocationInfo.GetInternalRepr()
-                            errorLog['error'] = "\n".join(
-                                traceback.format_exception(
-                                    type(excep),
-                                    excep,
-                                    None))
-                            # Only emit messages about exceptions that aren't to do
-                            # with cancellation
-                            if not isinstance(excep, concurrent.futures.CancelledError):
-                                _logger.error('{} runner hit exception:\n{}'.format(
-                                    r.programPathArgument, errorLog['error']))
-                            reports.append(errorLog)
-                        else:
-                            reports.append(r.getResults())
+                futureToJobs = {}
+                while len(futureToJobs) > 0 or (
+                        len(pendingJobIndices) > 0 and not cancelRequested):
+                    # Only dispatch a job when a worker is free and its
+                    # resources can be reserved so that runners are created
+                    # when they are about to run.
+                    admissionBlocked = False
+                    while (len(futureToJobs) < pargs.jobs and
+                           len(pendingJobIndices) > 0 and
+                           not cancelRequested):
+                        if not resourceBudget.tryReserve(*jobReservation):
+                            admissionBlocked = True
+                            break
+                        job = RunnerJob(pendingJobIndices.popleft(), builder, resultSink)
+                        futureToJobs[executor.submit(job.run)] = job
+                    if len(futureToJobs) == 0:
+                        # Waiting for free memory on the host
+                        time.sleep(admissionPollPeriod)
+                        continue
+                    done, _ = concurrent.futures.wait(
+                        futureToJobs,
+                        timeout=admissionPollPeriod if admissionBlocked else None,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        job = futureToJobs.pop(future)
+                        resourceBudget.release(*jobReservation)
+                        if future.cancelled():
+                            continue
+                        excep = future.exception()
+                        if excep is not None:
+                            # Should not happen. RunnerJob catches exceptions
+                            # from runners.
+                            _logger.error('Job for indices {} hit exception:\n{}'.format(
+                                job.indices,
+                                "\n".join(traceback.format_exception(
+                                    type(excep), excep, None))))
+                            exitCode = 1
+                            continue
+                        completedInvocationCounter += future.result()
+                        _logger.info('Completed {}/{} ({:.1f}%)'.format(
+                            completedInvocationCounter,
+                            numInvocationsToRun,
+                            100 * (float(completedInvocationCounter) / numInvocationsToRun)
+                            ))
         except KeyboardInterrupt:
             # The executor should of been cleaned terminated.
             # We'll then write what we can to the output YAML file
@@ -375,17 +589,43 @@ def entryPoint(args):
             signal.signal(signal.SIGINT, signal.SIG_DFL)
             signal.signal(signal.SIGTERM, signal.SIG_DFL)
 
+    if scratchSpace is not None:
+        scratchSpace.close()
+    journal.close()
+
     endTime = datetime.datetime.now()
     output_misc_data['end_time'] = str(endTime.isoformat(' '))
     output_misc_data['run_time'] = str(endTime- startTime)
+    if predictedMakespan is not None:
+        _logger.info('Predicted makespan: {:.1f} seconds, actual makespan: {:.1f} seconds'.format(
+            predictedMakespan, (endTime - startTime).total_seconds()))
 
-    # Write result to YAML file
+    # Write result to YAML file by streaming the results back out of the
+    # journal.
     outputData = {
         'schema_version': schemaVersion,
-        'results': reports,
         'misc': output_misc_data,
     }
-    DriverUtil.writeYAMLOutputFile(yamlOutputFile, outputData)
+    DriverUtil.writeYAMLOutputFileStreamingResults(
+        yamlOutputFile,
+        outputData,
+        (result for _, result in ResultJournal.iterLatestRecords(journalFile)))
+    if history is not None:
+        # Only record results from this run. Results from a previous run
+        # being resumed were recorded by that run.
+        numSamples = 0
+        for index, result in ResultJournal.iterLatestRecords(journalFile):
+            if index in indicesToRun:
+                numSamples += history.recordResult(config['runner'], rc, result)
+        _logger.info('Adding {} samples to runtime history'.format(numSamples))
+        history.save()
+    if len(ResultJournal.getCompletedIndices(journalFile)) == len(invocationInfoObjects):
+        # Everything in the journal is now in the YAML file
+        os.remove(journalFile)
+    else:
+        _logger.warning(('Not all jobs completed. Keeping journal "{}" so '
+                         'the run can be continued with --resume').format(
+                             journalFile))
 
     _logger.info('Finished {}'.format(endTime.isoformat(' ')))
     _logger.info('Total run time: {}'.format(endTime - startTime))
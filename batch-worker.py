@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+"""
+    Worker that runs jobs from a job queue created by
+    ``batch-runner.py --queue``. Several workers (on the same or
+    different machines) can use the same queue.
+"""
+import argparse
+import concurrent.futures
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import traceback
+from KleeRunner import DriverUtil
+from KleeRunner import InvocationInfo
+from KleeRunner import JobQueue
+from KleeRunner import RunnerContext
+from KleeRunner import RunnerFactory
+from KleeRunner.RunnerJob import RunnerBuilder, RunnerJob, killJobs
+
+_logger = None
+stopRequested = threading.Event()
+
+
+def handleInterrupt(signum, _):
+    logging.info('Received signal {}'.format(signum))
+    stopRequested.set()
+
+
+def sendHeartbeats(queue, workerName, runningJobs, lock, period):
+    """
+      Periodically tell the coordinator we are alive. Runs in its own
+      thread so that heartbeats are sent whilst jobs are running. If the
+      queue is cancelled the running jobs are killed.
+    """
+    while not stopRequested.wait(period):
+        try:
+            queue.heartbeat(workerName)
+            state = queue.getState()
+        except Exception: # pylint: disable=broad-except
+            _logger.error('Failed to send heartbeat:\n{}'.format(traceback.format_exc()))
+            continue
+        if state == JobQueue.QUEUE_CANCELLED:
+            _logger.warning('Queue was cancelled')
+            stopRequested.set()
+    with lock:
+        jobs = list(runningJobs)
+    killJobs(jobs)
+
+
+def entryPoint(args):
+    # pylint: disable=global-statement,too-many-locals
+    global _logger
+    parser = argparse.ArgumentParser(description=__doc__)
+    DriverUtil.parserAddLoggerArg(parser)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default="1",
+        help="Number of jobs to run in parallel (Default %(default)s)")
+    parser.add_argument("--name",
+                        default=None,
+                        help="Name of this worker (Default <hostname>:<pid>)")
+    parser.add_argument("--working-dirs-root",
+                        dest="working_dirs_root",
+                        default=None,
+                        help=("Directory to create working directories inside. "
+                              "(Default the working_dirs_root given to the coordinator)"))
+    parser.add_argument("--poll-period",
+                        dest="poll_period",
+                        type=float,
+                        default=1.0,
+                        help=("Time in seconds between checking the queue for new "
+                              "jobs and sending heartbeats (Default %(default)s)"))
+    parser.add_argument("queue", help="Job queue file created by batch-runner.py --queue")
+
+    pargs = parser.parse_args(args)
+    DriverUtil.handleLoggerArgs(pargs, parser)
+    _logger = logging.getLogger(__name__)
+
+    if pargs.jobs <= 0:
+        _logger.error('jobs must be > 0')
+        return 1
+
+    if not os.path.exists(pargs.queue):
+        _logger.error('Queue "{}" does not exist'.format(pargs.queue))
+        return 1
+
+    workerName = pargs.name
+    if workerName is None:
+        workerName = '{}:{}'.format(socket.gethostname(), os.getpid())
+    _logger.info('Starting worker "{}"'.format(workerName))
+
+    queue = JobQueue.JobQueue(pargs.queue)
+    queue.open()
+    try:
+        config = queue.getConfig()
+        workDirsRoot = pargs.working_dirs_root
+        if workDirsRoot is None:
+            workDirsRoot = queue.getWorkDirsRoot()
+        workDirsRoot = os.path.abspath(workDirsRoot)
+        if not os.path.isdir(workDirsRoot):
+            _logger.error('"{}" is not a directory'.format(workDirsRoot))
+            return 1
+        invocationInfoObjects = {
+            index: InvocationInfo.InvocationInfo(ii)
+            for index, ii in queue.getInvocationInfos().items()}
+
+        RunnerClass = RunnerFactory.getRunnerClass(config['runner'])
+        runner_ctx = RunnerContext.RunnerContext(num_parallel_jobs=pargs.jobs)
+        # Maps attempt to builder
+        builders = dict()
+        def getBuilder(attempt):
+            if attempt not in builders:
+                # A requeued job might still be being run by a worker that
+                # stopped sending heartbeats so each attempt gets its own
+                # working directories. A working directory for this
+                # attempt can only be left over from a previous run of
+                # this worker so it is safe to remove.
+                builders[attempt] = RunnerBuilder(
+                    RunnerClass,
+                    invocationInfoObjects,
+                    workDirsRoot,
+                    config['runner_config'],
+                    runner_ctx,
+                    removeExisting=True,
+                    workDirSuffix='' if attempt == 0 else '.attempt-{}'.format(attempt))
+            return builders[attempt]
+
+        signal.signal(signal.SIGINT, handleInterrupt)
+        signal.signal(signal.SIGTERM, handleInterrupt)
+
+        runningJobs = set()
+        lock = threading.Lock()
+        heartbeatThread = threading.Thread(
+            target=sendHeartbeats,
+            name='heartbeat',
+            args=(queue, workerName, runningJobs, lock, pargs.poll_period))
+        heartbeatThread.start()
+
+        numCompleted = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=pargs.jobs) as executor:
+            futureToJobs = {}
+            while not stopRequested.is_set():
+                # Only take a job from the queue when we have a free slot so
+                # that idle workers can take the rest.
+                queueEmpty = False
+                while len(futureToJobs) < pargs.jobs:
+                    claimed = queue.claimJob(workerName)
+                    if claimed is None:
+                        queueEmpty = True
+                        break
+                    jobId, indices, attempt = claimed
+                    _logger.info('Claimed job {} (indices {}, attempt {})'.format(
+                        jobId, indices, attempt))
+                    job = RunnerJob(
+                        indices,
+                        getBuilder(attempt),
+                        JobQueue.JobQueueResultSink(queue, jobId, workerName))
+                    with lock:
+                        runningJobs.add(job)
+                    futureToJobs[executor.submit(job.run)] = (jobId, job)
+                if queueEmpty and len(futureToJobs) == 0:
+                    state = queue.getState()
+                    if state != JobQueue.QUEUE_RUNNING:
+                        _logger.info('Queue is {}'.format(state))
+                        break
+                done, _ = concurrent.futures.wait(
+                    futureToJobs,
+                    timeout=pargs.poll_period,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    jobId, job = futureToJobs.pop(future)
+                    with lock:
+                        runningJobs.discard(job)
+                    excep = future.exception()
+                    if excep is not None:
+                        _logger.error('Job {} hit exception:\n{}'.format(
+                            jobId,
+                            "\n".join(traceback.format_exception(
+                                type(excep), excep, None))))
+                        queue.releaseJob(jobId, workerName)
+                        continue
+                    if stopRequested.is_set():
+                        # The job might have been killed part way through
+                        queue.releaseJob(jobId, workerName)
+                        continue
+                    queue.finishJob(jobId, workerName)
+                    numCompleted += future.result()
+                    _logger.info('Completed {} invocations'.format(numCompleted))
+            if len(futureToJobs) > 0:
+                _logger.warning('Stopping worker. Killing running jobs')
+            # This makes the heartbeat thread kill the running jobs
+            stopRequested.set()
+            for future, (jobId, _) in futureToJobs.items():
+                concurrent.futures.wait([future])
+                queue.releaseJob(jobId, workerName)
+    finally:
+        stopRequested.set()
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        queue.close()
+    heartbeatThread.join()
+    _logger.info('Worker "{}" finished. Completed {} invocations'.format(
+        workerName, numCompleted))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(entryPoint(sys.argv[1:]))
@@ -0,0 +1,215 @@
+/* vim: set sw=2 ts=2 softtabstop=2 expandtab: */
+/*
+ * Fork server used by the `BatchedNativeReplay` runner.
+ *
+ * This is loaded into a program linked against `libkleeRuntest.so` using
+ * `LD_PRELOAD`. When `KLEE_FORK_SERVER` is set in the environment, its
+ * constructor does not return. Instead it reads requests from file
+ * descriptor 8 and forks a child for each one. The child sets up the
+ * environment for the request and returns from the constructor, so the
+ * program runs normally. The parent waits for the child and reports
+ * the outcome on file descriptor 9. The program is only executed and
+ * dynamically linked once, however many test cases are replayed.
+ *
+ * Single digit descriptors are used because POSIX shells are only
+ * required to support redirecting descriptors 0 to 9.
+ *
+ * Each request is a line of tab separated fields:
+ *
+ *   <index> <ktest file> <log file> <GCOV_PREFIX or empty>
+ *
+ * and produces the following lines on the status file descriptor, which
+ * use the same format as the script generated by the runner.
+ *
+ *   start <index> <time>
+ *   timeout <index>
+ *   end <index> <exit code> <time>
+ *
+ * The exit code follows the shell convention. Death by signal N is
+ * reported as 128 + N. A child that exceeds `KLEE_FORK_SERVER_TIMEOUT`
+ * seconds is sent SIGTERM, then SIGKILL a second later. The `timeout`
+ * line is only written for such a child.
+ *
+ * Build with
+ *
+ *   cc -O2 -shared -fPIC -o libkleeforkserver.so klee_fork_server.c
+ */
+#define _GNU_SOURCE
+#include <errno.h>
+#include <fcntl.h>
+#include <signal.h>
+#include <stdarg.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#include <time.h>
+#include <unistd.h>
+
+#define REQUEST_FD 8
+#define STATUS_FD 9
+
+static volatile pid_t child_pid = -1;
+static volatile sig_atomic_t timed_out = 0;
+
+static void handle_alarm(int signum) {
+  (void) signum;
+  if (child_pid <= 0)
+    return;
+  if (!timed_out) {
+    timed_out = 1;
+    kill(child_pid, SIGTERM);
+    alarm(1);
+  } else {
+    kill(child_pid, SIGKILL);
+  }
+}
+
+static void report(const char *fmt, ...) __attribute__((format(printf, 1, 2)));
+
+static void report(const char *fmt, ...) {
+  char buffer[256];
+  va_list args;
+  int size;
+  va_start(args, fmt);
+  size = vsnprintf(buffer, sizeof(buffer), fmt, args);
+  va_end(args);
+  if (size > 0 && (size_t) size < sizeof(buffer)) {
+    /* Lines are short so a single write is atomic */
+    if (write(STATUS_FD, buffer, size) != size) {
+      perror("klee_fork_server: write");
+    }
+  }
+}
+
+static void now(char *buffer, size_t size) {
+  struct timespec ts;
+  clock_gettime(CLOCK_REALTIME, &ts);
+  snprintf(buffer, size, "%lld.%09ld", (long long) ts.tv_sec, ts.tv_nsec);
+}
+
+/* Split `line` in place on tabs. Returns the number of fields. */
+static int split(char *line, char **fields, int max_fields) {
+  int num_fields = 0;
+  char *p = line;
+  while (num_fields < max_fields) {
+    fields[num_fields++] = p;
+    p = strchr(p, '\t');
+    if (p == NULL)
+      break;
+    *p++ = '\0';
+  }
+  return num_fields;
+}
+
+static void run_child(char **fields) {
+  int log_fd;
+  signal(SIGALRM, SIG_DFL);
+  close(REQUEST_FD);
+  close(STATUS_FD);
+  if (setenv("KTEST_FILE", fields[1], 1) != 0)
+    _exit(127);
+  if (fields[3][0] != '\0') {
+    if (setenv("GCOV_PREFIX", fields[3], 1) != 0 ||
+        setenv("GCOV_PREFIX_STRIP", "0", 1) != 0)
+      _exit(127);
+  }
+  log_fd = open(fields[2], O_WRONLY | O_CREAT | O_TRUNC, 0644);
+  if (log_fd < 0) {
+    perror("klee_fork_server: open log");
+    _exit(127);
+  }
+  dup2(log_fd, STDOUT_FILENO);
+  dup2(log_fd, STDERR_FILENO);
+  close(log_fd);
+  /* Return to the constructor's caller so that `main()` runs */
+}
+
+__attribute__((constructor)) static void klee_fork_server(void) {
+  FILE *requests;
+  char *line = NULL;
+  size_t line_size = 0;
+  ssize_t length;
+  unsigned timeout = 0;
+  const char *timeout_str;
+  struct sigaction action;
+
+  if (getenv("KLEE_FORK_SERVER") == NULL)
+    return;
+  /* Children must not become fork servers */
+  unsetenv("KLEE_FORK_SERVER");
+
+  timeout_str = getenv("KLEE_FORK_SERVER_TIMEOUT");
+  if (timeout_str != NULL) {
+    timeout = (unsigned) strtoul(timeout_str, NULL, 10);
+    unsetenv("KLEE_FORK_SERVER_TIMEOUT");
+  }
+
+  memset(&action, 0, sizeof(action));
+  action.sa_handler = handle_alarm;
+  sigemptyset(&action.sa_mask);
+  sigaction(SIGALRM, &action, NULL);
+
+  requests = fdopen(REQUEST_FD, "r");
+  if (requests == NULL) {
+    perror("klee_fork_server: fdopen");
+    _exit(1);
+  }
+
+  while ((length = getline(&line, &line_size, requests)) != -1) {
+    char *fields[4];
+    char time_str[64];
+    int status;
+    int exit_code;
+    pid_t pid;
+
+    if (length > 0 && line[length - 1] == '\n')
+      line[length - 1] = '\0';
+    if (split(line, fields, 4) != 4) {
+      fprintf(stderr, "klee_fork_server: malformed request \"%s\"\n", line);
+      continue;
+    }
+
+    now(time_str, sizeof(time_str));
+    report("start %s %s\n", fields[0], time_str);
+    fflush(stdout);
+    fflush(stderr);
+    timed_out = 0;
+    pid = fork();
+    if (pid < 0) {
+      perror("klee_fork_server: fork");
+      _exit(1);
+    }
+    if (pid == 0) {
+      /* Don't use fclose() here because it might move the file offset
+       * that is shared with the server. */
+      run_child(fields);
+      free(line);
+      return;
+    }
+
+    child_pid = pid;
+    if (timeout > 0)
+      alarm(timeout);
+    while (waitpid(pid, &status, 0) < 0) {
+      if (errno != EINTR) {
+        perror("klee_fork_server: waitpid");
+        _exit(1);
+      }
+    }
+    alarm(0);
+    child_pid = -1;
+
+    if (timed_out)
+      report("timeout %s\n", fields[0]);
+    if (WIFSIGNALED(status))
+      exit_code = 128 + WTERMSIG(status);
+    else
+      exit_code = WEXITSTATUS(status);
+    now(time_str, sizeof(time_str));
+    report("end %s %d %s\n", fields[0], exit_code, time_str);
+  }
+  /* Don't run `main()` or any exit handlers in the server */
+  _exit(0);
+}
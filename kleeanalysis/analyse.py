@@ -287,20 +287,17 @@ def get_klee_verification_result(task, klee_dir, task_to_cex_map_fn, allow_inval
     # Note: Because we already would have exited early with KleeResultIncorrect
     # if there are any counter examples here they should not be for the task
     # we are currently considering.
-    assert len(task_to_cex_map_fn(task, klee_dir)) == 0
+    assert len(cexs_for_task) == 0
 
     # Compute the set of cexs that might not cause termination.
-    cexs_for_all_tasks = list(klee_dir.errors)
+    test_categories = klee_dir.test_categories
     non_terminating_cexs = []
     terminating_cexs = []
-    assertion_errors = list(klee_dir.assertion_errors)
-    abort_errors = list(klee_dir.abort_errors)
-    non_terminating_cexs = []
-    for cex in cexs_for_all_tasks:
-        if cex in assertion_errors:
+    for cex in test_categories.iterate("error"):
+        if test_categories.contains("assertion", cex):
             terminating_cexs.append(cex)
             continue
-        if cex in abort_errors:
+        if test_categories.contains("abort", cex):
             terminating_cexs.append(cex)
             continue
         non_terminating_cexs.append(cex)
@@ -0,0 +1,170 @@
+"""
+Cache of parsed KLEE working directories.
+
+Parsing thousands of KLEE directories is slow, particularly on network
+file systems, and the tools that analyse results do it on every
+invocation. A ``KleeDirCache`` is a SQLite database that stores the
+parsed ``Info``, "messages.txt", "warnings.txt" and the contents of every
+".early" and ".err" file of each KLEE directory it has seen.
+
+An entry is used only if the directory's fingerprint matches the one
+recorded when the entry was stored. The fingerprint is the number of
+entries in the directory, the modification time of the directory (which
+changes when files are added, removed or renamed) and the size and
+modification time of its "info" file. It does not detect files being
+modified in place, which KLEE does not do once it has finished.
+
+``KleeDir`` uses the cache set with ``set_default_cache()``.
+"""
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+
+import argparse
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+
+_logger = logging.getLogger(__name__)
+
+# Increment when the format of a stored summary changes
+_FORMAT_VERSION = 1
+
+_schema = """
+CREATE TABLE IF NOT EXISTS klee_dirs (
+    path TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    summary BLOB NOT NULL
+);
+"""
+
+def get_fingerprint(path, index):
+    """
+    Returns the fingerprint of the KLEE directory ``path``, which has
+    the ``KleeDirIndex`` ``index``, or None if it does not exist.
+    """
+    try:
+        dir_stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    info_size = None
+    info_mtime = None
+    if index.has_info:
+        try:
+            info_stat = os.stat(os.path.join(path, "info"))
+            info_size = info_stat.st_size
+            info_mtime = info_stat.st_mtime_ns
+        except FileNotFoundError:
+            pass
+    return json.dumps([
+        _FORMAT_VERSION,
+        index.num_entries,
+        dir_stat.st_mtime_ns,
+        info_size,
+        info_mtime,
+    ])
+
+class KleeDirSummary:
+    """
+    The parsed contents of a KLEE directory.
+
+    Attributes:
+        info -- the ``Info`` or None if it was missing or invalid
+        messages -- lines of "messages.txt"
+        warnings -- lines of "warnings.txt"
+        early_records -- map from test identifier to ``Early``
+        error_records -- map from test identifier to ``ErrorFile``
+    """
+    def __init__(self, info, messages, warnings, early_records, error_records):
+        self.info = info
+        self.messages = messages
+        self.warnings = warnings
+        self.early_records = early_records
+        self.error_records = error_records
+
+class KleeDirCache:
+    """
+    Wrapper around the cache database. An instance can be shared
+    between threads.
+    """
+    def __init__(self, db_path, busy_timeout=60.0):
+        self._db_path = db_path
+        self._lock = threading.Lock()
+        # Transactions are not needed. Each statement commits on its own.
+        self._conn = sqlite3.connect(
+            db_path,
+            timeout=busy_timeout,
+            isolation_level=None,
+            check_same_thread=False)
+        self._conn.executescript(_schema)
+
+    @property
+    def db_path(self):
+        return self._db_path
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def load(self, path, fingerprint):
+        """
+        Returns the ``KleeDirSummary`` stored for ``path`` if its
+        fingerprint matches ``fingerprint``, otherwise None.
+        """
+        if fingerprint is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT fingerprint, summary FROM klee_dirs WHERE path = ?',
+                (os.path.realpath(path),)).fetchone()
+        if row is None:
+            _logger.debug('No cache entry for "{}"'.format(path))
+            return None
+        if row[0] != fingerprint:
+            _logger.debug('Cache entry for "{}" is stale'.format(path))
+            return None
+        try:
+            return pickle.loads(row[1])
+        except Exception as e: # pylint: disable=broad-except
+            _logger.warning('Failed to load cache entry for "{}": {}'.format(path, e))
+            return None
+
+    def store(self, path, fingerprint, summary):
+        assert isinstance(summary, KleeDirSummary)
+        if fingerprint is None:
+            return
+        data = pickle.dumps(summary, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO klee_dirs (path, fingerprint, summary) VALUES (?, ?, ?)',
+                (os.path.realpath(path), fingerprint, data))
+        _logger.debug('Stored cache entry for "{}"'.format(path))
+
+_default_cache = None
+
+def set_default_cache(cache):
+    """Set the ``KleeDirCache`` (or None) used by ``KleeDir``"""
+    global _default_cache # pylint: disable=global-statement
+    assert cache is None or isinstance(cache, KleeDirCache)
+    _default_cache = cache
+
+def get_default_cache():
+    return _default_cache
+
+def parser_add_klee_dir_cache_arg(parser):
+    assert isinstance(parser, argparse.ArgumentParser)
+    parser.add_argument("--klee-dir-cache",
+        dest="klee_dir_cache",
+        default=None,
+        help=("SQLite database to cache parsed KLEE directories in. It is "
+              "created if it does not exist"))
+
+def handle_klee_dir_cache_arg(pargs):
+    assert isinstance(pargs, argparse.Namespace)
+    if pargs.klee_dir_cache is None:
+        return
+    _logger.info('Using KLEE directory cache "{}"'.format(pargs.klee_dir_cache))
+    set_default_cache(KleeDirCache(pargs.klee_dir_cache))
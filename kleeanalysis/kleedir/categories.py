@@ -0,0 +1,83 @@
+"""Index of the tests of a KLEE directory by category"""
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+
+import logging
+
+from .test import Test
+
+_logger = logging.getLogger(__name__)
+
+# The test attribute that is not None for tests in each error category
+ERROR_CATEGORIES = [
+    "abort",
+    "assertion",
+    "division",
+    "execution_error",
+    "free",
+    "misc_error",
+    "overflow",
+    "overshift",
+    "ptr",
+    "readonly_error",
+    "user_error",
+]
+
+CATEGORIES = ERROR_CATEGORIES + [
+    "early",
+    "error",
+    "successful_termination",
+]
+
+class TestCategories:
+    """
+    Tests grouped by category in a single pass over ``tests``.
+
+    Each category's tests are kept in the order they appear in ``tests``
+    along with a set for constant time membership checks. A test can be
+    in several categories (e.g. "assertion" and "error").
+    """
+    def __init__(self, tests):
+        self.source = tests
+        self.size = len(tests)
+        self._tests = {category: [] for category in CATEGORIES}
+        for test in tests:
+            for category in self._categories_of(test):
+                self._tests[category].append(test)
+        self._members = {
+            category: set(tests_in_category)
+            for category, tests_in_category in self._tests.items()
+        }
+        _logger.debug('Test categories: {}'.format(
+            {category: len(t) for category, t in self._tests.items()}))
+
+    @staticmethod
+    def _categories_of(test):
+        if isinstance(test, Test):
+            # This avoids reading the test's ".early" and ".err" files
+            return test.categories
+        return TestCategories._categories_from_attributes(test)
+
+    @staticmethod
+    def _categories_from_attributes(test):
+        if test.is_successful_termination:
+            yield "successful_termination"
+        if test.early is not None:
+            yield "early"
+        if test.error is not None:
+            yield "error"
+        for category in ERROR_CATEGORIES:
+            if getattr(test, category) is not None:
+                yield category
+
+    def get(self, category):
+        """Returns a new list of the tests in ``category``"""
+        return list(self._tests[category])
+
+    def iterate(self, category):
+        return iter(self._tests[category])
+
+    def count(self, category):
+        return len(self._tests[category])
+
+    def contains(self, category, test):
+        return test in self._members[category]
@@ -0,0 +1,251 @@
+"""Index of the files in a KLEE working directory"""
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+
+import collections
+import copy
+import logging
+import os
+import re
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+_RE_TEST_FILE = re.compile(r"^test(\d+)\.(.+)$")
+
+# Directory modification times within this many nanoseconds of when the
+# directory was listed do not show whether it changed afterwards. File
+# systems can have timestamps as coarse as 2 seconds (e.g. FAT).
+_RACY_WINDOW_NS = 2 * 10**9
+
+class KleeDirIndex:
+    """
+    Classifies every file in a KLEE working directory using a single
+    ``os.listdir()`` call so that tests can be built without probing the
+    file system for each of them.
+
+    Attributes:
+        path -- the KLEE directory
+        ktest_files -- sorted list of the ``.ktest`` file names
+        early_files -- map from test identifier to ``.early`` file name
+        error_files -- map from test identifier to ``.err`` file name
+        error_types -- map from test identifier to error type (e.g. "ptr")
+        pc_files -- map from test identifier to ``.pc`` file name
+        has_info -- True iff there is an "info" file
+        has_messages -- True iff there is a "messages.txt" file
+        has_warnings -- True iff there is a "warnings.txt" file
+        num_entries -- number of entries in the directory
+        early_records -- map from test identifier to ``Early`` for
+                         ".early" files whose contents are already known
+        error_records -- map from test identifier to ``ErrorFile`` for
+                         ".err" files whose contents are already known
+    """
+    def __init__(self, path: "Path to a KLEE working directory.",
+                 names: "Names of the entries in the directory. Listed if None." = None):
+        _logger.debug('Indexing KLEE directory "{}"'.format(path))
+        self.path = path
+        self.ktest_files = []
+        self.early_files = dict()
+        self.error_files = dict()
+        self.error_types = dict()
+        self.pc_files = dict()
+        self.has_info = False
+        self.has_messages = False
+        self.has_warnings = False
+        self.num_entries = 0
+        self.early_records = dict()
+        self.error_records = dict()
+
+        if names is None:
+            try:
+                names = os.listdir(path)
+            except FileNotFoundError:
+                # Treated the same as an empty directory. `KleeDir` reports
+                # the missing files.
+                _logger.debug('KLEE directory "{}" does not exist'.format(path))
+                names = []
+        for name in names:
+            self.num_entries += 1
+            self._add(name)
+        # Note: Tests should be returned in order so that all properties that use
+        # it (e.g. `abort_errors`) are also ordered.
+        self.ktest_files.sort()
+
+    def with_records(self, early_records, error_records):
+        """
+        Returns a copy of this index with the given ``early_records`` and
+        ``error_records``. The index itself may be shared so it is not
+        modified.
+        """
+        index = copy.copy(self)
+        index.early_records = dict(early_records)
+        index.error_records = dict(error_records)
+        return index
+
+    def _add(self, name):
+        if name == "info":
+            self.has_info = True
+            return
+        if name == "messages.txt":
+            self.has_messages = True
+            return
+        if name == "warnings.txt":
+            self.has_warnings = True
+            return
+        m = _RE_TEST_FILE.match(name)
+        if m is None:
+            return
+        identifier = int(m.group(1))
+        suffix = m.group(2)
+        if suffix == "ktest":
+            self.ktest_files.append(name)
+        elif suffix == "early":
+            self.early_files[identifier] = name
+        elif suffix == "pc":
+            self.pc_files[identifier] = name
+        elif suffix.endswith(".err"):
+            if identifier in self.error_files:
+                raise Exception("Identifier should not already be in the map")
+            self.error_files[identifier] = name
+            error_type = suffix[:-len(".err")]
+            self.error_types[identifier] = error_type[error_type.rfind(".")+1:]
+
+class KleeDirIndexCache:
+    """
+    Least recently used cache of ``KleeDirIndex`` objects holding at most
+    ``max_size`` of them. An instance can be shared between threads.
+
+    The modification time, size, link count and inode of a directory are
+    recorded when it is indexed. A cached index is discarded if any of
+    these have changed (i.e. files were added, removed or renamed) since
+    then. Timestamps are too coarse to show a change made just after the
+    directory was listed, so if it was modified shortly before being
+    listed the names of its entries are kept. They are compared with a
+    new listing until the modification time is old enough to be trusted.
+    """
+    def __init__(self, max_size):
+        assert isinstance(max_size, int)
+        assert max_size > 0
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        # Maps path to (stat key, KleeDirIndex, names or None)
+        self._entries = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._evictions = 0
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @staticmethod
+    def _get_stat_key(path):
+        try:
+            s = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (s.st_mtime_ns, s.st_size, s.st_nlink, s.st_ino)
+
+    @staticmethod
+    def _list(path):
+        """
+        Returns ``(names, racy)`` where ``racy`` is True iff the directory
+        was modified too recently for its stat key to show later changes.
+        """
+        # Time is read before listing so a change made during the listing
+        # is within the window.
+        list_time = int(time.time() * 10**9)
+        try:
+            names = os.listdir(path)
+        except FileNotFoundError:
+            return (None, False)
+        stat_key = KleeDirIndexCache._get_stat_key(path)
+        racy = stat_key is None or stat_key[0] + _RACY_WINDOW_NS >= list_time
+        return (names, racy)
+
+    def get(self, path):
+        """Returns the ``KleeDirIndex`` for ``path``"""
+        stat_key = self._get_stat_key(path)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == stat_key:
+            index, racy_names = entry[1], entry[2]
+            if racy_names is not None:
+                # The directory might have changed without its stat key
+                # changing.
+                names, racy = self._list(path)
+                if names is not None and frozenset(names) == racy_names:
+                    if not racy:
+                        racy_names = None
+                else:
+                    index = None
+            if index is not None:
+                with self._lock:
+                    if path in self._entries:
+                        self._entries[path] = (stat_key, index, racy_names)
+                        self._entries.move_to_end(path)
+                    self._hits += 1
+                return index
+        with self._lock:
+            if entry is not None:
+                _logger.debug('"{}" has changed since it was indexed'.format(path))
+                self._invalidations += 1
+                self._entries.pop(path, None)
+            self._misses += 1
+        # Index outside the lock so other directories can be looked up
+        # meanwhile. If two threads index the same directory the last
+        # one wins which is harmless.
+        names, racy = self._list(path)
+        index = KleeDirIndex(path, names)
+        racy_names = frozenset(names) if racy and names is not None else None
+        with self._lock:
+            self._entries[path] = (stat_key, index, racy_names)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        return index
+
+    def invalidate(self, path=None):
+        """Discard the index for ``path`` or all indexes if it is None"""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+
+    def resize(self, max_size):
+        assert isinstance(max_size, int)
+        assert max_size > 0
+        with self._lock:
+            self._max_size = max_size
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def stats(self):
+        """
+        Returns a dictionary with the current ``size`` and ``max_size``
+        and the number of ``hits``, ``misses``, ``invalidations`` and
+        ``evictions`` so far.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self._max_size,
+                "hits": self._hits,
+                "misses": self._misses,
+                "invalidations": self._invalidations,
+                "evictions": self._evictions,
+            }
+
+_index_cache = KleeDirIndexCache(max_size=64)
+
+def get_index_cache():
+    """Returns the ``KleeDirIndexCache`` used by ``KleeDir`` and ``Test``"""
+    return _index_cache
+
+def get_index(path):
+    """Returns the (possibly cached) ``KleeDirIndex`` for ``path``"""
+    return _index_cache.get(path)
@@ -1,17 +1,43 @@
 """Represent KLEE working directories"""
 # vim: set sw=4 ts=4 softtabstop=4 expandtab:
 
-import glob
+import collections.abc
 import logging
 import os
 import re
 
+from .cache import KleeDirSummary, get_default_cache, get_fingerprint
+from .categories import TestCategories
+from .index import get_index
 from .info import Info
 from .test import Test
 from ..exceptions import InputError
 
 _logger = logging.getLogger(__name__)
 
+class _TestSequence(collections.abc.Sequence):
+    """
+    The tests of a KLEE directory in order. Each ``Test`` is created
+    when it is first accessed and then kept so the same object is always
+    returned.
+    """
+    def __init__(self, path, index):
+        self._path = path
+        self._index = index
+        self._tests = [None] * len(index.ktest_files)
+
+    def __len__(self):
+        return len(self._tests)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+        test = self._tests[key]
+        if test is None:
+            test = Test(os.path.join(self._path, self._index.ktest_files[key]), self._index)
+            self._tests[key] = test
+        return test
+
 class KleeDir:
     """A KLEE working directory"""
 
@@ -21,21 +47,37 @@ class KleeDir:
         """
         _logger.debug('Creating KleeDir from "{}"'.format(path))
         self.path = path
-        try:
-            self.info = Info(os.path.join(path, "info"))
-        except InputError as ie:
-            _logger.debug(ie)
-            self.info = None
-        except FileNotFoundError as fne:
-            _logger.debug(fne)
-            _logger.error('Info file not found at \"{}\"'.format(os.path.join(path, "info")))
-            self.info = None
+        # Find all the files in one pass rather than probing for each test's files
+        index = get_index(path)
+        cache = get_default_cache()
+        fingerprint = None
+        summary = None
+        if cache is not None:
+            fingerprint = get_fingerprint(path, index)
+            summary = cache.load(path, fingerprint)
+        if summary is not None:
+            _logger.debug('Using cached summary of "{}"'.format(path))
+            self.info = summary.info
+            index = index.with_records(summary.early_records, summary.error_records)
+        else:
+            try:
+                if not index.has_info:
+                    raise FileNotFoundError(
+                        'No such file: \'{}\''.format(os.path.join(path, "info")))
+                self.info = Info(os.path.join(path, "info"))
+            except InputError as ie:
+                _logger.debug(ie)
+                self.info = None
+            except FileNotFoundError as fne:
+                _logger.debug(fne)
+                _logger.error('Info file not found at \"{}\"'.format(os.path.join(path, "info")))
+                self.info = None
 
         self._lost_test_cases = 0
 
         # Note: Tests should be returned in order so that all properties that use
         # it (e.g. `abort_errors`) are also ordered.
-        test_files = sorted(glob.glob(os.path.join(glob.escape(path), 'test*.ktest')))
+        test_files = index.ktest_files
         if self.is_valid:
             # Check the number of test matches what we expect
             if len(test_files) != self.info.tests:
@@ -63,13 +105,17 @@ class KleeDir:
                     self.path))
                 self._lost_test_cases += 1
 
-        self.tests = []
-        for test_file_path in test_files:
-            self.tests.append(Test(test_file_path))
+        self.tests = _TestSequence(path, index)
 
+        if summary is not None:
+            self.messages = summary.messages
+            self.warnings = summary.warnings
+            return
 
         messages_file_path = os.path.join(path, "messages.txt")
         try:
+            if not index.has_messages:
+                raise FileNotFoundError()
             with open(messages_file_path) as file:
                 self.messages = file.readlines()
         except FileNotFoundError:
@@ -78,6 +124,8 @@ class KleeDir:
                 'Failed to open "{}"'.format(messages_file_path))
         warnings_file_path = os.path.join(path, "warnings.txt")
         try:
+            if not index.has_warnings:
+                raise FileNotFoundError()
             with open(warnings_file_path) as file:
                 self.warnings = file.readlines()
         except FileNotFoundError:
@@ -85,6 +133,27 @@ class KleeDir:
             _logger.warning(
                 'Failed to open "{}"'.format(warnings_file_path))
 
+        if cache is not None:
+            self._store_summary(cache, fingerprint)
+
+    def _store_summary(self, cache, fingerprint):
+        # This reads every ".early" and ".err" file so later uses of the
+        # cache don't have to.
+        try:
+            early_records = {
+                test.identifier: test.early
+                for test in self.tests if test.is_early
+            }
+            error_records = {
+                test.identifier: test.error
+                for test in self.tests if test.is_error
+            }
+        except InputError as ie:
+            _logger.warning('Not caching "{}": {}'.format(self.path, ie))
+            return
+        cache.store(self.path, fingerprint, KleeDirSummary(
+            self.info, self.messages, self.warnings, early_records, error_records))
+
     @property
     def lost_test_cases(self):
         return self._lost_test_cases
@@ -103,74 +172,87 @@ class KleeDir:
         """If the KLEE directory is in a valid state"""
         return self.info is not None and not self.info.empty
 
+    @property
+    def test_categories(self):
+        """
+        Returns a ``TestCategories`` for ``self.tests``. It is built the
+        first time it is needed and rebuilt if tests are added.
+        """
+        categories = getattr(self, "_test_categories", None)
+        if (categories is None or categories.source is not self.tests or
+                categories.size != len(self.tests)):
+            categories = TestCategories(self.tests)
+            self._test_categories = categories
+        return categories
+
     @property
     def abort_errors(self):
         """Returns all abortions"""
-        return (test for test in self.tests if test.abort is not None)
+        return self.test_categories.iterate("abort")
 
     @property
     def assertion_errors(self):
         """Returns all assertion failures"""
-        return (test for test in self.tests if test.assertion is not None)
+        return self.test_categories.iterate("assertion")
 
     @property
     def division_errors(self):
         """Returns all division failures"""
-        return (test for test in self.tests if test.division is not None)
+        return self.test_categories.iterate("division")
 
     @property
     def execution_errors(self):
         """Returns all execution failures"""
-        return (test for test in self.tests if test.execution_error is not None)
+        return self.test_categories.iterate("execution_error")
 
     @property
     def free_errors(self):
         """Returns all use after free errors"""
-        return (test for test in self.tests if test.free is not None)
+        return self.test_categories.iterate("free")
 
     @property
     def overflow_errors(self):
         """Returns all overflow failures"""
-        return (test for test in self.tests if test.overflow is not None)
+        return self.test_categories.iterate("overflow")
 
     @property
     def overshift_errors(self):
         """Returns all overshift failures"""
-        return (test for test in self.tests if test.overshift is not None)
+        return self.test_categories.iterate("overshift")
 
     @property
     def ptr_errors(self):
         """Returns all derefence invalid ptr failures"""
-        return (test for test in self.tests if test.ptr is not None)
+        return self.test_categories.iterate("ptr")
 
     @property
     def read_only_errors(self):
         """Returns all user error failures"""
-        return (test for test in self.tests if test.readonly_error is not None)
+        return self.test_categories.iterate("readonly_error")
 
     @property
     def user_errors(self):
         """Returns all user error failures"""
-        return (test for test in self.tests if test.user_error is not None)
+        return self.test_categories.iterate("user_error")
 
     @property
     def early_terminations(self):
         """Returns all early terminations"""
-        return (test for test in self.tests if test.early is not None)
+        return self.test_categories.iterate("early")
 
     @property
     def successful_terminations(self):
         """Returns all terminations that terminated without error and
            are a complete execution (i.e. did not terminate early)
         """
-        return (test for test in self.tests if test.is_successful_termination)
+        return self.test_categories.iterate("successful_termination")
 
     @property
     def misc_errors(self):
         """Returns all uncategorized failures"""
-        return (test for test in self.tests if test.misc_error is not None)
+        return self.test_categories.iterate("misc_error")
 
     @property
     def errors(self):
         """Returns all tests for errors. This does not include early termination"""
-        return (test for test in self.tests if test.error is not None)
+        return self.test_categories.iterate("error")
@@ -3,9 +3,9 @@
 
 import os
 import re
-import glob
 import logging
 from collections import namedtuple
+from .index import get_index
 from ..exceptions import InputError
 
 _logger = logging.getLogger(__name__)
@@ -17,12 +17,15 @@ def _force_match(regex, line, message, path):
     return match
 
 Early = namedtuple("Early", ["message"])
+def _load_early(path):
+    with open(path) as file:
+        return Early(file.readlines())
+
 def _parse_early(path):
     """Load a .early file"""
     assert os.path.exists(os.path.dirname(path))
     try:
-        with open(path) as file:
-            return Early(file.readlines())
+        return _load_early(path)
     except FileNotFoundError:
         return None
 
@@ -32,28 +35,46 @@ _RE_ERROR = re.compile(r"Error: (.*)\r?\n")
 _RE_FILE = re.compile(r"File: (.*)\r?\n")
 _RE_LINE = re.compile(r"Line: (\d+)\r?\n")
 _RE_ASSEMBLY_LINE = re.compile(r"assembly.ll line: (\d+)\r?\n")
-_RE_ERROR_FILE = re.compile(r"^test(\d+)\.")
 _RE_KTEST_FILE = re.compile(r"^(test(\d+))\.ktest$")
 
+def _load_error(path):
+    with open(path) as file:
+        match = _force_match(_RE_ERROR, file.readline(), "{}: Invalid error message in line 1", path)
+        message = match.group(1)
+        match = _force_match(_RE_FILE, file.readline(), "{}: Invalid file in line 2", path)
+        filename = match.group(1)
+        match = _force_match(_RE_LINE, file.readline(), "{}: Invalid line number in line 3", path)
+        line = int(match.group(1))
+        match = _force_match(_RE_ASSEMBLY_LINE, file.readline(), "{}: Invalid assembly.ll line number in line 4", path)
+        assline = int(match.group(1))
+        if file.readline().rstrip() != "Stack:":
+            raise InputError("{}: Invalid begin stacktrace stack in line 5".format(path))
+        stack = file.readlines()
+        return ErrorFile(message, filename, line, assline, stack)
+
 def _parse_error(path):
     assert os.path.exists(os.path.dirname(path))
     try:
-        with open(path) as file:
-            match = _force_match(_RE_ERROR, file.readline(), "{}: Invalid error message in line 1", path)
-            message = match.group(1)
-            match = _force_match(_RE_FILE, file.readline(), "{}: Invalid file in line 2", path)
-            filename = match.group(1)
-            match = _force_match(_RE_LINE, file.readline(), "{}: Invalid line number in line 3", path)
-            line = int(match.group(1))
-            match = _force_match(_RE_ASSEMBLY_LINE, file.readline(), "{}: Invalid assembly.ll line number in line 4", path)
-            assline = int(match.group(1))
-            if file.readline().rstrip() != "Stack:":
-                raise InputError("{}: Invalid begin stacktrace stack in line 5".format(path))
-            stack = file.readlines()
-            return ErrorFile(message, filename, line, assline, stack)
+        return _load_error(path)
     except FileNotFoundError:
         return None
 
+# Maps error types (the part of the ".err" file name before the suffix)
+# to the attribute of `Test` for that type of error. Other types are
+# "misc" errors.
+_ERROR_TYPE_CATEGORIES = {
+    "abort": "abort",
+    "assert": "assertion",
+    "div": "division",
+    "exec": "execution_error",
+    "free": "free",
+    "overflow": "overflow",
+    "overshift": "overshift",
+    "ptr": "ptr",
+    "readonly": "readonly_error",
+    "user": "user_error",
+}
+
 class Test:
     """
     A KLEE test case
@@ -64,6 +85,10 @@ class Test:
         abort -- abortion error info (None if it did not happen)
         assertion -- assertion error info (None if it did not happen)
         division -- division error info (None if it did not happen)
+
+    Tests created from a ``KleeDirIndex`` know their category from the
+    file names. The ".early" and ".err" files are only parsed when their
+    contents are used so invalid files are reported at that point.
     """
     def __str__(self):
         msg = "Test {\n"
@@ -108,12 +133,18 @@ class Test:
             return "misc error"
         raise Exception('Unhandled test type')
 
-    def __init__(self, path: "path to ktest file"):
+    def __init__(self, path: "path to ktest file", index=None):
       # pylint: disable=too-many-branches
-        """Load a KLEE test case"""
+        """
+        Load a KLEE test case
+
+        If ``index`` (the ``KleeDirIndex`` of the KLEE directory containing
+        ``path``) is given then it is used to find the test's other files
+        instead of probing the file system.
+        """
         if not path.endswith('.ktest'):
             raise Exception('path is not a ktest file')
-        if not os.path.exists(path):
+        if index is None and not os.path.exists(path):
             raise Exception('{} does not exist'.format(path))
 
         # Get identifier and path stub
@@ -128,67 +159,133 @@ class Test:
         self.identifier = int(m.group(2))
         assert self.identifier >= 0
 
-        self.error = None
-        self.execution_error = None
-        self.abort = None
-        self.division = None
-        self.assertion = None
-        self.free = None
-        self.ptr = None
-        self.overshift = None
-        self.readonly_error = None
-        self.user_error = None
-        self.overflow = None
-        self.misc_error = None
-
         klee_dir_path = os.path.dirname(path)
-        assert os.path.exists(klee_dir_path)
+        _logger.debug('klee_dir_path: "{}"'.format(klee_dir_path))
+        self._early = None
+        self._error = None
+        self._error_type = None
+        # Paths of the ".early" and ".err" files that have not been
+        # read yet
+        self._early_path = None
+        self._error_path = None
+        if index is not None:
+            # The index says which files exist and the error type so the
+            # files only need to be read when their contents are used.
+            early_file = index.early_files.get(self.identifier)
+            if early_file is not None:
+                self._early = index.early_records.get(self.identifier)
+                if self._early is None:
+                    self._early_path = os.path.join(klee_dir_path, early_file)
+            error_file_path = index.error_files.get(self.identifier)
+            if error_file_path is not None:
+                self._error = index.error_records.get(self.identifier)
+                if self._error is None:
+                    self._error_path = os.path.join(klee_dir_path, error_file_path)
+                self._error_type = index.error_types[self.identifier]
+        else:
+            assert os.path.exists(klee_dir_path)
 
-        early_path = os.path.join(klee_dir_path, self.__pathstub) + ".early"
-        self.early = _parse_early(early_path) # FIXME: Mutually exclusive?
+            early_path = os.path.join(klee_dir_path, self.__pathstub) + ".early"
+            self._early = _parse_early(early_path) # FIXME: Mutually exclusive?
 
-        _logger.debug('klee_dir_path: "{}"'.format(klee_dir_path))
-        error_file_map = Test._get_error_file_map_for(klee_dir_path)
-        error_file_path = None
-        try:
-          error_file_path = error_file_map[self.identifier]
-        except KeyError:
-          # No error file
-          pass
-
-        if error_file_path is not None:
-            error = os.path.join(klee_dir_path, error_file_path)
-            if not os.path.exists(error):
-              raise Exception('Error file "{}" does not exist'.format(error))
-            self.error = _parse_error(error)
-            error = error[:-4]
-            error = error[error.rfind(".")+1:]
-            if error == "abort":
-                self.abort = self.error
-            elif error == "assert":
-                self.assertion = self.error
-            elif error == "div":
-                self.division = self.error
-            elif error == "exec":
-                self.execution_error = self.error
-            elif error == "free":
-                self.free = self.error
-            elif error == "overflow":
-                self.overflow = self.error
-            elif error == "overshift":
-                self.overshift = self.error
-            elif error == "ptr":
-                self.ptr = self.error
-            elif error == "readonly":
-                self.readonly_error = self.error
-            elif error == "user":
-                self.user_error = self.error
-            else:
-                self.misc_error = self.error
-
-            # Sanity check
-            if self.error:
-                assert self.early is None
+            error_file_map = Test._get_error_file_map_for(klee_dir_path)
+            error_file_path = None
+            try:
+              error_file_path = error_file_map[self.identifier]
+            except KeyError:
+              # No error file
+              pass
+
+            if error_file_path is not None:
+                error = os.path.join(klee_dir_path, error_file_path)
+                if not os.path.exists(error):
+                  raise Exception('Error file "{}" does not exist'.format(error))
+                self._error = _parse_error(error)
+                error = error[:-4]
+                self._error_type = error[error.rfind(".")+1:]
+
+        # Sanity check
+        if self.is_error:
+            assert not self.is_early
+
+    @property
+    def early(self):
+        """Early termination info (None if it did not happen)"""
+        if self._early_path is not None:
+            self._early = _load_early(self._early_path)
+            self._early_path = None
+        return self._early
+
+    @property
+    def error(self):
+        """Error info (None if it did not happen)"""
+        if self._error_path is not None:
+            self._error = _load_error(self._error_path)
+            self._error_path = None
+        return self._error
+
+    @property
+    def categories(self):
+        """
+        Names of the categories (see ``TestCategories``) this test is
+        in. The ".early" and ".err" files are not read.
+        """
+        if self.is_early:
+            return ["early"]
+        if self.is_error:
+            return ["error", _ERROR_TYPE_CATEGORIES.get(self._error_type, "misc_error")]
+        return ["successful_termination"]
+
+    def _error_of_type(self, error_type):
+        if self._error_type == error_type:
+            return self.error
+        return None
+
+    @property
+    def execution_error(self):
+        return self._error_of_type("exec")
+
+    @property
+    def abort(self):
+        return self._error_of_type("abort")
+
+    @property
+    def division(self):
+        return self._error_of_type("div")
+
+    @property
+    def assertion(self):
+        return self._error_of_type("assert")
+
+    @property
+    def free(self):
+        return self._error_of_type("free")
+
+    @property
+    def ptr(self):
+        return self._error_of_type("ptr")
+
+    @property
+    def overshift(self):
+        return self._error_of_type("overshift")
+
+    @property
+    def readonly_error(self):
+        return self._error_of_type("readonly")
+
+    @property
+    def user_error(self):
+        return self._error_of_type("user")
+
+    @property
+    def overflow(self):
+        return self._error_of_type("overflow")
+
+    @property
+    def misc_error(self):
+        if self._error_type in _ERROR_TYPE_CATEGORIES:
+            return None
+        return self.error
 
     @property
     def ktest_path(self):
@@ -200,7 +297,6 @@ class Test:
         """Path to the matching .pc file"""
         return self.__pathstub + ".pc"
 
-    _error_file_map_cache = dict()
     @classmethod
     def _get_error_file_map_for(cls, path):
       """
@@ -208,41 +304,21 @@ class Test:
         to error files for the particular
         `path` (a KLEE directory).
 
-        This is essentially a cache which
-        avoids traversing a KLEE directory
-        multiple times.
+        The directory's index is cached (see
+        `KleeDirIndexCache`) which avoids
+        traversing a KLEE directory multiple
+        times.
       """
-      # FIXME: There should be a lock on this!
-      error_file_map = None
-      try:
-        return cls._error_file_map_cache[path]
-      except KeyError:
-        # This KLEE directory has not been visited before
-        error_file_map = dict()
-        cls._error_file_map_cache[path] = error_file_map
-
-        # Initialise the map
-        errorFiles = glob.glob(os.path.join(glob.escape(path),'test*.*.err'))
-        for errorFileFullPath in errorFiles:
-          # Get identifier from the file name
-          basename = os.path.basename(errorFileFullPath)
-          m = _RE_ERROR_FILE.match(basename)
-          if m is None:
-            raise Exception('Could not get identifier from test file name')
-          identifier = int(m.group(1))
-          _logger.debug("Adding mapping [{}] => \"{}\"".format(
-            identifier,
-            basename))
-          if identifier in error_file_map:
-            raise Exception("Identifier should not already be in the map")
-          error_file_map[identifier] = basename
-
-      return error_file_map
+      return get_index(path).error_files
 
     @property
     def is_error(self):
-      return self.error is not None
+      return self._error is not None or self._error_path is not None
+
+    @property
+    def is_early(self):
+      return self._early is not None or self._early_path is not None
 
     @property
     def is_successful_termination(self):
-      return (not self.is_error) and (self.early is None)
+      return (not self.is_error) and (not self.is_early)
@@ -0,0 +1,434 @@
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from .exceptions import InputError
+from .kleedir import KleeDir
+from .kleedir import cache
+from .kleedir import index as kleedir_index
+from .kleedir.categories import CATEGORIES, TestCategories
+from .kleedir.index import KleeDirIndex, KleeDirIndexCache
+from .kleedir.test import Early, ErrorFile, Test
+
+_ERROR_FILE = """Error: memory error: out of bound pointer
+File: /src/main.c
+Line: 10
+assembly.ll line: 20
+Stack:
+\t#000000020 in main () at /src/main.c:10
+"""
+
+class KleeDirTestCase(unittest.TestCase):
+    """
+    Creates a temporary KLEE directory for each test.
+    """
+    @classmethod
+    def setUpClass(cls):
+        # So we can see debug output
+        logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='klee-runner-test-')
+        self.klee_dir = os.path.join(self.temp_dir, 'klee-out-0')
+        os.mkdir(self.klee_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_file(self, name, content=''):
+        with open(os.path.join(self.klee_dir, name), 'w') as f:
+            f.write(content)
+
+    def write_tests(self):
+        """
+        Write a test of each kind. Returns the names of their ktest files.
+        """
+        self.write_file('info')
+        self.write_file('test000001.ktest')
+        self.write_file('test000002.ktest')
+        self.write_file('test000002.early', 'Interrupted\n')
+        self.write_file('test000003.ktest')
+        self.write_file('test000003.ptr.err', _ERROR_FILE)
+        self.write_file('test000004.ktest')
+        self.write_file('test000004.assert.err', _ERROR_FILE)
+        self.write_file('test000005.ktest')
+        self.write_file('test000005.external.call.err', _ERROR_FILE)
+        return ['test00000{}.ktest'.format(i) for i in range(1, 6)]
+
+class KleeDirIndexTest(KleeDirTestCase):
+    def test_classification(self):
+        for name in [
+                'info',
+                'messages.txt',
+                'warnings.txt',
+                'assembly.ll',
+                'run.stats',
+                'test000002.ktest',
+                'test000001.ktest',
+                'test000001.pc',
+                'test000002.early',
+                'test000003.ktest',
+                'test000003.ptr.err',
+                'test000004.ktest',
+                # Extra dots before the error type
+                'test000004.external.call.err',
+                'test000005.ktest',
+                'test000005.assert.err',
+                'test000005.assert.err.bak',
+                'not_a_test000006.ktest']:
+            self.write_file(name)
+        index = KleeDirIndex(self.klee_dir)
+        self.assertEqual(index.path, self.klee_dir)
+        self.assertEqual(index.num_entries, 17)
+        self.assertTrue(index.has_info)
+        self.assertTrue(index.has_messages)
+        self.assertTrue(index.has_warnings)
+        # Sorted
+        self.assertEqual(index.ktest_files, [
+            'test000001.ktest',
+            'test000002.ktest',
+            'test000003.ktest',
+            'test000004.ktest',
+            'test000005.ktest'])
+        self.assertEqual(index.pc_files, {1: 'test000001.pc'})
+        self.assertEqual(index.early_files, {2: 'test000002.early'})
+        self.assertEqual(index.error_files, {
+            3: 'test000003.ptr.err',
+            4: 'test000004.external.call.err',
+            5: 'test000005.assert.err'})
+        self.assertEqual(index.error_types, {3: 'ptr', 4: 'call', 5: 'assert'})
+        self.assertEqual(index.early_records, {})
+        self.assertEqual(index.error_records, {})
+
+    def test_empty(self):
+        index = KleeDirIndex(self.klee_dir)
+        self.assertEqual(index.num_entries, 0)
+        self.assertFalse(index.has_info)
+        self.assertEqual(index.ktest_files, [])
+
+    def test_missing(self):
+        index = KleeDirIndex(os.path.join(self.temp_dir, 'missing'))
+        self.assertEqual(index.num_entries, 0)
+        self.assertFalse(index.has_info)
+        self.assertEqual(index.ktest_files, [])
+
+    def test_two_error_files(self):
+        self.write_file('test000001.ptr.err')
+        self.write_file('test000001.free.err')
+        with self.assertRaises(Exception):
+            KleeDirIndex(self.klee_dir)
+
+    def test_with_records(self):
+        self.write_file('test000001.ktest')
+        index = KleeDirIndex(self.klee_dir)
+        copy = index.with_records({1: 'early'}, {})
+        self.assertEqual(copy.early_records, {1: 'early'})
+        self.assertEqual(copy.ktest_files, index.ktest_files)
+        # The original is not modified
+        self.assertEqual(index.early_records, {})
+
+class LazyTestTest(KleeDirTestCase):
+    def make_test(self, name):
+        return Test(os.path.join(self.klee_dir, name), KleeDirIndex(self.klee_dir))
+
+    def test_records(self):
+        names = self.write_tests()
+        early = self.make_test(names[1]).early
+        self.assertIsInstance(early, Early)
+        self.assertEqual(early.message, ['Interrupted\n'])
+        error = self.make_test(names[2]).error
+        self.assertIs(type(error), ErrorFile)
+        self.assertEqual(error._fields, ErrorFile._fields)
+        self.assertEqual(error._asdict()['line'], 10)
+        self.assertEqual(error._replace(line=11).line, 11)
+        self.assertEqual(error.file, '/src/main.c')
+        self.assertEqual(error.assembly_line, 20)
+        self.assertEqual(len(error.stack), 1)
+
+    def test_same_as_without_index(self):
+        names = self.write_tests()
+        for name in names:
+            from_index = self.make_test(name)
+            probed = Test(os.path.join(self.klee_dir, name))
+            self.assertEqual(from_index.early, probed.early)
+            self.assertEqual(from_index.error, probed.error)
+            self.assertEqual(from_index.type_string, probed.type_string)
+            for attribute in ['ptr', 'assertion', 'misc_error', 'abort']:
+                self.assertEqual(getattr(from_index, attribute), getattr(probed, attribute))
+
+    def test_categories(self):
+        names = self.write_tests()
+        self.assertEqual(
+            [self.make_test(name).categories for name in names],
+            [['successful_termination'],
+             ['early'],
+             ['error', 'ptr'],
+             ['error', 'assertion'],
+             ['error', 'misc_error']])
+
+    def test_memoised(self):
+        names = self.write_tests()
+        test = self.make_test(names[2])
+        error = test.error
+        # Changes to the file are not seen once it has been read
+        self.write_file('test000003.ptr.err', 'invalid')
+        self.assertIs(test.error, error)
+        self.assertIs(test.ptr, error)
+
+    def test_parse_error_on_access(self):
+        self.write_file('test000001.ktest')
+        self.write_file('test000001.ptr.err', 'invalid')
+        self.write_file('test000002.ktest')
+        self.write_file('test000002.early', 'Interrupted\n')
+        test = self.make_test('test000001.ktest')
+        early_test = self.make_test('test000002.ktest')
+        # Nothing has been read so the category is known without an error
+        self.assertTrue(test.is_error)
+        self.assertFalse(test.is_early)
+        self.assertFalse(test.is_successful_termination)
+        self.assertEqual(test.categories, ['error', 'ptr'])
+        with self.assertRaises(InputError):
+            test.error
+        # The error is not memoised
+        with self.assertRaises(InputError):
+            test.ptr
+        # A file removed before it is read
+        os.remove(os.path.join(self.klee_dir, 'test000002.early'))
+        self.assertTrue(early_test.is_early)
+        with self.assertRaises(FileNotFoundError):
+            early_test.early
+
+class TestCategoriesTest(KleeDirTestCase):
+    def test_contents_and_order(self):
+        self.write_tests()
+        # Added out of order so the tests are sorted by the index
+        self.write_file('test000000.ktest')
+        self.write_file('test000000.ptr.err', _ERROR_FILE)
+        klee_dir = KleeDir(self.klee_dir)
+        tests = list(klee_dir.tests)
+        self.assertEqual(
+            [test.identifier for test in tests], [0, 1, 2, 3, 4, 5])
+        categories = klee_dir.test_categories
+        expected = {
+            'successful_termination': [1],
+            'early': [2],
+            'error': [0, 3, 4, 5],
+            'ptr': [0, 3],
+            'assertion': [4],
+            'misc_error': [5],
+        }
+        for category in CATEGORIES:
+            identifiers = [test.identifier for test in categories.iterate(category)]
+            self.assertEqual(identifiers, expected.get(category, []), category)
+            self.assertEqual(categories.count(category), len(identifiers))
+            for test in tests:
+                self.assertEqual(
+                    categories.contains(category, test),
+                    test.identifier in identifiers)
+        # The KleeDir properties use the categories
+        self.assertEqual([test.identifier for test in klee_dir.ptr_errors], [0, 3])
+        self.assertEqual([test.identifier for test in klee_dir.errors], [0, 3, 4, 5])
+        self.assertEqual(
+            [test.identifier for test in klee_dir.successful_terminations], [1])
+        # Categorising did not read the error files
+        self.assertTrue(all(test._error is None for test in tests if test.is_error))
+
+    def test_get_returns_copy(self):
+        self.write_tests()
+        categories = KleeDir(self.klee_dir).test_categories
+        ptr = categories.get('ptr')
+        ptr.clear()
+        self.assertEqual(categories.count('ptr'), 1)
+
+    def test_same_as_attributes(self):
+        self.write_tests()
+        for test in KleeDir(self.klee_dir).tests:
+            self.assertEqual(
+                sorted(TestCategories._categories_of(test)),
+                sorted(TestCategories._categories_from_attributes(test)))
+
+    def test_rebuilt_when_tests_change(self):
+        self.write_tests()
+        klee_dir = KleeDir(self.klee_dir)
+        categories = klee_dir.test_categories
+        self.assertIs(klee_dir.test_categories, categories)
+        klee_dir.tests = list(klee_dir.tests)[:2]
+        self.assertIsNot(klee_dir.test_categories, categories)
+        self.assertEqual(klee_dir.test_categories.count('error'), 0)
+
+class KleeDirCacheTest(KleeDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = cache.KleeDirCache(os.path.join(self.temp_dir, 'cache.db'))
+        cache.set_default_cache(self.cache)
+
+    def tearDown(self):
+        cache.set_default_cache(None)
+        self.cache.close()
+        super().tearDown()
+
+    def fingerprint(self):
+        return cache.get_fingerprint(self.klee_dir, KleeDirIndex(self.klee_dir))
+
+    def test_store_load(self):
+        summary = cache.KleeDirSummary(None, ['m\n'], ['w\n'], {1: Early(['x'])}, {})
+        self.assertIsNone(self.cache.load(self.klee_dir, self.fingerprint()))
+        self.cache.store(self.klee_dir, self.fingerprint(), summary)
+        loaded = self.cache.load(self.klee_dir, self.fingerprint())
+        self.assertEqual(loaded.messages, ['m\n'])
+        self.assertEqual(loaded.warnings, ['w\n'])
+        self.assertEqual(loaded.early_records, {1: Early(['x'])})
+        self.assertIsNone(self.cache.load(self.klee_dir, 'other'))
+        self.assertIsNone(self.cache.load(self.klee_dir, None))
+
+    def test_hit(self):
+        self.write_tests()
+        self.write_file('messages.txt', 'KLEE: HaltTimer invoked\n')
+        first = KleeDir(self.klee_dir)
+        self.assertEqual(first.tests[2].error.line, 10)
+        # Modifying a file in place is not detected so the cached
+        # contents are used.
+        self.write_file('messages.txt', '')
+        self.write_file('test000003.ptr.err', _ERROR_FILE.replace('Line: 10', 'Line: 11'))
+        self.assertEqual(self.cache.load(self.klee_dir, self.fingerprint()).messages,
+                         ['KLEE: HaltTimer invoked\n'])
+        second = KleeDir(self.klee_dir)
+        self.assertTrue(second.halt_timer_invoked)
+        error = second.tests[2].error
+        self.assertIs(type(error), ErrorFile)
+        self.assertEqual(error.line, 10)
+        self.assertIsInstance(second.tests[1].early, Early)
+        self.assertEqual(second.tests[1].early.message, ['Interrupted\n'])
+        self.assertEqual(
+            [test.identifier for test in second.ptr_errors], [3])
+
+    def test_miss_on_fingerprint_change(self):
+        self.write_tests()
+        KleeDir(self.klee_dir)
+        self.write_file('test000003.ptr.err', _ERROR_FILE.replace('Line: 10', 'Line: 11'))
+        old_fingerprint = self.fingerprint()
+        # Adding a file changes the fingerprint
+        self.write_file('test000006.ktest')
+        self.assertNotEqual(self.fingerprint(), old_fingerprint)
+        self.assertIsNone(self.cache.load(self.klee_dir, self.fingerprint()))
+        klee_dir = KleeDir(self.klee_dir)
+        self.assertEqual(len(klee_dir.tests), 6)
+        self.assertEqual(klee_dir.tests[2].error.line, 11)
+        # The new summary was stored
+        self.assertIsNotNone(self.cache.load(self.klee_dir, self.fingerprint()))
+
+    def test_invalid_error_file_not_cached(self):
+        self.write_file('info')
+        self.write_file('test000001.ktest')
+        self.write_file('test000001.ptr.err', 'invalid')
+        klee_dir = KleeDir(self.klee_dir)
+        self.assertIsNone(self.cache.load(self.klee_dir, self.fingerprint()))
+        with self.assertRaises(InputError):
+            klee_dir.tests[0].error
+
+class KleeDirIndexCacheTest(KleeDirTestCase):
+    def make_dirs(self, count):
+        paths = []
+        for i in range(0, count):
+            path = os.path.join(self.temp_dir, 'klee-out-{}'.format(i + 1))
+            os.mkdir(path)
+            paths.append(path)
+        return paths
+
+    def assertStats(self, index_cache, **expected):
+        stats = index_cache.stats()
+        self.assertEqual({k: stats[k] for k in expected}, expected)
+
+    def test_hit(self):
+        index_cache = KleeDirIndexCache(max_size=2)
+        index = index_cache.get(self.klee_dir)
+        self.assertIs(index_cache.get(self.klee_dir), index)
+        self.assertStats(index_cache, size=1, hits=1, misses=1)
+
+    def test_lru_eviction(self):
+        a, b, c = self.make_dirs(3)
+        index_cache = KleeDirIndexCache(max_size=2)
+        index_a = index_cache.get(a)
+        index_b = index_cache.get(b)
+        # Make `a` the most recently used so `b` is evicted
+        self.assertIs(index_cache.get(a), index_a)
+        index_cache.get(c)
+        self.assertStats(index_cache, size=2, evictions=1, hits=1, misses=3)
+        self.assertIs(index_cache.get(a), index_a)
+        self.assertIsNot(index_cache.get(b), index_b)
+        self.assertStats(index_cache, size=2, evictions=2, hits=2, misses=4)
+
+    def test_resize(self):
+        paths = self.make_dirs(3)
+        index_cache = KleeDirIndexCache(max_size=3)
+        indexes = [index_cache.get(path) for path in paths]
+        index_cache.resize(1)
+        self.assertStats(index_cache, size=1, max_size=1, evictions=2)
+        # Only the most recently used is kept
+        self.assertIs(index_cache.get(paths[2]), indexes[2])
+
+    def test_invalidated_by_change(self):
+        index_cache = KleeDirIndexCache(max_size=2)
+        index = index_cache.get(self.klee_dir)
+        self.assertEqual(index.ktest_files, [])
+        self.write_file('test000001.ktest')
+        index = index_cache.get(self.klee_dir)
+        self.assertEqual(index.ktest_files, ['test000001.ktest'])
+        self.assertStats(index_cache, size=1, invalidations=1, misses=2, hits=0)
+
+    def test_invalidated_by_change_with_same_stat(self):
+        # Timestamps are coarse and the size and link count of a directory
+        # need not change when a file is added.
+        index_cache = KleeDirIndexCache(max_size=2)
+        stat_key = (int(time.time() * 10**9), 4096, 2, 1)
+        with mock.patch.object(KleeDirIndexCache, '_get_stat_key', return_value=stat_key):
+            index = index_cache.get(self.klee_dir)
+            self.assertIs(index_cache.get(self.klee_dir), index)
+            self.write_file('test000001.ktest')
+            index = index_cache.get(self.klee_dir)
+        self.assertEqual(index.ktest_files, ['test000001.ktest'])
+        self.assertStats(index_cache, invalidations=1, misses=2, hits=1)
+
+    def get_later(self, index_cache, seconds):
+        # As if `seconds` have passed since the directory was modified
+        now = time.time() + seconds
+        with mock.patch.object(kleedir_index.time, 'time', return_value=now):
+            return index_cache.get(self.klee_dir)
+
+    def test_old_directory_not_listed(self):
+        index_cache = KleeDirIndexCache(max_size=2)
+        index = self.get_later(index_cache, 10)
+        with mock.patch('os.listdir', side_effect=AssertionError('listed')):
+            self.assertIs(index_cache.get(self.klee_dir), index)
+
+    def test_recently_modified_directory_listed_until_old(self):
+        index_cache = KleeDirIndexCache(max_size=2)
+        index = index_cache.get(self.klee_dir)
+        with mock.patch('os.listdir', wraps=os.listdir) as listdir_mock:
+            self.assertIs(index_cache.get(self.klee_dir), index)
+            self.assertEqual(listdir_mock.call_count, 1)
+            # The listing is trusted once the modification time is old
+            self.assertIs(self.get_later(index_cache, 10), index)
+            self.assertIs(index_cache.get(self.klee_dir), index)
+            self.assertEqual(listdir_mock.call_count, 2)
+        self.assertStats(index_cache, misses=1, hits=3, invalidations=0)
+
+    def test_invalidate(self):
+        a, b = self.make_dirs(2)
+        index_cache = KleeDirIndexCache(max_size=2)
+        index_a = index_cache.get(a)
+        index_b = index_cache.get(b)
+        index_cache.invalidate(a)
+        self.assertStats(index_cache, size=1)
+        self.assertIsNot(index_cache.get(a), index_a)
+        self.assertIs(index_cache.get(b), index_b)
+        index_cache.invalidate()
+        self.assertStats(index_cache, size=0)
+        self.assertIsNot(index_cache.get(b), index_b)
+        # Invalidating an unknown path does nothing
+        index_cache.invalidate(os.path.join(self.temp_dir, 'missing'))
@@ -22,6 +22,17 @@ fp_bench_tasks = {
     "no_reach_error_function",
 }
 
+# Maps each fp-bench task to the category (see `kleedir.categories`)
+# of the tests that are counter examples to it.
+fp_bench_task_to_test_category = {
+    "no_assert_fail": "assertion",
+    "no_integer_division_by_zero": "division",
+    "no_invalid_deref": "ptr",
+    "no_invalid_free": "free",
+    "no_overshift": "overshift",
+    "no_reach_error_function": "abort",
+}
+
 def get_cex_test_cases_for_fp_bench_task(task, klee_dir):
     """
         Returns a list of test cases that are counter examples
@@ -29,21 +40,10 @@ def get_cex_test_cases_for_fp_bench_task(task, klee_dir):
     """
     assert isinstance(task, str)
     assert isinstance(klee_dir, KleeDir)
-    test_cases = []
-    if task == "no_assert_fail":
-        test_cases.extend(klee_dir.assertion_errors)
-    elif task == "no_integer_division_by_zero":
-        test_cases.extend(klee_dir.division_errors)
-    elif task == "no_invalid_deref":
-        test_cases.extend(klee_dir.ptr_errors)
-    elif task == "no_invalid_free":
-        test_cases.extend(klee_dir.free_errors)
-    elif task == "no_overshift":
-        test_cases.extend(klee_dir.overshift_errors)
-    elif task == "no_reach_error_function":
-        test_cases.extend(klee_dir.abort_errors)
-    else:
+    try:
+        category = fp_bench_task_to_test_category[task]
+    except KeyError:
         raise Exception('Unknown task "{}"'.format(task))
-    return test_cases
+    return klee_dir.test_categories.get(category)
 
 
@@ -1,5 +1,7 @@
 # vim: set sw=4 ts=4 softtabstop=4 expandtab:
 from collections import namedtuple
+import gzip
+import io
 import logging
 import pprint
 import re
@@ -20,6 +22,25 @@ LibKleeRunTestError = namedtuple("LibKleeRunTestError", ["msg", "type"])
 
 LIB_KLEE_RUN_TEST_ERROR_MSG_RE = re.compile(r"KLEE_RUN_TEST_ERROR: (.+)$")
 
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+def open_log_file(path):
+    """
+        Open the log file at `path` for reading as text. Logs compressed
+        by the backend (gzip or zstd) are decompressed transparently.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(path, 'rt', errors='replace')
+    if magic.startswith(ZSTD_MAGIC):
+        import zstandard
+        return io.TextIOWrapper(
+            zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True),
+            errors='replace')
+    return open(path, 'r')
+
 def get_test_case_run_outcome(r):
     """
         Get an outcome for a run of a test case
@@ -47,7 +68,7 @@ def get_test_case_run_outcome(r):
     if r['exit_code'] == 1:
         log_file = r['log_file']
         _logger.debug('Opening log file "{}"'.format(log_file))
-        with open(log_file, 'r') as f:
+        with open_log_file(log_file) as f:
             for l in f:
                 libkleeruntest_error_match = LIB_KLEE_RUN_TEST_ERROR_MSG_RE.search(l)
                 if libkleeruntest_error_match:
@@ -64,7 +85,7 @@ def get_test_case_run_outcome(r):
         # FIXME: This only works when using PythonPsUtil as the backend
         log_file = r['log_file']
         _logger.debug('Opening log file "{}"'.format(log_file))
-        with open(log_file, 'r') as f:
+        with open_log_file(log_file) as f:
             for l in f:
                 assert_match = ASSERT_GDB_RE.search(l)
                 if assert_match:
@@ -182,7 +203,7 @@ def _get_outcome_attached_gdb(r):
     # For now assume we are looking for abort and assertion failures
     log_file = r['log_file']
     _logger.debug('Opening log file "{}"'.format(log_file))
-    with open(log_file, 'r') as f:
+    with open_log_file(log_file) as f:
         # Walk through the lines trying to find assertion message
         # e.g.
         # non_terminating_klee_bug.x86_64: /home/user/fp-bench/benchmarks/c/imperial/synthetic/non-terminating/non-terminating.c:65: main: Assertion `false' failed.
@@ -311,7 +332,7 @@ def _get_outcome_ubsan(r):
     # Look for runtime error
     log_file = r['log_file']
     _logger.debug('Opening log file "{}"'.format(log_file))
-    with open(log_file, 'r') as f:
+    with open_log_file(log_file) as f:
         for l in f:
             runtime_error_match = UBSAN_RUNTIME_ERROR_RE.search(l)
             if runtime_error_match:
@@ -406,7 +427,7 @@ def _get_outcome_asan(r):
     # AddressSanitizer: stack-buffer-overflow on address
     log_file = r['log_file']
     _logger.debug('Opening log file "{}"'.format(log_file))
-    with open(log_file, 'r') as f:
+    with open_log_file(log_file) as f:
         for l in f:
             asan_error_msg_match = ASAN_ERROR_MSG_RE.search(l)
             if asan_error_msg_match:
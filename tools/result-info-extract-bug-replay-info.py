@@ -16,6 +16,7 @@ add_nativeanalysis_to_module_search_path()
 from KleeRunner import ResultInfo
 import KleeRunner.DriverUtil as DriverUtil
 import KleeRunner.InvocationInfo
+import KleeRunner.ResultInfoUtil
 import KleeRunner.util
 import kleeanalysis.analyse
 import kleeanalysis.kleedir.test
@@ -62,8 +63,8 @@ def main(args):
     if resultInfoMisc is None:
         _logger.error('Expected result info to have misc data')
         return 1
-    if resultInfoMisc['runner'] != 'NativeReplay':
-        _logger.error('Expected runner to have been NativeReplay but was "{}"'.format(
+    if resultInfoMisc['runner'] not in ('NativeReplay', 'BatchedNativeReplay'):
+        _logger.error('Expected runner to have been NativeReplay or BatchedNativeReplay but was "{}"'.format(
             resultInfoMisc['runner']))
         return 1
 
@@ -82,9 +83,16 @@ def main(args):
         program_to_test_case_replay_info[program_name] = test_case_replay_info
         return test_case_replay_info
 
-    for result_index, r in enumerate(resultInfos):
-        _logger.info('Processing {}/{}'.format(result_index + 1, len(resultInfos)))
-        ii = r.RawInvocationInfo
+    # Results from BatchedNativeReplay contain several test cases
+    raw_results = []
+    for r in resultInfos:
+        raw_results.extend(
+            KleeRunner.ResultInfoUtil.expand_batched_native_replay_result(
+                r.GetInternalRepr()))
+
+    for result_index, raw_result in enumerate(raw_results):
+        _logger.info('Processing {}/{}'.format(result_index + 1, len(raw_results)))
+        ii = raw_result['invocation_info']
         program_path = ii['program']
         program_name = os.path.basename(program_path)
 
@@ -121,7 +129,7 @@ def main(args):
         test_case_obj = kleeanalysis.kleedir.test.Test(ktest_file)
 
         # Get the outcome of natively executing the test case
-        test_outcome = nativeanalysis.analyse.get_test_case_run_outcome(r.GetInternalRepr())
+        test_outcome = nativeanalysis.analyse.get_test_case_run_outcome(raw_result)
         _logger.debug('Got test case outcome: {}'.format(test_outcome))
 
         # Helper function
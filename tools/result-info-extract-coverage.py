@@ -14,6 +14,7 @@ add_kleeanalysis_to_module_search_path()
 from KleeRunner import ResultInfo
 import KleeRunner.DriverUtil as DriverUtil
 import KleeRunner.InvocationInfo
+import KleeRunner.ResultInfoUtil
 import KleeRunner.util
 import kleeanalysis.analyse
 import kleeanalysis.kleedir
@@ -79,8 +80,8 @@ def main(args):
     if resultInfoMisc is None:
         _logger.error('Expected result info to have misc data')
         return 1
-    if resultInfoMisc['runner'] != 'NativeReplay':
-        _logger.error('Expected runner to have been NativeReplay but was "{}"'.format(
+    if resultInfoMisc['runner'] not in ('NativeReplay', 'BatchedNativeReplay'):
+        _logger.error('Expected runner to have been NativeReplay or BatchedNativeReplay but was "{}"'.format(
             resultInfoMisc['runner']))
         return 1
 
@@ -129,8 +130,11 @@ def main(args):
     program_to_coverage_dir_map = dict()
     for result_index, r in enumerate(resultInfos):
         _logger.info('Processing {}/{}'.format(result_index + 1, len(resultInfos)))
-        result_ii = r.RawInvocationInfo
-        program_to_coverage_dir_map[result_ii['program']] = result_ii['coverage_dir']
+        # Results from BatchedNativeReplay contain several test cases
+        for raw_result in KleeRunner.ResultInfoUtil.expand_batched_native_replay_result(
+                r.GetInternalRepr()):
+            result_ii = raw_result['invocation_info']
+            program_to_coverage_dir_map[result_ii['program']] = result_ii['coverage_dir']
 
     _logger.info('Found {} coverage directories'.format(len(program_to_coverage_dir_map)))
 
@@ -24,6 +24,7 @@ import kleeanalysis.kleedir
 from kleeanalysis.kleedir import KleeDir
 from kleeanalysis import analyse
 import kleeanalysis.verificationtasks
+import kleeanalysis.kleedir.cache
 _logger = logging.getLogger(__name__)
 
 def handle_rejected_result_infos(rejected_result_infos, index_to_name_fn):
@@ -173,9 +174,11 @@ def main(argv):
        default=[]
     )
     DriverUtil.parserAddLoggerArg(parser)
+    kleeanalysis.kleedir.cache.parser_add_klee_dir_cache_arg(parser)
 
     args = parser.parse_args(args=argv)
     DriverUtil.handleLoggerArgs(args, parser)
+    kleeanalysis.kleedir.cache.handle_klee_dir_cache_arg(args)
 
     key_to_result_infos = None
     rejected_result_infos = None
@@ -21,6 +21,7 @@ import KleeRunner.util
 import kleeanalysis.analyse
 import kleeanalysis.verificationtasks
 import kleeanalysis.kleedir
+import kleeanalysis.kleedir.cache
 
 import argparse
 import logging
@@ -57,8 +58,10 @@ def main(args):
                         help='Output location (default stdout)')
 
     DriverUtil.parserAddLoggerArg(parser)
+    kleeanalysis.kleedir.cache.parser_add_klee_dir_cache_arg(parser)
     pargs = parser.parse_args()
     DriverUtil.handleLoggerArgs(pargs, parser)
+    kleeanalysis.kleedir.cache.handle_klee_dir_cache_arg(pargs)
 
     aug_spec_path_prefix = None
     aug_spec_path_replacement= None
@@ -84,7 +87,15 @@ def main(args):
         x['misc'] = {}
         return x
 
-    resultInfos, _  = ResultInfo.loadResultInfos(pargs.result_info_file)
+    resultInfos, resultInfoMisc  = ResultInfo.loadResultInfos(pargs.result_info_file)
+    # The KLEE directory of each result is needed. Replay results (including
+    # the per test case results inside BatchedNativeReplay results) do not
+    # have one.
+    if resultInfoMisc is not None and resultInfoMisc.get('runner', None) in (
+            'NativeReplay', 'BatchedNativeReplay'):
+        _logger.error('Expected results from KLEE runs but runner was "{}"'.format(
+            resultInfoMisc['runner']))
+        return 1
     coverage_dir_to_program_map = {} # For sanity checking
     coverage_dir_set = set() # For sanity checking
     for result_index, r in enumerate(resultInfos):
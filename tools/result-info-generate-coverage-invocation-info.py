@@ -8,7 +8,8 @@ generate an invocation info file to gather coverage
 from the generated ktest files.
 
 The generated invocation info file should be used with
-the NativeReplay runner
+the NativeReplay runner (or the BatchedNativeReplay runner if
+`--batch` is used)
 """
 from load_klee_runner import add_KleeRunner_to_module_search_path
 from load_klee_analysis import add_kleeanalysis_to_module_search_path
@@ -20,8 +21,10 @@ import KleeRunner.InvocationInfo
 import KleeRunner.util
 import kleeanalysis.analyse
 import kleeanalysis.kleedir
+import kleeanalysis.kleedir.cache
 
 import argparse
+import json
 import logging
 import os
 import pprint
@@ -32,6 +35,68 @@ import yaml
 _logger = logging.getLogger(__name__)
 
 
+def batch_jobs(jobs, sequential_execution_indices, coverage_mode, batch_size):
+    """
+    Merge jobs that only differ in their ktest file into jobs for the
+    BatchedNativeReplay runner that replay up to `batch_size` ktest files.
+
+    Returns a tuple `(batched_jobs, batched_sequential_execution_indices)`.
+    """
+    def get_key(job):
+        coverage_dir = job['coverage_dir']
+        if coverage_mode == 'testcase':
+            # Each test case keeps its own sub directory which is recorded
+            # in `ktest_coverage_dirs`.
+            coverage_dir = os.path.dirname(coverage_dir)
+        return json.dumps([
+            job['program'],
+            job['command_line_arguments'],
+            job['environment_variables'],
+            job['misc'],
+            coverage_dir], sort_keys=True)
+
+    if coverage_mode == 'testcase':
+        # All jobs are independent so can be batched together
+        groups = [[i for l in sequential_execution_indices for i in l]]
+    else:
+        # Only jobs that must run sequentially can be batched together
+        groups = sequential_execution_indices
+
+    batched_jobs = []
+    batched_sequential_execution_indices = []
+    for group in groups:
+        key_to_batch = {}
+        batch_indices = []
+        for index in group:
+            job = jobs[index]
+            key = get_key(job)
+            batch = key_to_batch.get(key, None)
+            if batch is None or len(batch['ktest_files']) >= batch_size:
+                batch = {
+                    'command_line_arguments': job['command_line_arguments'],
+                    'environment_variables': job['environment_variables'],
+                    'ktest_files': [],
+                    'coverage_dir': job['coverage_dir'],
+                    'program': job['program'],
+                    'misc': job['misc'],
+                }
+                if coverage_mode == 'testcase':
+                    batch['coverage_dir'] = os.path.dirname(job['coverage_dir'])
+                    batch['ktest_coverage_dirs'] = []
+                key_to_batch[key] = batch
+                batch_indices.append(len(batched_jobs))
+                batched_jobs.append(batch)
+            batch['ktest_files'].append(job['ktest_file'])
+            if coverage_mode == 'testcase':
+                batch['ktest_coverage_dirs'].append(
+                    os.path.basename(job['coverage_dir']))
+        if coverage_mode == 'testcase':
+            batched_sequential_execution_indices.extend([i] for i in batch_indices)
+        else:
+            batched_sequential_execution_indices.append(batch_indices)
+    return (batched_jobs, batched_sequential_execution_indices)
+
+
 def main(args):
     global _logger
     parser = argparse.ArgumentParser(description=__doc__)
@@ -60,9 +125,20 @@ def main(args):
         default=False,
         help='Skip over missing KLEE directories rather than emitting an error'
     )
+    parser.add_argument('--batch',
+        dest='batch_size',
+        type=int,
+        default=None,
+        help='Emit jobs for the BatchedNativeReplay runner that each replay up'
+        ' to this many test cases')
     DriverUtil.parserAddLoggerArg(parser)
+    kleeanalysis.kleedir.cache.parser_add_klee_dir_cache_arg(parser)
     pargs = parser.parse_args()
+    if pargs.batch_size is not None and pargs.batch_size < 1:
+        _logger.error('--batch must be >= 1')
+        return 1
     DriverUtil.handleLoggerArgs(pargs, parser)
+    kleeanalysis.kleedir.cache.handle_klee_dir_cache_arg(pargs)
 
     aug_spec_path_prefix = None
     aug_spec_path_replacement= None
@@ -137,7 +213,15 @@ def main(args):
         x['misc'] = {}
         return x
 
-    resultInfos, _  = ResultInfo.loadResultInfos(pargs.result_info_file)
+    resultInfos, resultInfoMisc  = ResultInfo.loadResultInfos(pargs.result_info_file)
+    # The KLEE directory of each result is needed. Replay results (including
+    # the per test case results inside BatchedNativeReplay results) do not
+    # have one.
+    if resultInfoMisc is not None and resultInfoMisc.get('runner', None) in (
+            'NativeReplay', 'BatchedNativeReplay'):
+        _logger.error('Expected results from KLEE runs but runner was "{}"'.format(
+            resultInfoMisc['runner']))
+        return 1
     coverage_dir_to_program_map = {} # For sanity checking
     coverage_dir_set = set() # For sanity checking
     for result_index, r in enumerate(resultInfos):
@@ -295,6 +379,16 @@ def main(args):
                 raise Exception('Should never happen')
             used_indices_set.add(i)
 
+    if pargs.batch_size is not None:
+        _logger.info('# of test cases: {}'.format(len(jobs)))
+        batched_jobs, batched_sequential_execution_indices = batch_jobs(
+            jobs,
+            sequential_execution_indices,
+            pargs.coverage_mode,
+            pargs.batch_size)
+        invocation_infos['jobs'] = jobs = batched_jobs
+        invocation_infos['misc']['sequential_execution_indices'] = batched_sequential_execution_indices
+
     # Report some stats
     _logger.info('# of invocations: {}'.format(len(jobs)))
     _logger.info('# of skipped test cases: {}'.format(skip_test_count))
@@ -505,6 +505,19 @@ def merge_result_infos(result_infos):
     wallclock_time_values = [r['wallclock_time'] for r in result_infos]
     merged_result_info['wallclock_time'] = wallclock_time_values
 
+    # merge other resource usage. Older result infos don't have these.
+    for key in KleeRunner.ResultInfoUtil.RESOURCE_USAGE_KEYS:
+        if key in ['user_cpu_time', 'sys_cpu_time']:
+            continue
+        merged_result_info[key] = [r.get(key, None) for r in result_infos]
+
+    # merge memory_accounting. Older result infos don't have this.
+    merged_result_info['memory_accounting'] = [r.get('memory_accounting', None) for r in result_infos]
+
+    # merge telemetry_file (only present if telemetry was recorded)
+    if any('telemetry_file' in r for r in result_infos):
+        merged_result_info['telemetry_file'] = [r.get('telemetry_file', None) for r in result_infos]
+
     # Add an attribute that hints that this is a merged result
     merged_result_info['merged_result'] = True
 
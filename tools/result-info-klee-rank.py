@@ -19,6 +19,7 @@ import KleeRunner.ResultInfoUtil
 import kleeanalysis
 import kleeanalysis.analyse
 import kleeanalysis.rank
+import kleeanalysis.kleedir.cache
 _logger = logging.getLogger(__name__)
 
 def handle_rejected_result_infos(rejected_result_infos, index_to_name_fn):
@@ -87,9 +88,11 @@ def main(argv):
         help="Information ranking algorithm of a minimum execution time difference for results to be considered distinguishable in addition to confidence boundary check",
     )
     DriverUtil.parserAddLoggerArg(parser)
+    kleeanalysis.kleedir.cache.parser_add_klee_dir_cache_arg(parser)
 
     args = parser.parse_args(args=argv)
     DriverUtil.handleLoggerArgs(args, parser)
+    kleeanalysis.kleedir.cache.handle_klee_dir_cache_arg(args)
 
     key_to_result_infos = None
     rejected_result_infos = None
@@ -19,6 +19,7 @@ import KleeRunner.DriverUtil as DriverUtil
 import kleeanalysis.analyse
 import kleeanalysis.verificationtasks
 import kleeanalysis.kleedir
+import kleeanalysis.kleedir.cache
 from kleeanalysis.kleedir import KleeDir
 from kleeanalysis.analyse import KleeRunnerResult, \
     raw_result_info_is_merged, \
@@ -62,9 +63,11 @@ def main(argv):
         help="Don't normalize merged results"
     )
     DriverUtil.parserAddLoggerArg(parser)
+    kleeanalysis.kleedir.cache.parser_add_klee_dir_cache_arg(parser)
 
     args = parser.parse_args(args=argv)
     DriverUtil.handleLoggerArgs(args, parser)
+    kleeanalysis.kleedir.cache.handle_klee_dir_cache_arg(args)
 
     exitCode = 0
     _logger.info('Reading result infos from {}'.format(args.result_info_file.name))
@@ -19,6 +19,7 @@ import KleeRunner.ResultInfo
 import KleeRunner.DriverUtil as DriverUtil
 import kleeanalysis.analyse
 import kleeanalysis.verificationtasks
+import kleeanalysis.kleedir.cache
 from kleeanalysis.analyse import KleeRunnerResult, \
     get_klee_verification_results_for_fp_bench, \
     get_klee_dir_verification_summary_across_tasks, \
@@ -72,9 +73,11 @@ def main(argv):
        default=[]
     )
     DriverUtil.parserAddLoggerArg(parser)
+    kleeanalysis.kleedir.cache.parser_add_klee_dir_cache_arg(parser)
 
     args = parser.parse_args(args=argv)
     DriverUtil.handleLoggerArgs(args, parser)
+    kleeanalysis.kleedir.cache.handle_klee_dir_cache_arg(args)
 
     exitCode = 0
     _logger.info('Reading result infos from {}'.format(args.result_info_file.name))
@@ -14,6 +14,7 @@ add_nativeanalysis_to_module_search_path()
 from KleeRunner import ResultInfo
 import KleeRunner.DriverUtil as DriverUtil
 import KleeRunner.InvocationInfo
+import KleeRunner.ResultInfoUtil
 import KleeRunner.util
 import nativeanalysis.analyse
 
@@ -51,8 +52,8 @@ def main(args):
     if resultInfoMisc is None:
         _logger.error('Expected result info to have misc data')
         return 1
-    if resultInfoMisc['runner'] != 'NativeReplay':
-        _logger.error('Expected runner to have been NativeReplay but was "{}"'.format(
+    if resultInfoMisc['runner'] not in ('NativeReplay', 'BatchedNativeReplay'):
+        _logger.error('Expected runner to have been NativeReplay or BatchedNativeReplay but was "{}"'.format(
             resultInfoMisc['runner']))
         return 1
 
@@ -60,16 +61,18 @@ def main(args):
     multipeOutcomeList = []
     for result_index, r in enumerate(resultInfos):
         _logger.info('Processing {}/{}'.format(result_index + 1, len(resultInfos)))
-        raw_result = r.GetInternalRepr()
         program_path = r.RawInvocationInfo['program']
-        outcome = nativeanalysis.analyse.get_test_case_run_outcome(raw_result)
-        error_list = None
-        try:
-            error_list = errorTypeToErrorListMap[type(outcome)]
-        except KeyError:
-            error_list = []
-            errorTypeToErrorListMap[type(outcome)] = error_list
-        error_list.append(outcome)
+        # Results from BatchedNativeReplay contain several test cases
+        for raw_result in KleeRunner.ResultInfoUtil.expand_batched_native_replay_result(
+                r.GetInternalRepr()):
+            outcome = nativeanalysis.analyse.get_test_case_run_outcome(raw_result)
+            error_list = None
+            try:
+                error_list = errorTypeToErrorListMap[type(outcome)]
+            except KeyError:
+                error_list = []
+                errorTypeToErrorListMap[type(outcome)] = error_list
+            error_list.append(outcome)
 
     # Print report
     print('#'*70)
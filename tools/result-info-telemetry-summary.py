@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+"""
+Summarise the telemetry recorded for each result in a result info
+file (see the `telemetry_interval` backend option).
+
+For each result the peak resident set size is shown, together with
+when it was reached as a percentage of the run time, the peak number
+of open files and the mean CPU use.
+"""
+from load_klee_runner import add_KleeRunner_to_module_search_path
+add_KleeRunner_to_module_search_path()
+from KleeRunner import DriverUtil
+from KleeRunner import ResultInfo
+from KleeRunner import Telemetry
+
+import argparse
+import logging
+import os
+import sys
+
+_logger = logging.getLogger(__name__)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    DriverUtil.parserAddLoggerArg(parser)
+    parser.add_argument('result_info_file',
+                        help='Result info file')
+
+    pargs = parser.parse_args(args)
+    DriverUtil.handleLoggerArgs(pargs, parser)
+
+    with open(pargs.result_info_file, 'r') as f:
+        resultInfos = ResultInfo.loadRawResultInfos(f)
+
+    print('# program, peak RSS (MiB), peak RSS time (% of run), peak open files, mean CPU (%)')
+    numMissing = 0
+    for r in resultInfos['results']:
+        telemetryFile = r.get('telemetry_file', None)
+        if not isinstance(telemetryFile, str) or not os.path.exists(telemetryFile):
+            numMissing += 1
+            continue
+        try:
+            telemetry = Telemetry.loadTelemetry(telemetryFile)
+        except Telemetry.TelemetryException as e:
+            _logger.error(e)
+            numMissing += 1
+            continue
+        if len(telemetry) == 0:
+            numMissing += 1
+            continue
+        wallclockTime = r.get('wallclock_time', None)
+        peakTimePercent = 'unknown'
+        if isinstance(wallclockTime, (int, float)) and wallclockTime > 0:
+            peakTimePercent = '{:.1f}'.format(
+                100.0 * telemetry.timeOfPeakRss / wallclockTime)
+        peakOpenFiles = max(telemetry.open_files)
+        if peakOpenFiles < 0:
+            # Not recorded by the backend
+            peakOpenFiles = 'unknown'
+        print('{}, {:.1f}, {}, {}, {:.1f}'.format(
+            r['invocation_info']['program'],
+            telemetry.peakRss,
+            peakTimePercent,
+            peakOpenFiles,
+            sum(telemetry.cpu_percent) / len(telemetry)))
+    if numMissing > 0:
+        _logger.warning('{} results have no telemetry'.format(numMissing))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# vim: set sw=4 ts=4 softtabstop=4 expandtab:
+"""
+Add the run times in existing result info files to a runtime history
+file that can be used by `batch-runner.py --runtime-history`.
+
+The config file must be the one used to produce the result info files
+because history entries are keyed by the runner configuration.
+"""
+from load_klee_runner import add_KleeRunner_to_module_search_path
+add_KleeRunner_to_module_search_path()
+from KleeRunner import DriverUtil
+from KleeRunner import ResultInfo
+from KleeRunner import RuntimeHistory
+
+import argparse
+import logging
+import sys
+
+_logger = logging.getLogger(__name__)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    DriverUtil.parserAddLoggerArg(parser)
+    parser.add_argument('config_file',
+                        help='Config file used to produce the result infos')
+    parser.add_argument('runtime_history',
+                        help='Runtime history file to update')
+    parser.add_argument('result_info_files',
+                        nargs='+',
+                        help='Result info files')
+
+    pargs = parser.parse_args(args)
+    DriverUtil.handleLoggerArgs(pargs, parser)
+
+    config, success = DriverUtil.loadRunnerConfig(pargs.config_file)
+    if not success:
+        return 1
+
+    history = RuntimeHistory.RuntimeHistory(pargs.runtime_history)
+    try:
+        history.load()
+    except RuntimeHistory.RuntimeHistoryException as e:
+        _logger.error(e)
+        return 1
+
+    for resultInfoFile in pargs.result_info_files:
+        _logger.info('Loading "{}"'.format(resultInfoFile))
+        with open(resultInfoFile, 'r') as f:
+            resultInfos = ResultInfo.loadRawResultInfos(f)
+        numSamples = 0
+        for r in resultInfos['results']:
+            numSamples += history.recordResult(
+                config['runner'], config['runner_config'], r)
+        _logger.info('Added {} samples from "{}"'.format(numSamples, resultInfoFile))
+
+    history.save()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))